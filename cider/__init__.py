@@ -1,5 +1,6 @@
+from .api import Api
 from .core import Cider
 
 __author__ = "Michael Sanders"
 __version__ = "1.1.12"
-__all__ = ["Cider"]
+__all__ = ["Api", "Cider"]
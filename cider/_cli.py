@@ -2,14 +2,19 @@
 from __future__ import absolute_import, print_function
 from . import __version__
 from . import _tty as tty
-from .core import Cider
+from ._daemon import DAEMON_COMMANDS, Daemon, forward, socket_path
+from ._history import RECORDED_COMMANDS, Recorder
+from ._metrics import Metrics
+from .core import Cider, completion_index, support_dir_for
 from subprocess import CalledProcessError
 from webbrowser import open as urlopen
 import click
+import os
 import sys
+import time
 
 from .exceptions import (
-    BrewMissingError, CiderException, ParserError
+    BrewMissingError, CiderException, DaemonError, ParserError
 )
 
 CONTEXT_SETTINGS = {"help_option_names": ['-h', '--help']}
@@ -32,14 +37,25 @@ class CLI(click.Group):
             "{0} set-default [-g] NAME KEY VALUE",
             "{0} remove-default [-g] NAME KEY",
             "{0} addlink NAME ITEM...",
-            "{0} unlink NAME",
+            "{0} unlink NAME...",
             "{0} set-icon APP ICON",
             "{0} remove-icon APP",
             "{0} apply-defaults",
             "{0} apply-icons",
             "{0} run-scripts",
-            "{0} restore",
+            "{0} restore [-j JOBS] [--resume] [--no-lock] [--no-update]",
+            "{0} restore --offline [--mirror DIR]",
+            "{0} lock",
+            "{0} status [--json]",
             "{0} relink",
+            "{0} sync [--dry-run] [--force] [REV_RANGE]",
+            "{0} watch [--poll] [--debounce SECONDS]",
+            "{0} provision [-j JOBS] [--scripts] HOME...",
+            "{0} completion",
+            "{0} history [--json] [-n LIMIT] [COMMAND]",
+            "{0} daemon [--poll] [--socket PATH]",
+            "{0} --output=ndjson COMMAND...",
+            "{0} --metrics-dir DIR COMMAND...",
         ]
 
         basename = ctx.command_path
@@ -64,14 +80,61 @@ def print_version(ctx, param, value):  # pylint: disable=W0613
     ctx.exit()
 
 
+def set_metrics_dir(ctx, param, value):  # pylint: disable=W0613
+    if value is not None and not ctx.resilient_parsing:
+        tty.add_listener(Metrics(value))
+    return value
+
+
+def split_commas(ctx, param, value):  # pylint: disable=W0613
+    return [item.strip() for option in value
+            for item in option.split(",") if item.strip()]
+
+
+def _completer(kind):
+    # Runs on every keypress, so it only opens the prebuilt index rather
+    # than setting up a Cider (which reads the bootstrap).
+    def complete(ctx, args, incomplete):  # pylint: disable=W0613
+        try:
+            return completion_index(
+                support_dir_for(os.path.expanduser("~"))
+            ).query(kind, incomplete)
+        except Exception:  # pylint: disable=W0703
+            return []
+    return complete
+
+
+def set_output(ctx, param, value):  # pylint: disable=W0613
+    tty.set_output(value)
+    return value
+
+
 @click.group(cls=CLI, context_settings=CONTEXT_SETTINGS)
 @click.option("-d", "--debug", is_flag=True)
 @click.option("-v", "--verbose", is_flag=True)
 @click.option("--version", is_flag=True, callback=print_version,
               expose_value=False, is_eager=True)
+@click.option("--output", type=click.Choice(tty.OUTPUT_MODES),
+              default=tty.TEXT, callback=set_output, expose_value=False,
+              is_eager=True, help="Output format (ndjson streams events).")
+@click.option("--metrics-dir", type=click.Path(file_okay=False),
+              envvar="CIDER_METRICS_DIR", callback=set_metrics_dir,
+              expose_value=False, is_eager=True,
+              help="Write Prometheus textfile metrics here after the run.")
 @click.pass_context
 def cli(ctx, debug, verbose):
-    ctx.obj = Cider(False, debug, verbose)
+    tty.event("command_started", command=ctx.invoked_subcommand,
+              argv=sys.argv[1:])
+    # `cider daemon` passes in a factory for Ciders sharing its warm state.
+    ctx.meta["cider.factory"] = ctx.obj if ctx.obj is not None else Cider
+    ctx.obj = ctx.meta["cider.factory"](False, debug, verbose)
+    _defer_completion(ctx)
+
+
+def _defer_completion(ctx):
+    # Rebuild the completion index once per command, not once per edit.
+    ctx.obj.defer_completion()
+    ctx.call_on_close(ctx.obj.flush_completion)
 
 
 @cli.command()
@@ -100,7 +163,9 @@ def cask(ctx, command, args, force=None):
         supported_args = args_by_cmd.get(command, [])
         kwargs = {k: v for k, v in kwargs.items() if k in supported_args}
         cmd = cli.commands.get(command)
-        ctx.obj = Cider(True, ctx.obj.debug, ctx.obj.verbose)
+        ctx.obj = ctx.meta["cider.factory"](True, ctx.obj.debug,
+                                            ctx.obj.verbose)
+        _defer_completion(ctx)
         ctx.invoke(cmd, **kwargs)
     else:
         raise click.ClickException("No such command \"{0}\"".format(command))
@@ -109,12 +174,51 @@ def cask(ctx, command, args, force=None):
 @cli.command()
 @click.pass_obj
 @click.option("-i", "--ignore-errors", is_flag=True)
-def restore(cider, ignore_errors):
-    cider.restore(ignore_errors=ignore_errors)
+@click.option("-j", "--jobs", type=int,
+              help="Number of restore steps to run at once.")
+@click.option("--resume", is_flag=True,
+              help="Skip steps completed by an interrupted restore.")
+@click.option("--lock/--no-lock", "use_lock", default=True,
+              help="Skip entries already matching bootstrap.lock.")
+@click.option("--mirror", type=click.Path(file_okay=False),
+              help="Shared directory of downloads to install from.")
+@click.option("--offline", is_flag=True,
+              help="Install only from the mirror.")
+@click.option("--no-update", is_flag=True,
+              help="Don't update brew first.")
+@click.option("--only", multiple=True, callback=split_commas,
+              help="Restore only these sections or steps, e.g. "
+              "links,defaults or casks/firefox.")
+@click.option("--skip", multiple=True, callback=split_commas,
+              help="Don't restore these sections or steps.")
+@click.option("-t", "--tag", "tags", multiple=True, callback=split_commas,
+              help="Restore only entries tagged so in bootstrap.yaml.")
+def restore(cider, ignore_errors, jobs=None, resume=None, use_lock=None,
+            mirror=None, offline=None, no_update=None, only=None, skip=None,
+            tags=None):
+    cider.restore(ignore_errors=ignore_errors, jobs=jobs, resume=resume,
+                  use_lock=use_lock, mirror=mirror, offline=offline,
+                  no_update=no_update, only=only, skip=skip, tags=tags)
 
 
 @cli.command()
-@click.argument("formulas", nargs=-1, required=True)
+@click.pass_obj
+def lock(cider):
+    cider.lock()
+
+
+@cli.command()
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the report as JSON.")
+@click.pass_obj
+def status(cider, as_json=None):
+    if cider.print_status(as_json=as_json):
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument("formulas", nargs=-1, required=True,
+                autocompletion=_completer("formula"))
 @click.option("-f", "--force", is_flag=True)
 @click.pass_obj
 def install(cider, formulas, force=None):
@@ -122,7 +226,8 @@ def install(cider, formulas, force=None):
 
 
 @cli.command()
-@click.argument("formulas", nargs=-1, required=True)
+@click.argument("formulas", nargs=-1, required=True,
+                autocompletion=_completer("bootstrap-formula"))
 @click.pass_obj
 def rm(cider, formulas):
     cider.rm(*formulas)
@@ -139,7 +244,7 @@ def tap(cider, tap):
 
 
 @cli.command()
-@click.argument("tap")
+@click.argument("tap", autocompletion=_completer("tap"))
 @click.pass_obj
 def untap(cider, tap):
     cider.untap(tap)
@@ -152,8 +257,43 @@ def relink(cider, force=None):
     cider.relink(force=force)
 
 
+@cli.command()
+@click.argument("homes", nargs=-1, required=True)
+@click.option("-f", "--force", is_flag=True)
+@click.option("--scripts", is_flag=True,
+              help="Also run before/after scripts in each home.")
+@click.option("-j", "--jobs", type=int,
+              help="Number of homes to provision at once.")
+@click.pass_obj
+def provision(cider, homes, force=None, scripts=None, jobs=None):
+    if cider.provision(homes, force=force, scripts=scripts, jobs=jobs):
+        sys.exit(1)
+
+
+@cli.command()
+@click.option("-f", "--force", is_flag=True)
+@click.option("--poll", is_flag=True,
+              help="Poll for changes instead of using inotify.")
+@click.option("--debounce", type=float,
+              help="Seconds to wait for a burst of changes to settle.")
+@click.pass_obj
+def watch(cider, force=None, poll=None, debounce=None):
+    cider.watch(force=force, debounce=debounce, poll=poll)
+
+
+@cli.command()
+@click.argument("rev_range", required=False)
+@click.option("-f", "--force", is_flag=True)
+@click.option("-n", "--dry-run", is_flag=True,
+              help="List the steps without running them.")
+@click.pass_obj
+def sync(cider, rev_range=None, force=None, dry_run=None):
+    cider.sync(rev_range, force=force, dry_run=dry_run)
+
+
 @cli.command("list")
-@click.argument("formula", required=False)
+@click.argument("formula", required=False,
+                autocompletion=_completer("bootstrap-formula"))
 @click.pass_obj
 def ls(cider, formula):
     cider.ls(formula)
@@ -166,7 +306,7 @@ def missing(cider):
 
 
 @cli.command("set-default")
-@click.argument("name")
+@click.argument("name", autocompletion=_completer("domain"))
 @click.argument("key")
 @click.argument("value")
 @click.option("-g", "--globalDomain", is_flag=True)
@@ -189,7 +329,7 @@ def set_default(cider, name, key, value, globaldomain=None, force=None):
 
 @cli.command("remove-default")
 @click.option("-g", "--globalDomain", is_flag=True)
-@click.argument("name")
+@click.argument("name", autocompletion=_completer("domain"))
 @click.argument("key", required=False)
 @click.pass_obj
 def remove_default(cider, name, key, globaldomain=None):
@@ -205,7 +345,7 @@ def apply_defaults(cider):
 
 
 @cli.command("set-icon")
-@click.argument("app")
+@click.argument("app", autocompletion=_completer("icon"))
 @click.argument("icon")
 @click.pass_obj
 def set_icon(cider, app, icon):
@@ -213,7 +353,7 @@ def set_icon(cider, app, icon):
 
 
 @cli.command("remove-icon")
-@click.argument("app")
+@click.argument("app", autocompletion=_completer("icon"))
 @click.pass_obj
 def remove_icon(cider, app):
     cider.remove_icon(app)
@@ -232,7 +372,7 @@ def run_scripts(cider):
 
 
 @cli.command("addlink")
-@click.argument("name")
+@click.argument("name", autocompletion=_completer("stow"))
 @click.argument("items", nargs=-1, required=True)
 @click.pass_obj
 def addlink(cider, name, items):
@@ -240,26 +380,111 @@ def addlink(cider, name, items):
 
 
 @cli.command("unlink")
-@click.argument("name")
+@click.argument("names", nargs=-1, required=True,
+                autocompletion=_completer("stow"))
 @click.pass_obj
-def unlink(cider, name):
-    cider.unlink(name)
+def unlink(cider, names):
+    cider.unlink(*names)
+
+
+@cli.command()
+@click.argument("command", required=False, default="restore",
+                type=click.Choice(RECORDED_COMMANDS))
+@click.option("-n", "--limit", type=click.IntRange(1), default=10,
+              help="Number of runs to show.")
+@click.option("--json", "as_json", is_flag=True)
+@click.pass_obj
+def history(cider, command, limit=None, as_json=None):
+    cider.print_history(command, limit, as_json=as_json)
+
+
+@cli.command()
+@click.pass_obj
+def completion(cider):
+    cider.refresh_completion()
+
+
+@cli.command()
+@click.option("--socket", "path", type=click.Path(dir_okay=False),
+              help="Where to listen (default: $CIDER_SOCKET).")
+@click.option("--poll", is_flag=True,
+              help="Poll for changes instead of using inotify.")
+def daemon(path=None, poll=None):
+    # Answers DAEMON_COMMANDS for other invocations (see main), keeping
+    # config and brew state in memory between them.
+    Daemon(path or socket_path(), _run, poll).serve()
 
 
 def main():
+    args = sys.argv[1:]
+    if _forwardable(args):
+        try:
+            exit_code = forward(socket_path(), args)
+        except DaemonError as e:
+            tty.puterr(e, prefix="Error:")
+            sys.exit(e.exit_code)
+        if exit_code is not None:
+            sys.exit(exit_code)
+    _run(args)
+
+
+def _forwardable(args):
+    """
+    Whether a running daemon (see `cider daemon`) could answer `args`.
+    """
+    if os.environ.get("CIDER_NO_DAEMON"):
+        return False
+    try:
+        ctx = cli.make_context("cider", list(args), resilient_parsing=True)
+    except click.ClickException:
+        return False
+    command = ctx.protected_args + ctx.args
+    if command[:1] == ["cask"]:
+        command = command[1:]
+    return bool(command) and command[0] in DAEMON_COMMANDS
+
+
+def _run(args, factory=None):
+    factory = factory if factory is not None else Cider
+    start = time.time()
+    exit_code = 0
+    # Resolved only once the run finishes, so a broken bootstrap is
+    # reported by the command itself.
+    recorder = Recorder(lambda: factory().history)
+    tty.add_listener(recorder)
     try:
-        cli.main(standalone_mode=False)
+        _main(args, factory)
+    except SystemExit as e:
+        exit_code = e.code
+        raise
+    except BaseException:
+        # e.g. an OSError from a step, which _main doesn't turn into an
+        # exit.
+        exit_code = 1
+        raise
+    finally:
+        tty.event("command_finished", exit_code=exit_code,
+                  duration=round(time.time() - start, 3))
+        tty.remove_listener(recorder)
+
+
+def _main(args=None, factory=None):
+    try:
+        cli.main(args=args, prog_name="cider", obj=factory,
+                 standalone_mode=False)
     except CalledProcessError as e:
         tty.puterr("`{0}` failed with code {1}".format(
             " ".join(e.cmd),
             e.returncode
         ))
+        sys.exit(1)
     except ParserError as e:
         tty.puterr("Error reading {0} at {1}: {2}".format(
             e.filetype,
             e.filepath,
             e
         ))
+        sys.exit(e.exit_code)
     except BrewMissingError as e:
         print("Next, install Homebrew (press any key to redirect)")
         click.getchar()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from ._sh import mkdir_p, read_config, write_config
+import errno
+import io
+import mmap
+import os
+
+# Each line of the index is "<kind>\t<name>\t<source>\n", sorted, so every
+# kind is a contiguous run and names sharing a prefix are adjacent.
+_SEP = b"\t"
+
+# Where taps keep their formulas and casks.
+_TAP_DIRS = (("Formula", "formula"), ("HomebrewFormula", "formula"),
+             ("Casks", "cask"))
+
+
+class CompletionIndex(object):
+    """
+    Sorted on-disk index of names to complete (formulas, casks, stow
+    names, defaults domains, ...), answering prefix queries by binary
+    search over a memory-mapped file.
+
+    Every name comes from a source: a (source_id, key, reader) tuple where
+    `key` changes whenever the source does (e.g. its mtime or git HEAD)
+    and `reader` is a generator of (kind, name). Refreshing only reads
+    sources whose key changed; names from the others are carried over
+    from the previous index.
+    """
+    def __init__(self, path, keys_file):
+        self.path = path
+        self.keys_file = keys_file
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def refresh(self, sources):
+        """
+        Brings the index up to date with `sources`. Returns the ids of the
+        sources that were (re)read.
+        """
+        old_keys = read_config(self.keys_file, {}) if self.exists() else {}
+        keys = dict((source_id, key) for source_id, key, _ in sources)
+        changed = [source for source in sources
+                   if old_keys.get(source[0]) != source[1]]
+        if not changed and set(old_keys) == set(keys):
+            return []
+
+        reread = set(source_id for source_id, _, _ in changed)
+        lines = set()
+        for line in self._lines():
+            source_id = line.rsplit(_SEP, 1)[-1].decode("utf-8")
+            if source_id in keys and source_id not in reread:
+                lines.add(line)
+        for source_id, _, reader in changed:
+            for kind, name in reader():
+                if name and "\t" not in name and "\n" not in name:
+                    lines.add(_SEP.join(
+                        part.encode("utf-8")
+                        for part in (kind, name, source_id)
+                    ))
+
+        mkdir_p(os.path.dirname(self.path))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for line in sorted(lines):
+                f.write(line + b"\n")
+        os.rename(tmp_path, self.path)
+        write_config(self.keys_file, keys)
+        return sorted(reread)
+
+    def query(self, kind, prefix):
+        """
+        Returns the sorted, unique names of `kind` starting with `prefix`.
+        """
+        key = _SEP.join([kind.encode("utf-8"), prefix.encode("utf-8")])
+        names = []
+        with _mapped(self.path) as mapped:
+            if mapped is None:
+                return names
+            offset = _lower_bound(mapped, key)
+            while offset < len(mapped):
+                end = mapped.find(b"\n", offset)
+                end = end if end != -1 else len(mapped)
+                line = mapped[offset:end]
+                if not line.startswith(key):
+                    break
+                name = line.split(_SEP)[1].decode("utf-8")
+                if not names or names[-1] != name:
+                    names.append(name)
+                offset = end + 1
+        return names
+
+    def _lines(self):
+        try:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    yield line.rstrip(b"\n")
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+class _mapped(object):  # pylint: disable=C0103
+    """
+    Context manager mapping a file read-only, or giving None for a missing
+    or empty one (which mmap can't map).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.mapped = None
+
+    def __enter__(self):
+        try:
+            self.file = io.open(self.path, "rb")
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        if os.fstat(self.file.fileno()).st_size:
+            self.mapped = mmap.mmap(self.file.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        return self.mapped
+
+    def __exit__(self, *args):
+        if self.mapped is not None:
+            self.mapped.close()
+        if self.file is not None:
+            self.file.close()
+
+
+def _lower_bound(mapped, key):
+    """
+    Returns the offset of the first line not sorting before `key`.
+    """
+    lo, hi = 0, len(mapped)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = mapped.rfind(b"\n", 0, mid) + 1
+        end = mapped.find(b"\n", start)
+        end = end if end != -1 else len(mapped)
+        if mapped[start:end] < key:
+            lo = end + 1
+        else:
+            hi = start
+    return lo
+
+
+def stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def read_lines(path, kind):
+    """
+    Streams one name per line, e.g. from brew's api/formula_names.txt.
+    """
+    try:
+        with io.open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield kind, line.strip()
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def read_tap(tap_dir):
+    """
+    Streams the formula and cask names defined in a tap checkout.
+    """
+    for subdir, kind in _TAP_DIRS:
+        for _, _, filenames in os.walk(os.path.join(tap_dir, subdir)):
+            for filename in filenames:
+                name, ext = os.path.splitext(filename)
+                if ext == ".rb":
+                    yield kind, name
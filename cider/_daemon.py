@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from . import _tty as tty
+from ._sh import Brew, mkdir_p
+from ._inventory import Inventory
+from ._watch import watcher
+from .core import Cider
+from .exceptions import DaemonError
+from contextlib import closing
+from functools import partial
+import copy
+import errno
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import traceback
+
+# Commands a running daemon answers instead of a fresh process.
+DAEMON_COMMANDS = ("ls", "list", "missing", "status", "relink")
+
+
+def socket_path(env=None):
+    env = env if env is not None else os.environ
+    if env.get("CIDER_SOCKET"):
+        return env["CIDER_SOCKET"]
+    if env.get("XDG_RUNTIME_DIR"):
+        return os.path.join(env["XDG_RUNTIME_DIR"], "cider.sock")
+    return os.path.join(tempfile.gettempdir(),
+                        "cider-{0}.sock".format(os.getuid()))
+
+
+class WarmState(object):
+    """
+    Values shared by every request a daemon serves, each dropped as soon
+    as a path it was read from changes.
+    """
+    def __init__(self):
+        self.values = {}
+        self.paths = {}
+        self._lock = threading.RLock()
+
+    def get(self, key, paths, fn):
+        with self._lock:
+            if key not in self.values:
+                self.values[key] = fn()
+                self.paths[key] = [os.path.abspath(path) for path in paths]
+            return self.values[key]
+
+    def invalidate(self, changed):
+        with self._lock:
+            for key, paths in list(self.paths.items()):
+                if any(_overlaps(path, other)
+                       for path in paths for other in changed):
+                    del self.values[key]
+                    del self.paths[key]
+
+
+def _overlaps(path, other):
+    other = os.path.abspath(other)
+    return path == other or path.startswith(os.path.join(other, "")) or \
+        other.startswith(os.path.join(path, ""))
+
+
+class WarmCider(Cider):
+    """
+    Cider whose config files, brew inventory and package lists come from
+    a WarmState rather than being read again for every command.
+    """
+    def __init__(self, state, *args, **kwargs):
+        self.state = state
+        super(WarmCider, self).__init__(*args, **kwargs)
+        self.brew = _WarmBrew(self.brew, self)
+
+    def _config(self, path, read):
+        return copy.deepcopy(self.state.get(("config", path), [path], read))
+
+    def read_bootstrap(self):
+        return self._config(self.bootstrap_file,
+                            super(WarmCider, self).read_bootstrap)
+
+    def read_defaults(self):
+        return self._config(self.defaults_file,
+                            super(WarmCider, self).read_defaults)
+
+    def _cached_targets(self):
+        return self._config(self.symlink_targets_file,
+                            super(WarmCider, self)._cached_targets)
+
+    def brew_paths(self):
+        def paths():
+            homebrew = Brew(False, self.debug, self.verbose, self.env)
+            return homebrew.prefix(), homebrew.repository()
+        return self.state.get("brew_paths", [], paths)
+
+    def brew_dir(self, name):
+        prefix, repository = self.brew_paths()
+        if name == "Taps":
+            return os.path.join(repository, "Library", "Taps")
+        return os.path.join(prefix, name)
+
+    @property
+    def preferences_dir(self):
+        return os.path.join(self.home, "Library", "Preferences")
+
+    def inventory(self):
+        prefix, repository = self.brew_paths()
+        paths = [self.brew_dir(name)
+                 for name in ("Cellar", "opt", "Caskroom", "Taps")]
+        return self.state.get(
+            "inventory", paths + [self.preferences_dir],
+            lambda: Inventory(prefix, repository, self.home)
+        )
+
+    def watch_paths(self):
+        """
+        The directories whose direct entries the warm values depend on.
+        """
+        return [self.cider_dir, self.support_dir, self.brew_paths()[0]] + \
+            [self.brew_dir(name)
+             for name in ("Cellar", "opt", "Caskroom", "Taps")] + \
+            [self.preferences_dir]
+
+
+class _WarmBrew(object):
+    """
+    Wraps a Brew so `ls` and `tap` (listing) answer from the WarmState.
+    """
+    def __init__(self, brew, cider):
+        self.brew = brew
+        self.cider = cider
+
+    def __getattr__(self, name):
+        return getattr(self.brew, name)
+
+    def ls(self):
+        directory = self.cider.brew_dir(
+            "Caskroom" if self.brew.cask else "Cellar"
+        )
+        return list(self.cider.state.get(("ls", self.brew.cask),
+                                         [directory], self.brew.ls))
+
+    def tap(self, tap=None):
+        if tap is not None:
+            return self.brew.tap(tap)
+        return self.cider.state.get("taps", [self.cider.brew_dir("Taps")],
+                                    self.brew.tap)
+
+
+class Daemon(object):
+    """
+    Serves cider commands over a Unix socket, one at a time, from Ciders
+    sharing a WarmState. `run(args, factory)` runs a command line with
+    `factory` making its Cider.
+
+    Each connection carries one command as JSON lines: the client sends
+    {"args": [...]}, the daemon replies with {"stdout": ...} and
+    {"stderr": ...} chunks, asks for {"stdin": true} when the command
+    prompts (answered with {"stdin": "<line>"}) and ends with
+    {"exit": <code>}.
+    """
+    def __init__(self, path, run, poll=None):
+        self.path = path
+        self.run = run
+        self.poll = poll
+        self.state = WarmState()
+        self.factory = partial(WarmCider, self.state)
+
+    def listen(self):
+        if os.path.exists(self.path):
+            conn = _connect(self.path)
+            if conn is not None:
+                conn.close()
+                raise DaemonError("A daemon is already listening on "
+                                  "{0}".format(self.path))
+            # Left behind by a daemon that didn't shut down cleanly.
+            os.remove(self.path)
+
+        mkdir_p(os.path.dirname(self.path))
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            listener.bind(self.path)
+        finally:
+            os.umask(umask)
+        listener.listen(8)
+        return listener
+
+    def serve(self):
+        """
+        Answers requests until interrupted.
+        """
+        roots = [(path, False) for path in self.factory().watch_paths()]
+        listener = self.listen()
+        tty.putinfo("Listening on {0}".format(self.path))
+        try:
+            with watcher(roots, poll=self.poll) as changes:
+                while True:
+                    conn, _ = listener.accept()
+                    self.state.invalidate(changes.poll(0))
+                    with closing(conn):
+                        self.handle(conn)
+        finally:
+            listener.close()
+            os.remove(self.path)
+
+    def handle(self, conn):
+        channel = _Channel(conn)
+        request = channel.receive()
+        if request is None:
+            return
+
+        streams = sys.stdin, sys.stdout, sys.stderr
+        listeners = tty.listeners()
+        sys.stdin = _Input(channel)
+        sys.stdout = _Output(channel, "stdout")
+        sys.stderr = _Output(channel, "stderr")
+        exit_code = 0
+        try:
+            self.run(request["args"], self.factory)
+        except SystemExit as e:
+            exit_code = e.code
+        except Exception:  # pylint: disable=W0703
+            # Keep serving; the client sees what a crash would have shown.
+            exit_code = traceback.format_exc()
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = streams
+            tty.set_output(tty.TEXT)
+            for listener in tty.listeners():
+                if listener not in listeners:
+                    tty.remove_listener(listener)
+
+        try:
+            if exit_code is not None and not isinstance(exit_code, int):
+                channel.send(stderr="{0}\n".format(exit_code))
+                exit_code = 1
+            channel.send(exit=exit_code or 0)
+        except socket.error:
+            pass  # The client went away mid-command.
+
+
+def forward(path, args, stdin=None, stdout=None, stderr=None):
+    """
+    Runs `args` on the daemon listening at `path`, relaying its output and
+    prompts. Returns the exit code, or None if no daemon is running.
+    """
+    conn = _connect(path)
+    if conn is None:
+        return None
+    with closing(conn):
+        return relay(conn, args, stdin, stdout, stderr)
+
+
+def relay(conn, args, stdin=None, stdout=None, stderr=None):
+    stdin = stdin if stdin is not None else sys.stdin
+    outputs = {
+        "stdout": stdout if stdout is not None else sys.stdout,
+        "stderr": stderr if stderr is not None else sys.stderr,
+    }
+    channel = _Channel(conn)
+    channel.send(args=list(args))
+    while True:
+        message = channel.receive()
+        if message is None:
+            raise DaemonError("The daemon hung up before finishing")
+        if "exit" in message:
+            return message["exit"]
+        if "stdin" in message:
+            channel.send(stdin=stdin.readline())
+        for name, output in outputs.items():
+            if name in message:
+                output.write(message[name])
+                output.flush()
+
+
+def _connect(path):
+    try:
+        if os.stat(path).st_uid != os.getuid():
+            return None
+    except OSError:
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except socket.error as e:
+        conn.close()
+        if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+            return None
+        raise
+    return conn
+
+
+class _Channel(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.reader = conn.makefile("rb")
+
+    def send(self, **message):
+        self.conn.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def receive(self):
+        line = self.reader.readline()
+        if not line:
+            return None
+        return json.loads(line.decode("utf-8"))
+
+
+class _Output(object):
+    encoding = "utf-8"
+    errors = "strict"
+
+    def __init__(self, channel, name):
+        self.channel = channel
+        self.name = name
+
+    def write(self, data):
+        if data:
+            self.channel.send(**{self.name: data})
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class _Input(object):
+    encoding = "utf-8"
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.buffer = ""
+
+    def _fill(self):
+        if not self.buffer:
+            self.channel.send(stdin=True)
+            self.buffer = (self.channel.receive() or {}).get("stdin", "")
+
+    def read(self, size=-1):
+        self._fill()
+        size = size if size >= 0 else len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self):
+        self._fill()
+        end = self.buffer.find("\n") + 1 or len(self.buffer)
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        return line
+
+    def isatty(self):
+        return False
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from . import _tty as tty
+from ._pool import WorkerPool
+import ctypes
+import ctypes.util
+import errno
+import os
+import shutil
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux ioctl that shares extents between two files (btrfs, xfs).
+_FICLONE = 0x40049409
+
+# clonefile(2) flag: don't follow a symlink at the source.
+_CLONE_NOFOLLOW = 0x0001
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Errors meaning a copy strategy isn't available for this pair of files, as
+# opposed to the copy itself failing.
+_UNSUPPORTED = set(getattr(errno, name) for name in (
+    "EXDEV", "ENOSYS", "EINVAL", "EBADF", "ENOTSUP", "EOPNOTSUPP",
+    "ENOTTY", "ETXTBSY", "EPERM"
+) if hasattr(errno, name))
+
+_STAGING_SUFFIX = ".cider-move"
+
+
+def _load_clonefile():
+    if sys.platform != "darwin":
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        clonefile = libc.clonefile
+    except (OSError, AttributeError):
+        return None
+    clonefile.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint]
+    clonefile.restype = ctypes.c_int
+    return clonefile
+
+
+_clonefile = _load_clonefile()
+
+
+def staging_path(dst):
+    """
+    Returns the path a cross-device move into `dst` is copied to before
+    being renamed into place. It lives next to `dst`, so the final rename
+    never crosses a filesystem.
+    """
+    parent, name = os.path.split(os.path.normpath(dst))
+    return os.path.join(parent, ".{0}{1}".format(name, _STAGING_SUFFIX))
+
+
+def move(src, dst, workers=None):
+    """
+    Moves `src` (a file, symlink or directory) to `dst`, which must not
+    exist yet. Renames when both are on the same filesystem; otherwise the
+    tree is copied to a staging path beside `dst`, renamed into place and
+    only then removed from `src`, so an interrupted move leaves the
+    original untouched (or, at worst, a complete copy in both places).
+    """
+    try:
+        os.rename(src, dst)
+        return dst
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    staging = staging_path(dst)
+    _remove(staging)
+    try:
+        copy_tree(src, staging, workers)
+        os.rename(staging, dst)
+    except BaseException:
+        _remove(staging)
+        raise
+
+    _remove(src)
+    return dst
+
+
+def copy_tree(src, dst, workers=None):
+    """
+    Copies `src` to `dst` preserving symlinks, permissions and timestamps.
+    Directories are created up front and regular files are copied in
+    parallel.
+    """
+    if os.path.islink(src) or not os.path.isdir(src):
+        copy_file(src, dst)
+        return
+
+    dirs = []
+    files = []
+    for root, dirnames, filenames in os.walk(src):
+        target_root = os.path.join(dst, os.path.relpath(root, src))
+        os.mkdir(os.path.normpath(target_root))
+        dirs.append((root, target_root))
+
+        for dirname in list(dirnames):
+            path = os.path.join(root, dirname)
+            if os.path.islink(path):
+                # os.walk() doesn't descend into these; copy them as links.
+                dirnames.remove(dirname)
+                filenames.append(dirname)
+
+        for filename in filenames:
+            files.append((os.path.join(root, filename),
+                          os.path.join(target_root, filename)))
+
+    total = len(files)
+    if total:
+        tty.putprogress("Copying {0} files to {1}".format(total, dst))
+
+    copied = [0]
+    lock = threading.Lock()
+
+    def copy(paths):
+        copy_file(*paths)
+        with lock:
+            copied[0] += 1
+            tty.event("move_progress", source=src, target=dst,
+                      copied=copied[0], total=total)
+
+    with WorkerPool(workers) as pool:
+        tasks = [pool.submit(copy, paths) for paths in files]
+    for task in tasks:
+        task.result()
+
+    # Children first, so copying into a directory doesn't bump its mtime.
+    for source_dir, target_dir in reversed(dirs):
+        shutil.copystat(source_dir, target_dir)
+
+
+def copy_file(src, dst):
+    """
+    Copies a single file or symlink, using a copy-on-write clone where the
+    filesystem supports it and in-kernel copying otherwise.
+    """
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return
+
+    if not _clone(src, dst):
+        with open(src, "rb") as fsrc:
+            with open(dst, "wb") as fdst:
+                _copy_contents(fsrc, fdst)
+    shutil.copystat(src, dst)
+
+
+def _clone(src, dst):
+    if _clonefile is not None:
+        if _clonefile(_encode(src), _encode(dst), _CLONE_NOFOLLOW) == 0:
+            return True
+        if ctypes.get_errno() not in _UNSUPPORTED:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), src)
+        return False
+
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                return True
+            except (IOError, OSError) as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+    return False
+
+
+def _copy_contents(fsrc, fdst):
+    size = os.fstat(fsrc.fileno()).st_size
+    for offload in (_copy_file_range, _sendfile):
+        try:
+            if offload(fsrc.fileno(), fdst.fileno(), size):
+                return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+        # Start over with the next strategy.
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+    shutil.copyfileobj(fsrc, fdst, _CHUNK_SIZE)
+
+
+def _copy_file_range(infd, outfd, size):
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is None:
+        return False
+    return _copy_loop(lambda count: copy_file_range(infd, outfd, count),
+                      size)
+
+
+def _sendfile(infd, outfd, size):
+    # Only Linux can sendfile() into a regular file.
+    sendfile = getattr(os, "sendfile", None)
+    if sendfile is None or not sys.platform.startswith("linux"):
+        return False
+    offset = [0]
+
+    def send(count):
+        sent = sendfile(outfd, infd, offset[0], count)
+        offset[0] += sent
+        return sent
+    return _copy_loop(send, size)
+
+
+def _copy_loop(copy, size):
+    copied = 0
+    while True:
+        # Keep going past `size` in case the file grew while copying.
+        count = copy(max(size - copied, _CHUNK_SIZE))
+        if not count:
+            return True
+        copied += count
+
+
+def _encode(path):
+    return path.encode(sys.getfilesystemencoding()) \
+        if not isinstance(path, bytes) else path
+
+
+def _remove(path):
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from ._sh import spawn
+from .exceptions import GitError
+from subprocess import CalledProcessError
+import subprocess
+
+# What the last `git pull` (or merge, rebase or reset) brought in.
+DEFAULT_RANGE = "ORIG_HEAD..HEAD"
+
+
+class Repo(object):
+    """
+    The git checkout containing `path`. Paths passed to and returned by
+    its methods are relative to `path`.
+    """
+    def __init__(self, path, env=None, debug=None):
+        self.path = path
+        self.env = env
+        self.debug = debug if debug is not None else False
+
+    def _git(self, *args):
+        return spawn(["git"] + list(args), check_output=True,
+                     debug=self.debug, env=self.env, cwd=self.path,
+                     stderr=subprocess.PIPE)
+
+    def commit(self, rev):
+        try:
+            return self._git("rev-parse", "--verify", "--quiet",
+                             rev + "^{commit}").strip()
+        except CalledProcessError:
+            raise GitError("Unknown revision in {0}: {1}".format(
+                self.path, rev
+            ))
+        except OSError as e:
+            raise GitError("Couldn't run git: {0}".format(e))
+
+    def resolve(self, spec=None):
+        """
+        Returns the (old, new) commits of a revision range: "A..B",
+        "A...B" (from their merge base), or "A" for A..HEAD.
+        """
+        spec = spec if spec is not None else DEFAULT_RANGE
+        if "..." in spec:
+            old, new = spec.split("...", 1)
+            new = self.commit(new or "HEAD")
+            try:
+                old = self._git("merge-base", self.commit(old or "HEAD"),
+                                new).strip()
+            except CalledProcessError:
+                raise GitError("No common ancestor in {0}".format(spec))
+            return old, new
+
+        old, new = (spec.split("..", 1) + ["HEAD"])[:2]
+        return self.commit(old or "HEAD"), self.commit(new or "HEAD")
+
+    def show(self, rev, path):
+        """
+        Returns the contents of `path` at `rev`, or None if it didn't
+        exist then.
+        """
+        try:
+            return self._git("show", "{0}:./{1}".format(rev, path))
+        except CalledProcessError:
+            return None
+
+    def changed(self, old, new):
+        """
+        Returns {path: status} for the files changed between two commits,
+        with "A" (added), "D" (deleted) or "M" (modified) as the status.
+        Renames count as a deletion and an addition.
+        """
+        try:
+            output = self._git("diff", "--name-status", "--no-renames",
+                               "--relative", "-z", old, new)
+        except CalledProcessError:
+            raise GitError("Couldn't diff {0}..{1}".format(old, new))
+        fields = output.split("\0")
+        return dict((path, status[0]) for status, path in
+                    zip(fields[0::2], fields[1::2]) if path)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from . import _tty as tty
+from ._sh import mkdir_p
+from .exceptions import CiderException
+from contextlib import closing
+import os
+import sqlite3
+import threading
+import time
+
+# Commands whose runs are worth comparing over time.
+RECORDED_COMMANDS = ("restore", "relink", "provision", "apply-defaults",
+                     "apply-icons", "run-scripts", "sync")
+
+# A step is flagged when it took `factor` times its median, and at least
+# `min_seconds` longer, over at least `min_runs` earlier runs.
+DEFAULT_FACTOR = 2.0
+DEFAULT_MIN_RUNS = 3
+DEFAULT_MIN_SECONDS = 1.0
+
+# How many earlier runs medians are taken over.
+DEFAULT_WINDOW = 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    command TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    exit_code INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    step TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_command ON runs (command, id);
+CREATE INDEX IF NOT EXISTS steps_run ON steps (run_id);
+"""
+
+
+class History(object):
+    """
+    SQLite log of past runs and the duration of every step in them
+    (keyed like the restore plan, e.g. "formulas/git" or
+    "defaults/com.apple.dock").
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        mkdir_p(os.path.dirname(self.path))
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def record(self, command, started, duration, exit_code, steps):
+        """
+        Appends a run and its (step, status, duration) tuples. Returns the
+        new run's id.
+        """
+        with closing(self._connect()) as conn:
+            with conn:
+                run_id = conn.execute(
+                    "INSERT INTO runs (command, started, duration, exit_code)"
+                    " VALUES (?, ?, ?, ?)",
+                    (command, started, duration, exit_code)
+                ).lastrowid
+                conn.executemany(
+                    "INSERT INTO steps (run_id, step, status, duration)"
+                    " VALUES (?, ?, ?, ?)",
+                    [(run_id,) + tuple(step) for step in steps]
+                )
+        return run_id
+
+    def runs(self, command, limit=None):
+        """
+        Returns the latest runs of `command`, newest first.
+        """
+        limit = limit if limit is not None else DEFAULT_WINDOW
+        if not os.path.isfile(self.path):
+            return []
+        with closing(self._connect()) as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT id, started, duration, exit_code FROM runs"
+                " WHERE command = ? ORDER BY id DESC LIMIT ?",
+                (command, limit)
+            )]
+
+    def medians(self, command, before, window=None):
+        """
+        Returns {step: (median duration, sample count)} over the successful
+        steps of the `window` runs of `command` preceding run `before`.
+        """
+        window = window if window is not None else DEFAULT_WINDOW
+        durations = {}
+        with closing(self._connect()) as conn:
+            for row in conn.execute(
+                "SELECT step, duration FROM steps WHERE status = 'ok'"
+                " AND run_id IN (SELECT id FROM runs WHERE command = ?"
+                " AND id < ? ORDER BY id DESC LIMIT ?)",
+                (command, before, window)
+            ):
+                durations.setdefault(row["step"], []).append(row["duration"])
+        return dict((step, (_median(values), len(values)))
+                    for step, values in durations.items())
+
+    def slow_steps(self, command, run_id, factor=None, min_runs=None,
+                   min_seconds=None, window=None):
+        """
+        Returns the steps of run `run_id` that were significantly slower
+        than their median, slowest relative to it first.
+        """
+        factor = factor if factor is not None else DEFAULT_FACTOR
+        min_runs = min_runs if min_runs is not None else DEFAULT_MIN_RUNS
+        min_seconds = min_seconds if min_seconds is not None else \
+            DEFAULT_MIN_SECONDS
+        medians = self.medians(command, run_id, window)
+        slow = []
+        with closing(self._connect()) as conn:
+            for row in conn.execute(
+                "SELECT step, duration FROM steps WHERE run_id = ?"
+                " AND status = 'ok'", (run_id,)
+            ):
+                median, count = medians.get(row["step"], (None, 0))
+                if count < min_runs:
+                    continue
+                if row["duration"] >= median * factor and \
+                   row["duration"] - median >= min_seconds:
+                    slow.append({"step": row["step"],
+                                 "duration": row["duration"],
+                                 "median": median, "runs": count})
+        return sorted(slow, key=lambda s: (
+            -s["duration"] / max(s["median"], 0.001), s["step"]
+        ))
+
+
+class Recorder(object):
+    """
+    Event listener (see tty.add_listener) collecting the steps of a run
+    and, once the command finishes, appending them to the history.
+
+    `history` is a callable returning the History, only called when
+    there's something to record.
+    """
+    def __init__(self, history, commands=None):
+        self.history = history
+        self.commands = commands if commands is not None else \
+            RECORDED_COMMANDS
+        self.command = None
+        self.started = time.time()
+        self.steps = []
+        self.skipped = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        kind = event["event"]
+        if kind == "command_started":
+            self.command = event.get("command")
+            self.started = time.time()
+        elif kind == "step_finished":
+            with self._lock:
+                self.steps.append((event["step"], event["status"],
+                                   event["duration"]))
+        elif kind == "step_skipped":
+            # Skipped steps finish at once, which would drag medians down.
+            with self._lock:
+                self.skipped.add(event["step"])
+        elif kind == "command_finished" and self.command in self.commands:
+            exit_code = event.get("exit_code") or 0
+            try:
+                self.history().record(
+                    self.command, self.started, event["duration"],
+                    exit_code if isinstance(exit_code, int) else 1,
+                    [step for step in self.steps
+                     if step[0] not in self.skipped]
+                )
+            except (CiderException, EnvironmentError, sqlite3.Error) as e:
+                tty.puterr("Couldn't record run history: {0}".format(e),
+                           warning=True)
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from . import _tty as tty
+from ._native import download
+from ._pool import WorkerPool
+from ._sh import mkdir_p, read_config, sha1sum, write_config
+from .exceptions import DownloadError
+from rfc3987 import parse as urlparse
+import errno
+import hashlib
+import os
+import threading
+
+# Finder stores custom folder and bundle icons in this file.
+_ICON_FILE = "Icon\r"
+
+
+def icon_source(icon):
+    """
+    Returns (url, None) for remote icons or (None, path) for local ones.
+    """
+    try:
+        components = urlparse(icon)
+        if not components["scheme"] or components["scheme"] == "file":
+            return None, os.path.expanduser(components["path"])
+        return icon, None
+    except ValueError:
+        return None, os.path.expanduser(icon)
+
+
+class IconCache(object):
+    """
+    Content-addressed store for icons. Files are kept as
+    `<cache_dir>/<sha1><ext>`, and the index remembers the validators
+    (ETag/Last-Modified for URLs, mtime/size for local files) used to
+    decide whether a source changed, as well as which icon was last
+    applied to each app bundle.
+    """
+    def __init__(self, cache_dir, index_file, debug=None):
+        self.cache_dir = cache_dir
+        self.index_file = index_file
+        self.debug = debug if debug is not None else False
+        self._lock = threading.Lock()
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            index = read_config(self.index_file, {})
+            index.setdefault("sources", {})
+            index.setdefault("applied", {})
+            self._index = index
+        return self._index
+
+    def save(self):
+        with self._lock:
+            mkdir_p(os.path.dirname(self.index_file))
+            write_config(self.index_file, self.index)
+
+    def fetch_all(self, icons, workers=None):
+        """
+        Resolves every icon to (path, digest), downloading remote icons in
+        parallel.
+        """
+        icons = sorted(set(icons))
+        with WorkerPool(workers) as pool:
+            return dict(zip(icons, pool.map(self.fetch, icons)))
+
+    def fetch(self, icon):
+        url, path = icon_source(icon)
+        if url is None:
+            return path, self._hash_local(path)
+        return self._download(url)
+
+    def is_applied(self, app_path, digest):
+        record = self.index["applied"].get(app_path)
+        return bool(
+            record is not None and record == digest and
+            os.path.exists(os.path.join(app_path, _ICON_FILE))
+        )
+
+    def mark_applied(self, app_path, digest):
+        with self._lock:
+            self.index["applied"][app_path] = digest
+
+    def forget(self, app_path):
+        with self._lock:
+            self.index["applied"].pop(app_path, None)
+
+    def _entry(self, key):
+        with self._lock:
+            return dict(self.index["sources"].get(key, {}))
+
+    def _record(self, key, entry):
+        with self._lock:
+            self.index["sources"][key] = entry
+
+    def _cached_path(self, entry):
+        if not entry.get("hash"):
+            return None
+        path = os.path.join(self.cache_dir,
+                            entry["hash"] + entry.get("ext", ""))
+        return path if os.path.isfile(path) else None
+
+    def _hash_local(self, path):
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            raise DownloadError("Icon not found: {0}".format(path), path)
+
+        entry = self._entry(path)
+        validator = [st.st_mtime, st.st_size]
+        if entry.get("validator") == validator and entry.get("hash"):
+            return entry["hash"]
+
+        digest = sha1sum(path)
+        self._record(path, {"validator": validator, "hash": digest})
+        return digest
+
+    def _download(self, url):
+        entry = self._entry(url)
+        cached = self._cached_path(entry)
+        headers = {}
+        if cached is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        mkdir_p(self.cache_dir)
+        tmp_path = os.path.join(self.cache_dir, ".{0}.download".format(
+            hashlib.sha1(url.encode("utf-8")).hexdigest()
+        ))
+        try:
+            info = download(url, tmp_path, headers=headers,
+                            debug=self.debug)
+        except DownloadError as e:
+            return self._stale(url, cached, entry, e)
+        if info is None:
+            return cached, entry["hash"]
+
+        tty.putprogress("Downloaded icon: {0}".format(url))
+        digest = sha1sum(tmp_path)
+        ext = os.path.splitext(urlparse(url)["path"] or "")[1]
+        path = os.path.join(self.cache_dir, digest + ext)
+        os.rename(tmp_path, path)
+        self._record(url, {
+            "hash": digest,
+            "ext": ext,
+            "etag": info.get("ETag"),
+            "last_modified": info.get("Last-Modified"),
+        })
+        return path, digest
+
+    @staticmethod
+    def _stale(url, cached, entry, error):
+        if cached is None:
+            raise error
+        tty.puterr("Failed to download {0}; using cached copy".format(url),
+                   warning=True)
+        return cached, entry["hash"]
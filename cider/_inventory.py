@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from ._lib import lazyproperty
+from ._sh import _listdir
+import errno
+import hashlib
+import json
+import os
+import plistlib
+import re
+
+_GLOBAL_DOMAIN = "NSGlobalDomain"
+
+_GLOBAL_PLIST = ".GlobalPreferences"
+
+
+def package_name(entry):
+    """
+    Returns the name brew installs an entry under, e.g. "foo" for
+    "user/repo/foo --with-bar".
+    """
+    return entry.split()[0].split("/")[-1]
+
+
+def defaults_hash(options):
+    """
+    Hashes a domain's key => value options. Types are part of the hash, so
+    e.g. 1 and True don't compare equal.
+    """
+    typed = dict(
+        (key, [type(value).__name__, value])
+        for key, value in options.items()
+    )
+    data = json.dumps(typed, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def same_default(current, key, value):
+    if not isinstance(current, dict) or key not in current:
+        return False
+    # Don't let e.g. 1 == True hide a type change.
+    return type(current[key]) is type(value) and current[key] == value
+
+
+def git_head(path):
+    """
+    Returns the commit a git checkout is at, reading .git directly instead
+    of spawning git, or None if it can't be determined.
+    """
+    git_dir = os.path.join(path, ".git")
+    head = _read(os.path.join(git_dir, "HEAD"))
+    if head is None or not head.startswith("ref:"):
+        return head
+
+    ref = head[len("ref:"):].strip()
+    revision = _read(os.path.join(git_dir, ref))
+    if revision is not None:
+        return revision
+
+    for line in (_read(os.path.join(git_dir, "packed-refs")) or
+                 "").splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == ref:
+            return parts[0]
+    return None
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except IOError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            raise
+        return None
+
+
+class Inventory(object):
+    """
+    What is installed, read straight from the Homebrew prefix, the tap
+    checkouts and the preference files rather than by asking brew or
+    `defaults` about each entry.
+    """
+    def __init__(self, prefix, repository, home=None):
+        self.prefix = prefix
+        self.repository = repository
+        self.home = home if home is not None else os.path.expanduser("~")
+
+    @lazyproperty
+    def formulas(self):
+        """
+        Maps each installed formula to its linked (or newest) version.
+        """
+        cellar = os.path.join(self.prefix, "Cellar")
+        versions = {}
+        for name in _listdir(cellar):
+            installed = _versions(os.path.join(cellar, name))
+            if not installed:
+                continue
+            opt = os.path.realpath(os.path.join(self.prefix, "opt", name))
+            linked = os.path.basename(opt)
+            versions[name] = linked if linked in installed else installed[-1]
+        return versions
+
+    @lazyproperty
+    def requested(self):
+        """
+        Returns the installed formulas that were asked for, as opposed to
+        pulled in as dependencies, going by their install receipts.
+        """
+        requested = set()
+        for name, version in self.formulas.items():
+            receipt = _read(os.path.join(self.prefix, "Cellar", name,
+                                         version, "INSTALL_RECEIPT.json"))
+            try:
+                on_request = json.loads(receipt).get("installed_on_request",
+                                                     True)
+            except (TypeError, ValueError, AttributeError):
+                # No (or an unreadable) receipt; err on the side of
+                # reporting it.
+                on_request = True
+            if on_request:
+                requested.add(name)
+        return requested
+
+    @lazyproperty
+    def casks(self):
+        caskroom = os.path.join(self.prefix, "Caskroom")
+        versions = {}
+        for name in _listdir(caskroom):
+            installed = _versions(os.path.join(caskroom, name))
+            if installed:
+                versions[name] = installed[-1]
+        return versions
+
+    @lazyproperty
+    def taps(self):
+        """
+        Maps each tapped "user/repo" (lowercased) to its checked out
+        revision.
+        """
+        taps_dir = os.path.join(self.repository, "Library", "Taps")
+        taps = {}
+        for user in _listdir(taps_dir):
+            for repo in _listdir(os.path.join(taps_dir, user)):
+                if repo.startswith("homebrew-"):
+                    name = "{0}/{1}".format(user, repo[len("homebrew-"):])
+                    taps[name.lower()] = git_head(
+                        os.path.join(taps_dir, user, repo)
+                    )
+        return taps
+
+    def version(self, kind, entry):
+        return getattr(self, kind).get(package_name(entry))
+
+    def plist_path(self, domain):
+        if domain == _GLOBAL_DOMAIN:
+            domain = _GLOBAL_PLIST
+        return os.path.join(self.home, "Library", "Preferences",
+                            domain + ".plist")
+
+    def read_domain(self, domain):
+        """
+        Returns the contents of a domain's preferences file, or None if it
+        can't be read (in which case callers should ask `defaults`).
+        """
+        path = self.plist_path(domain)
+        try:
+            with open(path, "rb") as f:
+                if hasattr(plistlib, "load"):
+                    return plistlib.load(f)
+                return plistlib.readPlist(f)
+        except IOError as e:
+            # A missing file doesn't mean the domain is empty, e.g. for
+            # those kept under ~/Library/Containers or by cfprefsd.
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        except Exception:  # pylint: disable=W0703
+            # e.g. a binary plist on Python 2.
+            return None
+
+    def domain_hash(self, domain, keys):
+        """
+        Hashes the current values of `keys` in `domain`, in the same form
+        as defaults_hash(), or returns None if the domain can't be read.
+        """
+        current = self.read_domain(domain)
+        if current is None:
+            return None
+        return defaults_hash(dict(
+            (key, current[key]) for key in keys if key in current
+        ))
+
+
+def _versions(path):
+    return sorted(
+        (version for version in _listdir(path)
+         if not version.startswith(".")),
+        key=_version_key
+    )
+
+
+def _version_key(version):
+    # So that e.g. 1.10 sorts after 1.9.
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part)
+            for part in re.split(r"(\d+)", version) if part]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from ._sh import mkdir_p
+import errno
+import hashlib
+import json
+import os
+import threading
+
+
+def config_hash(*configs):
+    """
+    Hashes parsed config data, so formatting-only edits don't invalidate
+    anything keyed by it.
+    """
+    sha1 = hashlib.sha1()
+    for config in configs:
+        sha1.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+        sha1.update(b"\0")
+    return sha1.hexdigest()
+
+
+class Journal(object):
+    """
+    Append-only log of completed steps. Each line is a JSON object holding
+    the step name and the hash of the config it was completed against, so
+    entries written for a different config are ignored when resuming.
+    """
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.completed = set()
+        self._lock = threading.Lock()
+
+    def read(self):
+        completed = set()
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Most likely a line cut short by a crash.
+                        continue
+                    if entry.get("key") == self.key and "step" in entry:
+                        completed.add(entry["step"])
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return completed
+
+    def start(self, resume=None):
+        """
+        Loads completed steps when resuming, otherwise (or when nothing in
+        the journal applies to this config) starts a new one. Returns the
+        number of steps that will be skipped.
+        """
+        self.completed = self.read() if resume else set()
+        if not self.completed:
+            mkdir_p(os.path.dirname(self.path))
+            with open(self.path, "w"):
+                pass
+        return len(self.completed)
+
+    def record(self, step):
+        line = json.dumps({"key": self.key, "step": step}) + "\n"
+        with self._lock:
+            self.completed.add(step)
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def wrap(self, step, fn, on_skip=None):
+        """
+        Returns `fn` wrapped to be skipped if `step` already completed, and
+        recorded once it succeeds. Returning False (e.g. an install that
+        failed with --ignore-errors) counts as not completed.
+        """
+        def _run():
+            if step in self.completed:
+                if on_skip is not None:
+                    on_skip(step)
+                return None
+            result = fn()
+            if result is not False:
+                self.record(step)
+            return result
+        return _run
+
+    def finish(self):
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from ._inventory import defaults_hash
+
+LOCK_VERSION = 1
+
+_PACKAGE_KINDS = ("formulas", "casks")
+
+
+def build_lock(bootstrap, defaults, inventory):
+    """
+    Returns (lock, unlocked). The lock maps formulas and casks to their
+    installed versions, taps to their revisions and defaults domains to
+    the hash of their options; `unlocked` names the restore steps left out
+    because they aren't installed or applied yet.
+    """
+    lock = {"version": LOCK_VERSION, "taps": {}, "defaults": {}}
+    unlocked = []
+    for kind in _PACKAGE_KINDS:
+        lock[kind] = {}
+        for entry in bootstrap.get(kind, []):
+            version = inventory.version(kind, entry)
+            if version is None:
+                unlocked.append("{0}/{1}".format(kind, entry))
+            else:
+                lock[kind][entry] = version
+
+    for tap in bootstrap.get("taps", []):
+        revision = inventory.taps.get(tap.lower())
+        if revision is None:
+            unlocked.append("taps/" + tap.lower())
+        else:
+            lock["taps"][tap.lower()] = revision
+
+    for domain, options in sorted(defaults.items()):
+        digest = defaults_hash(options)
+        if inventory.domain_hash(domain, options) != digest:
+            unlocked.append("defaults/" + domain)
+        else:
+            lock["defaults"][domain] = digest
+    return lock, unlocked
+
+
+def current_steps(lock, bootstrap, defaults, inventory):
+    """
+    Returns the restore steps that need no work: packages installed at
+    their locked version and defaults domains whose options and current
+    values both match the lock. Entries missing from the lock always need
+    work.
+    """
+    current = set()
+    for kind in _PACKAGE_KINDS:
+        locked = lock.get(kind) or {}
+        for entry in bootstrap.get(kind, []):
+            if entry in locked and \
+               inventory.version(kind, entry) == locked[entry]:
+                current.add("{0}/{1}".format(kind, entry))
+
+    locked = lock.get("defaults") or {}
+    for domain, options in defaults.items():
+        digest = defaults_hash(options)
+        if locked.get(domain) == digest and \
+           inventory.domain_hash(domain, options) == digest:
+            current.add("defaults/" + domain)
+    return current
+
+
+def tap_drift(lock, inventory):
+    """
+    Returns (tap, locked, current) for every locked tap checked out at a
+    different revision.
+    """
+    return [
+        (tap, revision, inventory.taps.get(tap))
+        for tap, revision in sorted((lock.get("taps") or {}).items())
+        if tap in inventory.taps and inventory.taps[tap] != revision
+    ]
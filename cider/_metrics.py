@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from ._sh import mkdir_p
+from collections import defaultdict
+import os
+import threading
+import time
+
+# (name, type, help) for every metric, in the order they're written.
+METRICS = (
+    ("cider_last_run_timestamp_seconds", "gauge",
+     "When the last run finished."),
+    ("cider_last_run_duration_seconds", "gauge",
+     "Wall time of the last run."),
+    ("cider_last_run_exit_code", "gauge",
+     "Exit code of the last run."),
+    ("cider_phase_duration_seconds", "gauge",
+     "Time spent in each kind of restore step."),
+    ("cider_steps", "gauge",
+     "Restore steps by kind and outcome."),
+    ("cider_packages", "gauge",
+     "Formulas and casks by outcome."),
+    ("cider_links", "gauge",
+     "Symlinks by outcome."),
+    ("cider_defaults", "gauge",
+     "Defaults by outcome."),
+    ("cider_downloads", "gauge",
+     "Downloads by outcome."),
+    ("cider_subprocesses", "gauge",
+     "Subprocesses spawned, by program."),
+    ("cider_subprocess_duration_seconds", "gauge",
+     "Time spent waiting on subprocesses, by program."),
+)
+
+
+class Metrics(object):
+    """
+    Event listener (see tty.add_listener) that tallies a run and, once the
+    command finishes, writes the totals to `<directory>/cider_<command>.prom`
+    for the Prometheus node exporter's textfile collector.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.command = "cider"
+        self.values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        handler = getattr(self, "_on_" + event["event"], None)
+        if handler is not None:
+            with self._lock:
+                handler(event)
+
+    @property
+    def path(self):
+        return os.path.join(self.directory,
+                            "cider_{0}.prom".format(self.command))
+
+    def add(self, name, value, **labels):
+        self.values[(name, tuple(sorted(labels.items())))] += value
+
+    def render(self):
+        lines = []
+        for name, kind, description in METRICS:
+            samples = sorted(
+                (labels, value) for (metric, labels), value
+                in self.values.items() if metric == name
+            )
+            if not samples:
+                continue
+            lines.append("# HELP {0} {1}".format(name, description))
+            lines.append("# TYPE {0} {1}".format(name, kind))
+            for labels, value in samples:
+                labels = (("command", self.command),) + labels
+                lines.append("{0}{{{1}}} {2}".format(name, ",".join(
+                    '{0}="{1}"'.format(key, _escape(label))
+                    for key, label in labels
+                ), _format(value)))
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        # Written beside the final file and renamed, so the collector never
+        # reads a partial one (it ignores anything not ending in .prom).
+        mkdir_p(self.directory)
+        tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.rename(tmp_path, self.path)
+
+    def _on_command_started(self, event):
+        self.command = event.get("command") or self.command
+
+    def _on_step_finished(self, event):
+        phase = event["step"].split("/", 1)[0]
+        self.add("cider_phase_duration_seconds", event["duration"],
+                 phase=phase)
+        self.add("cider_steps", 1, phase=phase, status=event["status"])
+
+    def _on_package(self, event):
+        self.add("cider_packages", 1,
+                 kind="cask" if event.get("cask") else "formula",
+                 status=event["status"])
+
+    def _on_link(self, event):
+        self.add("cider_links", 1, status=event["status"])
+
+    def _on_default(self, event):
+        self.add("cider_defaults", 1, status=event["status"])
+
+    def _on_download_finished(self, event):
+        self.add("cider_downloads", 1, status=event["status"])
+
+    def _on_process_finished(self, event):
+        self.add("cider_subprocesses", 1, program=event["program"])
+        self.add("cider_subprocess_duration_seconds", event["duration"],
+                 program=event["program"])
+
+    def _on_command_finished(self, event):
+        exit_code = event.get("exit_code") or 0
+        self.add("cider_last_run_timestamp_seconds", time.time())
+        self.add("cider_last_run_duration_seconds", event["duration"])
+        self.add("cider_last_run_exit_code",
+                 exit_code if isinstance(exit_code, int) else 1)
+        self.write()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _format(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
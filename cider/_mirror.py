@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from . import _tty as tty
+from ._fs import copy_file
+from ._inventory import package_name
+from ._pool import WorkerPool
+from ._sh import mkdir_p
+import errno
+import os
+import uuid
+
+# Suffixes of downloads brew hasn't finished (or is still writing), and of
+# copies the mirror hasn't renamed into place yet.
+_PARTIAL_SUFFIXES = (".incomplete", ".cider-mirror")
+
+# Cask payloads live in their own directory of the download cache.
+_CASK_DIR = "Cask"
+
+
+class Mirror(object):
+    """
+    A directory shared between machines (e.g. over NFS or on a USB disk)
+    holding copies of brew's download cache. It uses the same layout as
+    the cache: bottles are found through `<name>--<version>...` entries at
+    the top level and cask payloads through the same in Cask/.
+    """
+    def __init__(self, path, cache, workers=None):
+        self.path = path
+        self.cache = cache
+        self.workers = workers
+
+    def seed(self):
+        """
+        Copies downloads missing from the cache out of the mirror. Returns
+        the number of files copied.
+
+        Everything in the mirror is copied, not only the downloads of the
+        bootstrap's own formulas and casks: the bottles of their
+        dependencies aren't named anywhere cider can read without asking
+        brew, and an offline restore needs them too. Files already cached
+        are skipped, so only the first seed on a machine copies much.
+        """
+        return _sync(self.path, self.cache, self.workers)
+
+    def populate(self):
+        """
+        Copies finished downloads missing from the mirror out of the cache.
+        Returns the number of files copied.
+        """
+        return _sync(self.cache, self.path, self.workers)
+
+    def misses(self, kind, entries):
+        """
+        Returns the formulas or casks among `entries` that have nothing in
+        the mirror to install from.
+        """
+        directory = os.path.join(self.path, _CASK_DIR) \
+            if kind == "casks" else self.path
+        names = [name for name in _listdir(directory)
+                 if not name.endswith(_PARTIAL_SUFFIXES)]
+        return [entry for entry in entries if not any(
+            name.startswith(package_name(entry) + "--") for name in names
+        )]
+
+
+def _sync(src, dst, workers=None):
+    """
+    Copies files and symlinks under `src` that don't exist under `dst`.
+    Each one is copied beside its destination and renamed into place, so
+    other machines reading `dst` never see a partial file.
+    """
+    copies = []
+    for root, dirnames, filenames in os.walk(src):
+        target_root = os.path.join(dst, os.path.relpath(root, src))
+        for dirname in list(dirnames):
+            if os.path.islink(os.path.join(root, dirname)):
+                dirnames.remove(dirname)
+                filenames.append(dirname)
+
+        for filename in filenames:
+            target = os.path.normpath(os.path.join(target_root, filename))
+            if not filename.endswith(_PARTIAL_SUFFIXES) and \
+               not os.path.lexists(target):
+                copies.append((os.path.join(root, filename), target))
+
+    if copies:
+        tty.putprogress("Copying {0} downloads to {1}".format(
+            len(copies), dst
+        ))
+
+    def copy(paths):
+        source, target = paths
+        mkdir_p(os.path.dirname(target))
+        staging = os.path.join(os.path.dirname(target), ".{0}.{1}{2}".format(
+            os.path.basename(target), uuid.uuid4().hex, _PARTIAL_SUFFIXES[1]
+        ))
+        try:
+            copy_file(source, staging)
+            os.rename(staging, target)
+        except BaseException:
+            if os.path.lexists(staging):
+                os.remove(staging)
+            raise
+
+    with WorkerPool(workers) as pool:
+        tasks = [pool.submit(copy, paths) for paths in copies]
+    for task in tasks:
+        task.result()
+    return len(copies)
+
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return []
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from . import _tty as tty
+from .exceptions import DownloadError
+import errno
+import hashlib
+import os
+import sys
+import time
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPError, URLError  # noqa pylint: disable=F0401
+
+DEFAULT_RETRIES = 2
+
+_CHUNK_SIZE = 64 * 1024
+_TIMEOUT = 30
+_BACKOFF = 0.5
+_PART_SUFFIX = ".part"
+
+
+def which(name, path=None):
+    """
+    Returns the first executable `name` on `path` (a PATH-style string,
+    defaulting to $PATH), or None.
+    """
+    path = path if path is not None else os.environ.get("PATH", os.defpath)
+    for directory in path.split(os.pathsep):
+        candidate = os.path.join(directory or os.curdir, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def brew_paths(brew):
+    """
+    Returns (prefix, repository) for the brew executable at `brew`, or
+    None if it doesn't look like a Homebrew checkout. `<prefix>/bin/brew`
+    links to `<repository>/bin/brew`; they're the same directory on Apple
+    Silicon.
+    """
+    prefix = os.path.dirname(os.path.dirname(os.path.abspath(brew)))
+    repository = os.path.dirname(os.path.dirname(os.path.realpath(brew)))
+    if not os.path.isdir(os.path.join(repository, "Library", "Homebrew")):
+        return None
+    return prefix, repository
+
+
+def brew_cache(env=None, home=None):
+    """
+    Returns brew's download cache (what `brew --cache` prints).
+    """
+    env = env if env is not None else os.environ
+    if env.get("HOMEBREW_CACHE"):
+        return env["HOMEBREW_CACHE"]
+    home = home if home is not None else os.path.expanduser("~")
+    if sys.platform == "darwin":
+        return os.path.join(home, "Library", "Caches", "Homebrew")
+    return os.path.join(env.get("XDG_CACHE_HOME") or
+                        os.path.join(home, ".cache"), "Homebrew")
+
+
+def download(url, path, sha256=None, headers=None, retries=None,
+             debug=None):
+    """
+    Streams `url` to `path`. A partial `<path>.part` left by an earlier
+    attempt is resumed where the server supports ranges; network errors and
+    5xx responses are retried `retries` times with backoff. Returns the
+    response headers, or None if conditional `headers` (e.g.
+    If-None-Match) got 304 Not Modified.
+    """
+    retries = retries if retries is not None else DEFAULT_RETRIES
+    part = path + _PART_SUFFIX
+    start = time.time()
+    attempt = 0
+    while True:
+        try:
+            info, resumed = _fetch(url, part, headers, debug)
+            if sha256 is None or _sha256sum(part) == sha256:
+                break
+            os.remove(part)
+            error = "checksum mismatch"
+        except HTTPError as e:
+            if e.code == 304:
+                _finished(url, "not_modified", start, attempt)
+                return None
+            if e.code == 416:
+                # Asked to resume a file that was already complete.
+                os.remove(part)
+            elif e.code < 500:
+                _finished(url, "failed", start, attempt)
+                raise DownloadError(
+                    "Failed to download {0}: {1}".format(url, e), url
+                )
+            error = e
+        except (URLError, IOError) as e:
+            error = e
+
+        if attempt >= retries:
+            _finished(url, "failed", start, attempt)
+            raise DownloadError(
+                "Failed to download {0}: {1}".format(url, error), url
+            )
+        attempt += 1
+        tty.putdebug("Retrying {0} ({1})".format(url, error), debug)
+        time.sleep(_BACKOFF * 2 ** (attempt - 1))
+
+    os.rename(part, path)
+    _finished(url, "ok", start, attempt, size=os.path.getsize(path),
+              resumed=resumed)
+    return info
+
+
+def _fetch(url, part, headers, debug):
+    try:
+        offset = os.path.getsize(part)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        offset = 0
+
+    request = Request(url)
+    for key, value in (headers or {}).items():
+        request.add_header(key, value)
+    if offset:
+        request.add_header("Range", "bytes={0}-".format(offset))
+
+    tty.putdebug("GET {0}".format(url), debug)
+    response = urlopen(request, timeout=_TIMEOUT)
+    try:
+        # Servers that ignore Range send the whole file again.
+        resumed = offset if response.getcode() == 206 else 0
+        with open(part, "ab" if resumed else "wb") as f:
+            for chunk in iter(lambda: response.read(_CHUNK_SIZE), b""):
+                f.write(chunk)
+        return response.info(), resumed
+    finally:
+        response.close()
+
+
+def _sha256sum(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _finished(url, status, start, attempt, **fields):
+    tty.event("download_finished", url=url, status=status,
+              retries=attempt, duration=round(time.time() - start, 3),
+              **fields)
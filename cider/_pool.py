@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+import threading
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue  # pylint: disable=F0401
+
+DEFAULT_WORKERS = 4
+
+_SENTINEL = object()
+
+
+class Task(object):
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def run(self):
+        try:
+            self._result = self.fn(*self.args, **self.kwargs)
+        except BaseException as e:  # pylint: disable=W0703
+            self._error = e
+        finally:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.done()
+
+    def result(self):
+        self.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of daemon threads. Tasks are started in submission order
+    and never more than `workers` of them run at once.
+    """
+    def __init__(self, workers=None):
+        self.workers = max(1, workers if workers is not None
+                           else DEFAULT_WORKERS)
+        self._queue = Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Don't block on running tasks when unwinding, e.g. after Ctrl-C.
+        self.join(wait=exc_type is None)
+
+    def submit(self, fn, *args, **kwargs):
+        task = Task(fn, args, kwargs)
+        self._queue.put(task)
+        self._spawn_worker()
+        return task
+
+    def map(self, fn, items):
+        tasks = [self.submit(fn, item) for item in items]
+        return [task.result() for task in tasks]
+
+    def join(self, wait=None):
+        wait = wait if wait is not None else True
+        with self._lock:
+            threads, self._threads = self._threads, []
+            for _ in threads:
+                self._queue.put(_SENTINEL)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _spawn_worker(self):
+        with self._lock:
+            if len(self._threads) >= self.workers:
+                return
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is _SENTINEL:
+                return
+            task.run()
+
+
+def wait_all(tasks):
+    """
+    Waits for every task to finish, then re-raises the first error (in
+    submission order), if any.
+    """
+    tasks = list(tasks)
+    for task in tasks:
+        task.wait()
+    for task in tasks:
+        task.result()
+
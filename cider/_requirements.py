@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from ._native import which
+from ._pool import WorkerPool
+from ._sh import spawn
+from subprocess import CalledProcessError
+import os
+import platform
+import subprocess
+
+# Rewritten by every macOS update.
+SYSTEM_VERSION_PLIST = "/System/Library/CoreServices/SystemVersion.plist"
+
+# Where `xcode-select --switch` records the developer directory.
+XCODE_SELECT_LINK = "/var/db/xcode_select_link"
+
+
+def developer_dir(env=None, debug=None):
+    try:
+        return spawn(["/usr/bin/xcode-select", "-print-path"],
+                     check_output=True, debug=debug, env=env,
+                     stderr=subprocess.PIPE).strip() or None
+    except (CalledProcessError, OSError):
+        return None
+
+
+def which_brew(env=None):
+    env = env if env is not None else os.environ
+    return which("brew", env.get("PATH"))
+
+
+def has_xcode_tools(path):
+    return bool(path and os.path.isdir(path) and os.path.exists(
+        os.path.join(path, "usr", "bin", "git")
+    ))
+
+
+def probe(env=None, debug=None):
+    """
+    Runs the (independent) requirement checks concurrently and returns
+    what they found along with the fingerprint to revalidate it against.
+    """
+    with WorkerPool() as pool:
+        tasks = {
+            "os_version": pool.submit(lambda: platform.mac_ver()[0]),
+            "developer_dir": pool.submit(developer_dir, env, debug),
+            "brew": pool.submit(which_brew, env),
+        }
+    requirements = dict((key, task.result()) for key, task in tasks.items())
+    requirements["fingerprint"] = fingerprint(env)
+    return requirements
+
+
+def fingerprint(env=None):
+    """
+    Returns what the probe results depend on, using only stat(2) and
+    readlink(2): the OS version file, the selected developer directory and
+    the PATH `which` searched.
+    """
+    env = env if env is not None else os.environ
+    return {
+        "system_version": _stat_key(SYSTEM_VERSION_PLIST),
+        "xcode_select_link": _readlink(XCODE_SELECT_LINK),
+        "developer_dir_env": env.get("DEVELOPER_DIR"),
+        "path": env.get("PATH"),
+    }
+
+
+def is_current(requirements, env=None):
+    """
+    Returns whether previously probed `requirements` still hold, without
+    spawning anything.
+    """
+    if not requirements or \
+       requirements.get("fingerprint") != fingerprint(env):
+        return False
+    brew = requirements.get("brew")
+    return has_xcode_tools(requirements.get("developer_dir")) and \
+        bool(brew) and os.path.isfile(brew) and os.access(brew, os.X_OK)
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size, st.st_ino]
+
+
+def _readlink(path):
+    try:
+        return os.readlink(path)
+    except OSError:
+        return None
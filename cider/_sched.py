@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from . import _tty as tty
+from ._pool import WorkerPool
+from .exceptions import DependencyError
+from collections import OrderedDict
+import time
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue  # pylint: disable=F0401
+
+
+def run_step(name, fn):
+    """
+    Calls `fn` as the step `name`, emitting step_started and step_finished
+    (with its status and duration) around it.
+    """
+    tty.event("step_started", step=name)
+    start = time.time()
+    try:
+        result = fn()
+    except BaseException:
+        tty.event("step_finished", step=name, status="failed",
+                  duration=round(time.time() - start, 3))
+        raise
+    tty.event("step_finished", step=name, status="ok",
+              duration=round(time.time() - start, 3))
+    return result
+
+
+class Node(object):
+    def __init__(self, name, fn, deps=None, resource=None):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps or [])
+        self.resource = resource
+
+
+class Scheduler(object):
+    """
+    Runs a DAG of nodes on a worker pool. A node starts as soon as all of
+    its dependencies finished, in insertion order among ready nodes. Nodes
+    sharing a `resource` never run at the same time (e.g. brew, which
+    can't install two packages at once).
+    """
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.nodes = OrderedDict()
+
+    def __contains__(self, name):
+        return name in self.nodes
+
+    def add(self, name, fn, deps=None, resource=None):
+        if name in self.nodes:
+            raise DependencyError("Duplicate step: {0}".format(name))
+        self.nodes[name] = Node(name, fn, deps, resource)
+        return self.nodes[name]
+
+    def order(self):
+        """
+        Returns node names in a valid execution order, raising
+        DependencyError for unknown dependencies or cycles.
+        """
+        for node in self.nodes.values():
+            for dep in node.deps:
+                if dep not in self.nodes:
+                    raise DependencyError(
+                        "Unknown dependency for {0}: {1}".format(
+                            node.name, dep
+                        )
+                    )
+
+        indegree = dict(
+            (name, len(set(node.deps))) for name, node in self.nodes.items()
+        )
+        dependents = self._dependents()
+        ready = [name for name, count in indegree.items() if not count]
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for dependent in dependents[name]:
+                indegree[dependent] -= 1
+                if not indegree[dependent]:
+                    ready.append(dependent)
+
+        if len(order) != len(self.nodes):
+            cycle = sorted(name for name, count in indegree.items() if count)
+            raise DependencyError(
+                "Dependency cycle between: {0}".format(", ".join(cycle))
+            )
+        return order
+
+    def _dependents(self):
+        dependents = OrderedDict((name, []) for name in self.nodes)
+        for name, node in self.nodes.items():
+            for dep in set(node.deps):
+                dependents[dep].append(name)
+        return dependents
+
+    def run(self):
+        """
+        Runs every node and returns a map of name => result. If a node
+        raises, no further nodes are started; nodes already running are
+        allowed to finish and the first error is then re-raised.
+        """
+        self.order()
+
+        pending = OrderedDict(
+            (name, set(node.deps)) for name, node in self.nodes.items()
+        )
+        dependents = self._dependents()
+
+        finished = Queue()
+        busy = set()
+        results = {}
+        errors = []
+        running = 0
+
+        def wrap(node):
+            def _run():
+                try:
+                    result = run_step(node.name, node.fn)
+                except BaseException as e:  # pylint: disable=W0703
+                    finished.put((node, None, e))
+                    return
+                finished.put((node, result, None))
+            return _run
+
+        with WorkerPool(self.workers) as pool:
+            while True:
+                if not errors:
+                    for name, deps in list(pending.items()):
+                        node = self.nodes[name]
+                        if deps or (node.resource is not None and
+                                    node.resource in busy):
+                            continue
+                        del pending[name]
+                        if node.resource is not None:
+                            busy.add(node.resource)
+                        pool.submit(wrap(node))
+                        running += 1
+
+                if not running:
+                    break
+
+                node, result, error = finished.get()
+                running -= 1
+                busy.discard(node.resource)
+                if error is not None:
+                    errors.append(error)
+                    continue
+
+                results[node.name] = result
+                for dependent in dependents[node.name]:
+                    if dependent in pending:
+                        pending[dependent].discard(node.name)
+
+        if errors:
+            raise errors[0]
+        return results
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from . import _tty as tty
+from ._sched import Scheduler
+from ._sh import mkdir_p, read_config, sha1sum, spawn, write_config
+from .exceptions import DependencyError
+from glob import glob
+from subprocess import CalledProcessError
+import hashlib
+import os
+import re
+import subprocess
+import sys
+import threading
+
+_SLUG_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+# Number of trailing log lines shown when a script fails.
+_LOG_TAIL = 20
+
+
+class Script(object):
+    """
+    A before/after script. Entries are either a plain command string or a
+    mapping with the keys:
+
+        run:     the command, run through the shell from cider_dir
+        name:    name other scripts can depend on (defaults to `run`)
+        depends: names of scripts that must finish first
+        group:   consecutive scripts in the same group may run in parallel
+        inputs:  files or globs (relative to cider_dir); when present, the
+                 script is skipped if neither these nor the command changed
+                 since its last successful run
+    """
+    def __init__(self, run, name=None, depends=None, group=None,
+                 inputs=None, phase=None):
+        self.run = run
+        self.name = name if name is not None else run
+        self.depends = depends
+        self.group = group
+        self.inputs = inputs
+        self.phase = phase
+
+    @classmethod
+    def parse(cls, entry, phase=None):
+        if not isinstance(entry, dict):
+            return cls(entry, phase=phase)
+
+        if "run" not in entry:
+            raise DependencyError(
+                "Script is missing a `run` command: {0}".format(entry)
+            )
+
+        def as_list(value):
+            if value is None:
+                return None
+            return value if isinstance(value, list) else [value]
+
+        return cls(
+            entry["run"],
+            name=entry.get("name"),
+            depends=as_list(entry.get("depends")),
+            group=entry.get("group"),
+            inputs=as_list(entry.get("inputs")),
+            phase=phase
+        )
+
+
+def parse_scripts(bootstrap, before=None, after=None):
+    """
+    Returns (scripts, known) where `scripts` are the scripts to run and
+    `known` holds the names of every script in the bootstrap.
+    """
+    scripts = []
+    known = set()
+    for phase, selected in (("before", before), ("after", after)):
+        names = {}
+        for entry in bootstrap.get("{0}-scripts".format(phase), []):
+            script = Script.parse(entry, phase)
+            # Unnamed duplicates (e.g. the same command twice) get a suffix.
+            count = names.get(script.name, 0) + 1
+            names[script.name] = count
+            if count > 1:
+                if isinstance(entry, dict) and "name" in entry:
+                    raise DependencyError(
+                        "Duplicate script name: {0}".format(script.name)
+                    )
+                script.name = "{0} #{1}".format(script.name, count)
+            if script.name in known:
+                raise DependencyError(
+                    "Duplicate script name: {0}".format(script.name)
+                )
+            known.add(script.name)
+            if selected:
+                scripts.append(script)
+    return scripts, known
+
+
+def script_dependencies(scripts, known):
+    """
+    Returns a map of script name => names it waits on. Scripts without an
+    explicit `depends` wait on the previous stage, where a stage is either a
+    single script or a run of consecutive scripts sharing a group. Explicit
+    dependencies on scripts that aren't part of this run are ignored.
+    """
+    scheduled = set(script.name for script in scripts)
+    deps = {}
+    previous_stage = []
+    stage = []
+    stage_group = None
+
+    for script in scripts:
+        if script.group is None or script.group != stage_group:
+            previous_stage, stage = stage or previous_stage, []
+            stage_group = script.group
+        stage.append(script.name)
+
+        if script.depends is None:
+            deps[script.name] = list(previous_stage)
+            continue
+
+        for dep in script.depends:
+            if dep not in known:
+                raise DependencyError(
+                    "Unknown dependency for script {0}: {1}".format(
+                        script.name, dep
+                    )
+                )
+        deps[script.name] = [dep for dep in script.depends
+                             if dep in scheduled]
+    return deps
+
+
+class ScriptRunner(object):
+    def __init__(self, cider_dir, support_dir, env=None, debug=None,
+                 workers=None):
+        self.cider_dir = cider_dir
+        self.state_file = os.path.join(support_dir, "scripts.json")
+        self.log_dir = os.path.join(support_dir, "logs", "scripts")
+        self.env = env
+        self.debug = debug if debug is not None else False
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._state = None
+
+    @property
+    def state(self):
+        if self._state is None:
+            self._state = read_config(self.state_file, {})
+        return self._state
+
+    def log_path(self, script):
+        slug = _SLUG_RE.sub("-", script.name).strip("-")[:48]
+        digest = hashlib.sha1(script.name.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.log_dir, "{0}-{1}.log".format(slug, digest))
+
+    def input_hash(self, script):
+        """
+        Hashes the command text along with the path and contents of every
+        file matched by the script's inputs.
+        """
+        sha1 = hashlib.sha1(script.run.encode("utf-8"))
+        paths = set()
+        for pattern in script.inputs or []:
+            pattern = os.path.join(self.cider_dir,
+                                   os.path.expanduser(pattern))
+            paths.update(path for path in glob(pattern)
+                         if os.path.isfile(path))
+
+        for path in sorted(paths):
+            relpath = os.path.relpath(path, self.cider_dir)
+            sha1.update(b"\0" + relpath.encode("utf-8") + b"\0")
+            sha1.update(sha1sum(path).encode("utf-8"))
+        return sha1.hexdigest()
+
+    def is_current(self, script, digest):
+        return script.inputs is not None and \
+            self.state.get(script.name) == digest
+
+    def run(self, scripts, known):
+        deps = script_dependencies(scripts, known)
+        scheduler = Scheduler(self.workers)
+        for script in scripts:
+            scheduler.add(script.name, self._runner(script),
+                          deps[script.name])
+
+        try:
+            return scheduler.run()
+        finally:
+            if self._state is not None:
+                mkdir_p(os.path.dirname(self.state_file))
+                write_config(self.state_file, self._state)
+
+    def _runner(self, script):
+        return lambda: self.run_script(script)
+
+    def run_script(self, script):
+        digest = self.input_hash(script) if script.inputs is not None \
+            else None
+        if self.is_current(script, digest):
+            tty.putdebug("Script unchanged, skipping: {0}".format(
+                script.name
+            ), self.debug)
+            return False
+
+        log_path = self.log_path(script)
+        mkdir_p(self.log_dir)
+        tty.putprogress("Running script: {0}".format(script.name))
+        with open(log_path, "w") as log:
+            try:
+                spawn([script.run], shell=True, debug=self.debug,
+                      cwd=self.cider_dir, env=self.env,
+                      stdout=log, stderr=subprocess.STDOUT)
+            except CalledProcessError:
+                log.flush()
+                self._put_log_tail(script, log_path)
+                raise
+
+        if digest is not None:
+            with self._lock:
+                self.state[script.name] = digest
+        return True
+
+    @staticmethod
+    def _put_log_tail(script, log_path):
+        with open(log_path, "r") as f:
+            tail = f.readlines()[-_LOG_TAIL:]
+        tty.puterr("Script failed: {0} (log: {1})".format(
+            script.name, log_path
+        ))
+        for line in tail:
+            sys.stderr.write(line if line.endswith("\n") else line + "\n")
@@ -1,23 +1,32 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function
 from . import _tty as tty
+from ._native import brew_cache, brew_paths, which
+from ._yamledit import splice
 from .exceptions import ParserError
 from subprocess import CalledProcessError
 import click
 import copy
 import errno
+import hashlib
+import io
 import json
 import os
+import plistlib
 import pwd
 import re
 import subprocess
 import sys
+import time
 import yaml
 
 JSONDecodeError = ValueError
 
 _OUTDATED_RE = re.compile(r' \(\d.*\)$')
 
+# Brew's default HOMEBREW_AUTO_UPDATE_SECS.
+DEFAULT_UPDATE_WINDOW = 24 * 60 * 60
+
 
 class Brew(object):
     def __init__(self, cask=None, debug=None, verbose=None, env=None):
@@ -33,7 +42,7 @@ class Brew(object):
         args += [cmd] + cmdargs
 
         # `brew ls` doesn't seem to like these flags.
-        if cmd != "ls":
+        if cmd not in ("ls", "--repository", "--prefix", "--cache"):
             args += (["--debug"] if self.debug else [])
             args += (["--verbose"] if self.verbose else [])
 
@@ -41,7 +50,8 @@ class Brew(object):
             return spawn(args, debug=self.debug,
                          check_output=check_output, env=self.env)
         except CalledProcessError as e:
-            if not prompt or not click.confirm(prompt):
+            if not prompt or tty.get_output() == tty.SILENT or \
+               not click.confirm(prompt, err=tty.is_ndjson()):
                 raise e
 
     def __assert_no_cask(self, cmd):
@@ -49,18 +59,27 @@ class Brew(object):
 
     def safe_install(self, formula, warn=None, outdated=False):
         warn = warn if warn is not None else False
+        cmd = "install" if not outdated else "upgrade"
         try:
             prompt = None
-            cmd = "install" if not outdated else "upgrade"
             if not warn:
                 prompt = "Failed to install {0}. Continue? [y/N]".format(
                     formula
                 )
-            return self.__spawn(cmd, formula.split(" "), prompt)
+            # __spawn() returns None if the user chose to continue.
+            installed = self.__spawn(cmd, formula.split(" "),
+                                     prompt) is not None
         except CalledProcessError as e:
+            tty.event("package", name=formula, cask=self.cask, action=cmd,
+                      status="failed")
             if not warn:
                 raise e
             tty.puterr("Failed to install {0}".format(formula), warning=True)
+            return False
+
+        tty.event("package", name=formula, cask=self.cask, action=cmd,
+                  status="installed" if installed else "failed")
+        return installed
 
     def install(self, *formulas, **kwargs):
         formulas = list(formulas) or []
@@ -86,6 +105,62 @@ class Brew(object):
         self.__assert_no_cask(__name__)
         return self.__spawn("untap", [tap])
 
+    def repository(self):
+        self.__assert_no_cask("--repository")
+        paths = self.__paths()
+        if paths is not None:
+            return paths[1]
+        return self.__spawn("--repository", [], check_output=True).strip()
+
+    def prefix(self):
+        paths = self.__paths()
+        if paths is not None:
+            return paths[0]
+        return self.__spawn("--prefix", [], check_output=True).strip()
+
+    def update(self, window=None):
+        """
+        Runs `brew update` unless brew last fetched updates less than
+        `window` seconds ago. Returns whether it ran.
+        """
+        self.__assert_no_cask("update")
+        window = window if window is not None else DEFAULT_UPDATE_WINDOW
+        try:
+            fetched = os.path.getmtime(
+                os.path.join(self.repository(), ".git", "FETCH_HEAD")
+            )
+        except OSError:
+            fetched = None
+        if fetched is not None and time.time() - fetched < window:
+            return False
+        self.__spawn("update", [])
+        return True
+
+    def __paths(self):
+        # Derived from where brew is installed rather than asking it.
+        brew = which("brew", (self.env or os.environ).get("PATH"))
+        return brew_paths(brew) if brew is not None else None
+
+    def cache(self):
+        self.__assert_no_cask("--cache")
+        return brew_cache(self.env, (self.env or {}).get("HOME"))
+
+    def installed_taps(self):
+        """
+        Returns the taps already cloned into the Taps directory, without
+        going through `brew tap` (which has to load every tap to list them).
+        """
+        self.__assert_no_cask("tap")
+        taps_dir = os.path.join(self.repository(), "Library", "Taps")
+        taps = []
+        for user in _listdir(taps_dir):
+            for repo in _listdir(os.path.join(taps_dir, user)):
+                if repo.startswith("homebrew-"):
+                    taps.append("{0}/{1}".format(
+                        user, repo[len("homebrew-"):]
+                    ).lower())
+        return sorted(taps)
+
     def ls(self):
         return [formula for formula in self.__spawn(
             "ls", ["-1"], check_output=True
@@ -114,6 +189,22 @@ class Defaults(object):
         args += [domain, key, self.key_type(value), str(value)]
         return spawn(args, debug=self.debug, env=self.env)
 
+    def export(self, domain):
+        """
+        Returns the current contents of `domain` in one `defaults` call, or
+        an empty dict if it can't be read.
+        """
+        try:
+            output = spawn(["defaults", "export", domain, "-"],
+                           check_output=True, debug=self.debug,
+                           stderr=subprocess.PIPE, env=self.env)
+        except CalledProcessError:
+            return {}
+        try:
+            return _loads_plist(output)
+        except Exception:  # pylint: disable=W0703
+            return {}
+
     def delete(self, domain, key):
         return spawn(["defaults", "delete", domain, key], debug=self.debug,
                      env=self.env)
@@ -143,25 +234,57 @@ def spawn(args, **kwargs):
 
     tty.putdebug(" ".join(args), debug)
 
-    if check_output:
-        return subprocess.check_output(args, **params).decode("utf-8")
-    elif check_call:
-        return subprocess.check_call(args, **params)
-    else:
-        return subprocess.call(args, **params)
+    # Keep stdout free for the event stream.
+    if tty.is_structured() and not check_output and "stdout" not in params:
+        params["stdout"] = sys.stderr
+
+    start = time.time()
+    try:
+        if check_output:
+            return subprocess.check_output(args, **params).decode("utf-8")
+        elif check_call:
+            return subprocess.check_call(args, **params)
+        else:
+            return subprocess.call(args, **params)
+    finally:
+        tty.event("process_finished",
+                  program="sh" if params.get("shell") else
+                  os.path.basename(args[0]),
+                  duration=round(time.time() - start, 3))
 
 
 def prompt(msg, default=None):
     if default is None:
         default = False
-    sys.stdout.write(msg)
-    sys.stdout.flush()
+    out = sys.stderr if tty.is_structured() else sys.stdout
+    out.write(msg)
+    out.flush()
     expected = "n" if default else "y"
     return sys.stdin.read(1).lower() == expected
 
 
-def curl(url, path):
-    return spawn(["curl", "-L", url, "-o", path, "--progress-bar"])
+def _loads_plist(contents):
+    if hasattr(plistlib, "loads"):
+        return plistlib.loads(contents.encode("utf-8"))
+    return plistlib.readPlistFromString(contents.encode("utf-8"))
+
+
+def sha1sum(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _listdir(path):
+    try:
+        return sorted(x for x in os.listdir(path)
+                      if os.path.isdir(os.path.join(path, x)))
+    except OSError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            raise
+        return []
 
 
 def mkdir_p(path):
@@ -172,8 +295,10 @@ def mkdir_p(path):
             raise
 
 
-def collapseuser(path):
-    home_dir = os.environ.get("HOME", pwd.getpwuid(os.getuid()).pw_dir)
+def collapseuser(path, home=None):
+    home_dir = home if home is not None else os.environ.get(
+        "HOME", pwd.getpwuid(os.getuid()).pw_dir
+    )
     if os.path.samefile(home_dir, commonpath([path, home_dir])):
         relpath = os.path.relpath(path, home_dir)
         return os.path.join("~", relpath) if relpath != "." else "~"
@@ -193,21 +318,35 @@ def commonpath(paths):
 
 
 def read_config(path, fallback=None):
-    is_json = os.path.splitext(path)[1] == ".json"
     try:
         with open(path, "r") as f:
-            contents = f.read() or "{}"
-            return json.loads(contents) if is_json else yaml.safe_load(contents)
+            return parse_config(f.read(), path)
     except IOError as e:
         if fallback is not None and e.errno == errno.ENOENT:
             return fallback
 
         raise e
+
+
+def parse_config(contents, path):
+    """
+    Parses config file contents, as JSON or YAML depending on `path`.
+    """
+    is_json = os.path.splitext(path)[1] == ".json"
+    contents = contents or "{}"
+    try:
+        return json.loads(contents) if is_json else yaml.safe_load(contents)
     except (JSONDecodeError, yaml.parser.ParserError) as e:
         raise ParserError(e, path)
 
 
-def modify_config(path, transform):
+def modify_config(path, transform, unordered=None):
+    """
+    Applies `transform` to the config at `path`. YAML files are edited in
+    place where possible (see _yamledit.splice), keeping comments and
+    formatting, with the top-level lists named in `unordered` keeping
+    their order.
+    """
     is_json = os.path.splitext(path)[1] == ".json"
     contents = read_config(path, {})
     old_contents = contents
@@ -215,13 +354,22 @@ def modify_config(path, transform):
     changed = bool(old_contents != contents)
 
     if changed:
-        with open(path, "w") as f:
-            if is_json:
-                json.dump(contents, f, indent=4, sort_keys=True,
-                          separators=(',', ': '))
-            else:
-                yaml.dump(contents, f, indent=4, width=79, allow_unicode=True,
-                          default_flow_style=False)
+        text = None
+        if not is_json and os.path.exists(path):
+            with io.open(path, "r", encoding="utf-8") as f:
+                text = splice(f.read(), old_contents, contents, unordered)
+
+        if text is not None:
+            with io.open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        else:
+            with open(path, "w") as f:
+                if is_json:
+                    json.dump(contents, f, indent=4, sort_keys=True,
+                              separators=(',', ': '))
+                else:
+                    yaml.dump(contents, f, indent=4, width=79,
+                              allow_unicode=True, default_flow_style=False)
 
     return changed
 
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from ._inventory import package_name, same_default
+import os
+
+# Taps brew manages itself.
+_DEFAULT_TAPS = ("homebrew/core", "homebrew/cask")
+
+_LINK_OK = "ok"
+
+
+def package_status(bootstrap, inventory, kind):
+    """
+    Returns {"missing": [...], "extra": [...]} for formulas or casks:
+    bootstrapped entries that aren't installed, and installed packages
+    (formulas only if installed on request) that aren't bootstrapped.
+    """
+    entries = bootstrap.get(kind, [])
+    installed = getattr(inventory, kind)
+    wanted = set(package_name(entry) for entry in entries)
+    candidates = inventory.requested if kind == "formulas" else installed
+    return {
+        "missing": sorted(entry for entry in entries
+                          if package_name(entry) not in installed),
+        "extra": sorted(set(candidates) - wanted),
+    }
+
+
+def tap_status(bootstrap, inventory):
+    wanted = set(tap.lower() for tap in bootstrap.get("taps", []))
+    tapped = set(inventory.taps)
+    return {
+        "missing": sorted(wanted - tapped),
+        "extra": sorted(tapped - wanted - set(_DEFAULT_TAPS)),
+    }
+
+
+def link_state(source, target):
+    """
+    Returns "ok", "missing", "broken" (a dangling symlink), "wrong" (a
+    symlink to somewhere else) or "conflict" (a regular file or directory)
+    for the link expected from `target` to `source`. A directory source
+    may also be satisfied by a real directory with its entries linked.
+    """
+    if os.path.islink(target):
+        if not os.path.exists(target):
+            return "broken"
+        if os.path.samefile(os.path.realpath(target),
+                            os.path.realpath(source)):
+            return _LINK_OK
+        return "wrong"
+    if os.path.isdir(target) and os.path.isdir(source):
+        # Unfolded (see Cider._link_tree): each entry is linked inside.
+        for name in sorted(os.listdir(source)):
+            state = link_state(os.path.join(source, name),
+                               os.path.join(target, name))
+            if state != _LINK_OK:
+                return state
+        return _LINK_OK
+    if os.path.lexists(target):
+        return "conflict"
+    return "missing"
+
+
+def link_status(expected, cached, cider_dir):
+    """
+    Returns the problem links among `expected` (source, target) pairs,
+    plus cached targets that no longer belong to any group but still point
+    into cider_dir ("stale").
+    """
+    problems = []
+    targets = set()
+    for source, target in expected:
+        targets.add(target)
+        state = link_state(source, target)
+        if state != _LINK_OK:
+            problems.append({"source": source, "target": target,
+                             "status": state})
+
+    cider_dir = os.path.join(os.path.realpath(cider_dir), "")
+    for target in sorted(set(cached) - targets):
+        if os.path.islink(target) and \
+           os.path.realpath(target).startswith(cider_dir):
+            problems.append({"source": os.path.realpath(target),
+                             "target": target, "status": "stale"})
+    return problems
+
+
+def defaults_status(defaults, inventory, export):
+    """
+    Returns the configured defaults whose current value differs. Domains
+    are read from their preferences file where possible, falling back to
+    `export` (i.e. `defaults export`) otherwise.
+    """
+    changed = []
+    for domain, options in sorted(defaults.items()):
+        current = inventory.read_domain(domain)
+        if current is None:
+            current = export(domain)
+        for key, value in sorted(options.items()):
+            if not same_default(current, key, value):
+                changed.append({"domain": domain, "key": key,
+                                "expected": value,
+                                "actual": current.get(key)})
+    return changed
+
+
+def drifted(status):
+    return any(
+        status[kind][key] for kind in ("formulas", "casks", "taps")
+        for key in ("missing", "extra")
+    ) or bool(status["links"] or status["defaults"])
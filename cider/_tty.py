@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function
+import json
 import re
 import sys
+import threading
+import time
 
 CLEAR = 0
 RED = 31
@@ -11,7 +14,84 @@ BLUE = 34
 MAGENTA = 35
 WHITE = 39
 
+TEXT = "text"
+NDJSON = "ndjson"
+OUTPUT_MODES = (TEXT, NDJSON)
+# Messages only reach listeners; used by the Python API, not the CLI.
+SILENT = "silent"
+
 _PREFIX_RE = re.compile(r"[.:!?>]$")
+_ESCAPE_RE = re.compile(r"\033\[[0-9;]*m")
+
+_state = {"output": TEXT}
+_listeners = []
+_lock = threading.Lock()
+
+
+def set_output(mode):
+    assert mode in OUTPUT_MODES + (SILENT,), \
+        "unknown output mode: {0}".format(mode)
+    _state["output"] = mode
+
+
+def get_output():
+    return _state["output"]
+
+
+def is_ndjson():
+    return _state["output"] == NDJSON
+
+
+def is_structured():
+    """
+    Whether messages go out as events (NDJSON or SILENT) instead of text.
+    """
+    return _state["output"] != TEXT
+
+
+def add_listener(listener):
+    """
+    Calls `listener` with the fields of every event from now on, whatever
+    the output mode.
+    """
+    with _lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    with _lock:
+        _listeners.remove(listener)
+
+
+def listeners():
+    with _lock:
+        return list(_listeners)
+
+
+def event(kind, **fields):
+    """
+    Writes a typed event as one JSON line on stdout in NDJSON mode and
+    passes it to any listeners; a no-op otherwise.
+    """
+    if not is_ndjson() and not _listeners:
+        return
+    fields["event"] = kind
+    fields["time"] = round(time.time(), 3)
+    for listener in list(_listeners):
+        listener(dict(fields))
+    if not is_ndjson():
+        return
+    line = json.dumps(fields, sort_keys=True, default=str)
+    with _lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+def _message(level, msg, prefix=None):
+    fields = {"level": level, "message": strip(str(msg))}
+    if prefix is not None:
+        fields["prefix"] = prefix
+    event("message", **fields)
 
 
 def error(msg, prefix=None):
@@ -61,23 +141,56 @@ def debug(msg, prefix=None):
 def puterr(msg, warning=None, prefix=None):
     if warning is None:
         warning = False
+    if is_structured():
+        return _message("warning" if warning else "error", msg, prefix)
     if warning and prefix is None:
         prefix = "Warning"
     sys.stderr.write(error(msg, prefix=prefix) + "\n")
 
 
 def puts(msg, prefix=None):
+    if is_structured():
+        return _message("success", msg, prefix)
     sys.stdout.write(success(msg, prefix=prefix) + "\n")
 
 
+def putinfo(msg):
+    if is_structured():
+        return _message("info", msg)
+    sys.stdout.write(msg + "\n")
+
+
+def putprogress(msg, prefix=None):
+    if is_structured():
+        return _message("progress", msg)
+    sys.stdout.write(progress(msg, prefix=prefix) + "\n")
+
+
 def putdebug(msg, debug=None, prefix=None):
     if debug is None:
         debug = False
     if debug:
+        if is_structured():
+            return _message("debug", msg)
         debug_func = putdebug.__globals__["debug"]
         sys.stdout.write(debug_func(msg, prefix=prefix) + "\n")
 
 
+def putitems(items, kind):
+    """
+    Writes each item as it's produced: one per line, or as an "item" event
+    in NDJSON mode. Returns the number of items written.
+    """
+    count = 0
+    for item in items:
+        count += 1
+        if is_structured():
+            event("item", list=kind, value=item)
+        else:
+            sys.stdout.write(item + "\n")
+    return count
+
+
 def color(msg, num):
     return _escape(msg, "0;{0}".format(num))
 
@@ -93,3 +206,7 @@ def bold(msg, num):
 def _escape(msg, seq):
     fmt = "\033[{0}m"
     return fmt.format(seq) + msg + fmt.format(CLEAR)
+
+
+def strip(msg):
+    return _ESCAPE_RE.sub("", msg)
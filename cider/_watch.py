@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import stat
+import struct
+import sys
+import time
+
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_INTERVAL = 1.0
+
+# <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_IN_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM |
+            _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF |
+            _IN_MOVE_SELF)
+
+_EVENT = struct.Struct("iIII")
+
+
+class Watcher(object):
+    """
+    Reports paths that changed under a set of roots. Each root is a
+    (path, recursive) pair; a non-recursive root only reports its direct
+    children. A change to a root itself (or a dropped event queue) is
+    reported as the root path, meaning anything below it may have changed.
+    """
+    def __init__(self, roots):
+        self.roots = [(os.path.abspath(path), recursive)
+                      for path, recursive in roots]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    def poll(self, timeout=None):
+        """
+        Returns the set of changed paths, waiting up to `timeout` seconds
+        (forever if None) for the first one.
+        """
+        raise NotImplementedError
+
+    def wait(self, debounce=None):
+        """
+        Blocks until something changes, then keeps collecting changes until
+        none arrive for `debounce` seconds, so a burst (e.g. a `git pull`)
+        is handled as a single batch.
+        """
+        debounce = debounce if debounce is not None else DEFAULT_DEBOUNCE
+        changed = set()
+        while not changed:
+            changed |= self.poll()
+        while True:
+            more = self.poll(debounce)
+            if not more:
+                return changed
+            changed |= more
+
+    def _recursive(self, path):
+        for root, recursive in self.roots:
+            if recursive and (path == root or
+                              path.startswith(os.path.join(root, ""))):
+                return True
+        return False
+
+
+class PollingWatcher(Watcher):
+    """
+    Fallback that compares lstat() snapshots every `interval` seconds.
+    """
+    def __init__(self, roots, interval=None):
+        super(PollingWatcher, self).__init__(roots)
+        self.interval = interval if interval is not None \
+            else DEFAULT_INTERVAL
+        self._snapshot = self.snapshot()
+
+    def snapshot(self):
+        entries = {}
+        for root, recursive in self.roots:
+            entries[root] = _stat(root)
+            if entries[root] is None or not stat.S_ISDIR(entries[root][0]):
+                continue
+            for dirpath, dirnames, filenames in os.walk(root):
+                for name in dirnames + filenames:
+                    path = os.path.join(dirpath, name)
+                    entries[path] = _stat(path)
+                if not recursive:
+                    break
+        return entries
+
+    def poll(self, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            snapshot = self.snapshot()
+            changed = set(
+                path for path in set(snapshot) | set(self._snapshot)
+                if snapshot.get(path) != self._snapshot.get(path)
+            )
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.time() >= deadline:
+                return set()
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.time()))
+            time.sleep(delay)
+
+
+class InotifyWatcher(Watcher):
+    def __init__(self, roots):
+        super(InotifyWatcher, self).__init__(roots)
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self.fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            _raise_errno()
+        self._paths = {}
+        try:
+            for root, recursive in self.roots:
+                if recursive:
+                    self._add_tree(root)
+                else:
+                    self._add(root)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self.fd is not None and self.fd >= 0:
+            os.close(self.fd)
+        self.fd = None
+
+    def _add(self, path):
+        if not os.path.isdir(path):
+            return
+        wd = self._libc.inotify_add_watch(
+            self.fd, path.encode(sys.getfilesystemencoding()), _IN_MASK
+        )
+        if wd < 0:
+            # The directory may have gone away since it was seen.
+            if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                return
+            _raise_errno(path)
+        self._paths[wd] = path
+
+    def _add_tree(self, path):
+        self._add(path)
+        for dirpath, dirnames, _ in os.walk(path):
+            for name in dirnames:
+                self._add(os.path.join(dirpath, name))
+
+    def poll(self, timeout=None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            changed |= self._parse(data)
+        return changed
+
+    def _parse(self, data):
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                changed.update(root for root, _ in self.roots)
+                continue
+            if mask & _IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+
+            parent = self._paths.get(wd)
+            if parent is None:
+                continue
+            path = os.path.join(
+                parent, name.decode(sys.getfilesystemencoding())
+            ) if name else parent
+            changed.add(path)
+
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO) and \
+               self._recursive(path):
+                self._add_tree(path)
+                # Anything created before the watch was added is missed by
+                # inotify, so report the new tree's contents as well.
+                for dirpath, dirnames, filenames in os.walk(path):
+                    changed.update(os.path.join(dirpath, x)
+                                   for x in dirnames + filenames)
+        return changed
+
+
+def watcher(roots, poll=None, interval=None):
+    """
+    Returns an inotify watcher where available, a polling one otherwise
+    (or when `poll` is set).
+    """
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except OSError:
+            pass
+    return PollingWatcher(roots, interval)
+
+
+def _stat(path):
+    try:
+        st = os.lstat(path)
+    except OSError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            raise
+        return None
+    return (st.st_mode, st.st_size, st.st_mtime, st.st_ino)
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+def _raise_errno(path=None):
+    error = ctypes.get_errno()
+    raise OSError(error, os.strerror(error), path)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from collections import Counter
+import yaml
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _dump(contents):
+    return yaml.dump(contents, indent=4, width=79, allow_unicode=True,
+                     default_flow_style=False)
+
+
+def splice(text, old, new, unordered=None):
+    """
+    Returns `text`, a YAML document loading as `old`, edited to load as
+    `new` by rewriting only the lines of entries that changed, so comments,
+    key order and formatting elsewhere are kept. New keys and items are
+    inserted in sorted position when their neighbours are sorted.
+
+    The top-level lists named in `unordered` are treated as sets: their
+    items keep their order in the file rather than that in `new`.
+
+    Returns None when the change can't be spliced in (e.g. for flow style
+    or anchors), in which case the document has to be dumped anew.
+    """
+    unordered = unordered if unordered is not None else ()
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return None
+    lines = text.splitlines(True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+
+    try:
+        edits = _splice_mapping(lines, 0, len(lines), _block_indent(
+            lines, 0, len(lines)
+        ), old, new, unordered)
+    except _Unsupported:
+        return None
+    # Bottom up, so earlier line numbers stay valid; insertions at the
+    # same line keep their order.
+    for _, start, end, replacement in sorted(
+        ((i,) + edit for i, edit in enumerate(edits)),
+        key=lambda edit: (edit[1], edit[2], edit[0]), reverse=True
+    ):
+        lines[start:end] = replacement
+    result = "".join(lines)
+
+    try:
+        loaded = yaml.safe_load(result or "{}")
+    except yaml.YAMLError:
+        return None
+    if not isinstance(loaded, dict):
+        return None
+    for key in unordered:
+        if _same_items(loaded.get(key), new.get(key)):
+            loaded[key] = new[key]
+    return result if loaded == new else None
+
+
+def _same_items(a, b):
+    if not isinstance(a, list) or not isinstance(b, list):
+        return False
+    return _sorted(a) == _sorted(b)
+
+
+def _sorted(values):
+    try:
+        return sorted(values)
+    except TypeError:
+        return list(values)
+
+
+def _skipped(line):
+    stripped = line.strip()
+    return not stripped or stripped.startswith("#") or \
+        stripped in ("---", "...")
+
+
+def _indent(line):
+    return len(line) - len(line.lstrip(" "))
+
+
+def _is_item(line):
+    content = line.strip()
+    return content == "-" or content.startswith("- ")
+
+
+def _block_indent(lines, start, end):
+    for line in lines[start:end]:
+        if not _skipped(line):
+            return _indent(line)
+    return 0
+
+
+def _entries(lines, start, end, indent, items):
+    """
+    Returns (first, last) line ranges of the entries of the block in
+    lines[start:end], mapping entries or, with `items`, sequence items.
+    Blank and comment lines after an entry are left out of it.
+    """
+    starts = []
+    for i in range(start, end):
+        line = lines[i]
+        if _skipped(line) or _indent(line) > indent:
+            continue
+        if _indent(line) < indent or "\t" in line[:indent + 1]:
+            raise _Unsupported()
+        if _is_item(line) == items:
+            starts.append(i)
+        elif items or not starts:
+            # A mapping's compact sequences share its indentation.
+            raise _Unsupported()
+
+    entries = []
+    for first, following in zip(starts, starts[1:] + [end]):
+        last = following
+        while last > first + 1 and _skipped(lines[last - 1]):
+            last -= 1
+        entries.append((first, last))
+    return entries
+
+
+def _load(lines):
+    try:
+        return yaml.safe_load("".join(lines))
+    except yaml.YAMLError:
+        raise _Unsupported()
+
+
+def _key(lines, first, last, indent):
+    loaded = _load([lines[first][indent:]])
+    if not isinstance(loaded, dict):
+        # e.g. a quoted key spanning lines.
+        loaded = _load([line[indent:] for line in lines[first:last]])
+    if not isinstance(loaded, dict) or len(loaded) != 1:
+        raise _Unsupported()
+    return list(loaded.keys())[0]
+
+
+def _render(value, indent):
+    return [" " * indent + line if line.strip() else line
+            for line in _dump(value).splitlines(True)]
+
+
+def _insertion(positions, sort_keys, key):
+    """
+    Returns where in `positions` (one per existing entry, plus one for the
+    end of the block) to insert `key`.
+    """
+    try:
+        if sort_keys == sorted(sort_keys):
+            for i, other in enumerate(sort_keys):
+                if key < other:
+                    return positions[i]
+    except TypeError:
+        pass
+    return positions[-1]
+
+
+def _splice_mapping(lines, start, end, indent, old, new, unordered=()):
+    entries = _entries(lines, start, end, indent, False)
+    keys = [_key(lines, first, last, indent) for first, last in entries]
+    if len(set(keys)) != len(keys) or set(keys) != set(old):
+        raise _Unsupported()  # e.g. merge keys.
+
+    edits = []
+    for key, (first, last) in zip(keys, entries):
+        if key not in new:
+            edits.append((first, last, []))
+        elif old[key] != new[key]:
+            edits += _splice_value(lines, first, last, indent, key,
+                                   old[key], new[key], key in unordered)
+
+    # Insert before the comments leading into the next entry.
+    positions = [entries[0][0]] + [last for _, last in entries] \
+        if entries else [end]
+    for key in _sorted(key for key in new if key not in old):
+        position = _insertion(positions, keys, key)
+        edits.append((position, position, _render({key: new[key]}, indent)))
+    return edits
+
+
+def _splice_value(lines, first, last, indent, key, old, new, unordered):
+    replace = [(first, last, _render({key: new}, indent))]
+    child = _block_indent(lines, first + 1, last)
+    if last == first + 1 or _load([lines[first][indent:]])[key] is not None:
+        return replace  # The value is on the key's line.
+
+    if isinstance(old, dict) and isinstance(new, dict) and new and \
+       child > indent and not _is_item(lines[_next(lines, first + 1)]):
+        return _splice_mapping(lines, first + 1, last, child, old, new)
+    if unordered and isinstance(old, list) and isinstance(new, list) and \
+       new and _is_item(lines[_next(lines, first + 1)]):
+        return _splice_set(lines, first + 1, last, child, old, new)
+    return replace
+
+
+def _next(lines, start):
+    while _skipped(lines[start]):
+        start += 1
+    return start
+
+
+def _splice_set(lines, start, end, indent, old, new):
+    """
+    Removes the items of a sequence missing from `new` and inserts those
+    added, leaving the rest where they are.
+    """
+    entries = _entries(lines, start, end, indent, True)
+    if len(entries) != len(old):
+        raise _Unsupported()
+
+    try:
+        wanted = Counter(new)
+        Counter(old)
+    except TypeError:
+        raise _Unsupported()  # Mappings or lists as items.
+    edits = []
+    kept_indexes, kept = [], []
+    for i, (item, (first, last)) in enumerate(zip(old, entries)):
+        if wanted[item] > 0:
+            wanted[item] -= 1
+            kept_indexes.append(i)
+            kept.append(item)
+        else:
+            edits.append((first, last, []))
+
+    # Insert after the previous item, before any comments leading into
+    # the next one.
+    positions = [entries[i - 1][1] if i else entries[0][0]
+                 for i in kept_indexes] + [entries[-1][1]]
+    for item in _sorted(wanted.elements()):
+        position = _insertion(positions, kept, item)
+        edits.append((position, position, _render([item], indent)))
+    return edits
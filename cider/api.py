@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+from . import _tty as tty
+from ._lock import current_steps
+from ._sh import read_config
+from .core import Cider
+from collections import namedtuple
+from contextlib import contextmanager
+import threading
+
+InventorySnapshot = namedtuple("InventorySnapshot",
+                               "formulas requested casks taps")
+Drift = namedtuple("Drift", "missing extra")
+LinkResult = namedtuple("LinkResult", "source target status")
+DefaultDiff = namedtuple("DefaultDiff", "domain key expected actual")
+DefaultResult = namedtuple("DefaultResult", "domain key status")
+PackageResult = namedtuple("PackageResult", "name cask status")
+PlanStep = namedtuple("PlanStep", "name deps resource current")
+StepResult = namedtuple("StepResult", "name status duration")
+Message = namedtuple("Message", "level message")
+RestoreResult = namedtuple("RestoreResult",
+                           "steps packages links defaults messages")
+
+
+class Status(namedtuple("Status", "formulas casks taps links defaults")):
+    __slots__ = ()
+
+    @property
+    def drifted(self):
+        return any(drift.missing or drift.extra
+                   for drift in (self.formulas, self.casks, self.taps)) \
+            or bool(self.links or self.defaults)
+
+
+# tty's output mode and listeners are process-wide, so calls take turns.
+_lock = threading.Lock()
+
+
+class _Capture(object):
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def of(self, kind):
+        return [event for event in self.events if event["event"] == kind]
+
+
+@contextmanager
+def _captured():
+    """
+    Silences tty for the duration of a call, collecting its events.
+    """
+    with _lock:
+        capture = _Capture()
+        mode = tty.get_output()
+        tty.set_output(tty.SILENT)
+        tty.add_listener(capture)
+        try:
+            yield capture
+        finally:
+            tty.remove_listener(capture)
+            tty.set_output(mode)
+
+
+class Api(object):
+    """
+    Cider operations for Python callers: each returns result objects
+    instead of printing, and takes callbacks where the CLI would prompt.
+
+    Wraps a Cider (by default one built from `kwargs`, as for Cider()).
+    Brew's own output still goes to stderr while it runs, and a failed
+    install is treated as if its "Continue?" prompt was declined.
+    """
+    def __init__(self, cider=None, **kwargs):
+        self.cider = cider if cider is not None else Cider(**kwargs)
+
+    def inventory(self):
+        with _captured():
+            inventory = self.cider.inventory()
+            return InventorySnapshot(
+                formulas=dict(inventory.formulas),
+                requested=sorted(inventory.requested),
+                casks=dict(inventory.casks),
+                taps=dict(inventory.taps),
+            )
+
+    def status(self):
+        with _captured():
+            status = self.cider.status()
+        return Status(
+            formulas=Drift(**status["formulas"]),
+            casks=Drift(**status["casks"]),
+            taps=Drift(**status["taps"]),
+            links=[LinkResult(**link) for link in status["links"]],
+            defaults=[DefaultDiff(**change)
+                      for change in status["defaults"]],
+        )
+
+    def plan(self):
+        """
+        Returns the restore steps in the order they'd be considered, with
+        `current` set for those the lockfile shows are already done.
+        """
+        with _captured():
+            bootstrap = self.cider.read_bootstrap()
+            plan = self.cider._restore_plan(  # pylint: disable=W0212
+                bootstrap
+            )
+            lock = read_config(self.cider.lock_file, {})
+            current = current_steps(lock, bootstrap,
+                                    self.cider.read_defaults(),
+                                    self.cider.inventory()) if lock \
+                else set()
+        return [PlanStep(node.name, list(node.deps), node.resource,
+                         node.name in current)
+                for node in plan.nodes.values()]
+
+    def restore(self, **kwargs):
+        """
+        Runs a restore (taking Cider.restore's keyword arguments) and
+        returns what happened.
+        """
+        with _captured() as capture:
+            self.cider.restore(**kwargs)
+        return RestoreResult(
+            steps=[StepResult(e["step"], e["status"], e["duration"])
+                   for e in capture.of("step_finished")],
+            packages=_packages(capture),
+            links=_links(capture),
+            defaults=_defaults(capture),
+            messages=_messages(capture),
+        )
+
+    def relink(self, force=None):
+        with _captured() as capture:
+            self.cider.relink(force)
+        return _links(capture)
+
+    def apply_defaults(self):
+        with _captured() as capture:
+            self.cider.apply_defaults()
+        return _defaults(capture)
+
+    def adopt(self, confirm=None):
+        """
+        Adds installed formulas, casks and taps that aren't bootstrapped
+        to the bootstrap file, each kind only if `confirm(kind, names)`
+        returns true (by default, all of them). Returns the added names by
+        kind.
+        """
+        confirm = confirm if confirm is not None else (lambda *args: True)
+        status = self.status()
+        added = {}
+        with _captured():
+            for kind in ("formulas", "casks", "taps"):
+                names = getattr(status, kind).extra
+                if not names or not confirm(kind, names):
+                    continue
+                if kind == "taps":
+                    self.cider.add_taps(names)
+                else:
+                    cider = Cider(kind == "casks", self.cider.debug,
+                                  self.cider.verbose, self.cider.cider_dir,
+                                  self.cider.support_dir, self.cider.home)
+                    cider.add_to_bootstrap(names)
+                added[kind] = names
+        return added
+
+
+def _packages(capture):
+    return [PackageResult(e["name"], e["cask"], e["status"])
+            for e in capture.of("package")]
+
+
+def _links(capture):
+    return [LinkResult(e.get("source"), e["target"], e["status"])
+            for e in capture.of("link")]
+
+
+def _defaults(capture):
+    return [DefaultResult(e["domain"], e["key"], e["status"])
+            for e in capture.of("default")]
+
+
+def _messages(capture):
+    return [Message(e["level"], e["message"])
+            for e in capture.of("message")]
@@ -4,42 +4,80 @@ from . import _osx as osx
 from . import _tty as tty
 from .exceptions import (
     UnsupportedOSError, XcodeMissingError, BrewMissingError,
-    SymlinkError, AppMissingError, StowError
+    CiderException, SymlinkError, AppMissingError, StowError,
+    DependencyError, MirrorError, ParserError
 )
+from ._complete import CompletionIndex, read_lines, read_tap, stat_key
+from ._fs import move
+from ._git import Repo
+from ._history import History
+from ._icons import IconCache
+from ._inventory import Inventory, git_head, same_default
+from ._journal import Journal, config_hash
 from ._lib import lazyproperty
+from ._lock import build_lock, current_steps, tap_drift
+from ._mirror import Mirror
+from ._native import brew_cache, brew_paths, which
+from ._pool import WorkerPool
+from ._requirements import (
+    developer_dir, fingerprint, has_xcode_tools, is_current,
+    probe as probe_requirements
+)
+from ._sched import Scheduler, run_step
+from ._status import (
+    defaults_status, drifted, link_status, package_status, tap_status
+)
+from ._scripts import ScriptRunner, parse_scripts
 from ._sh import (
-    Brew, Defaults, spawn, collapseuser, commonpath, curl, mkdir_p,
-    read_config, write_config, modify_config, isdirname, prompt
+    Brew, Defaults, spawn, collapseuser, commonpath, mkdir_p,
+    read_config, write_config, modify_config, parse_config, isdirname,
+    prompt, _listdir
 )
+from ._watch import watcher
 from fnmatch import fnmatch
+from functools import partial
 from glob import iglob
-from rfc3987 import parse as urlparse
-from tempfile import mkdtemp
 import click
+import copy
 import errno
 import json
 import os
-import platform
 import re
-import shutil
 import subprocess
+import threading
+import time
 
 _DEFAULTS_TRUE_RE = re.compile(r"\b(Y(ES)?|TRUE)\b", re.I)
 _DEFAULTS_FALSE_RE = re.compile(r"\b(N(O)?|FALSE)\b", re.I)
+_GLOB_MAGIC_RE = re.compile(r"[*?[]")
+
+# Step kinds in a restore plan; see Cider._restore_plan.
+_STEP_KINDS = ("taps", "formulas", "casks", "links", "defaults", "icons",
+               "scripts")
+
+# Steps a resumed restore can skip. Link groups are cheap and are always
+# rerun, since pruning dead links needs every group's targets.
+_JOURNALED_STEPS = ("taps", "formulas", "casks", "defaults", "icons",
+                    "scripts")
 
 
 class Cider(object):
     def __init__(self, cask=None, debug=None, verbose=None, cider_dir=None,
-                 support_dir=None):
+                 support_dir=None, home=None):
         self.cask = cask if cask is not None else False
         self.debug = debug if debug is not None else False
         self.verbose = verbose if verbose is not None else False
+        self.home = home if home is not None else os.path.expanduser("~")
         self.cider_dir = cider_dir if cider_dir is not None else \
             self.fallback_cider_dir()
         self.support_dir = support_dir if support_dir is not None else \
             self.fallback_support_dir()
         self.brew = Brew(cask, debug, verbose, self.env)
         self.defaults = Defaults(debug, self.env)
+        # Held while changing the link tree under home.
+        self._links_lock = threading.RLock()
+        self._completion_deferred = False
+        self._completion_pending = False
 
     @lazyproperty
     def symlink_dir(self):
@@ -66,26 +104,72 @@ class Cider(object):
         return env
 
     def fallback_cider_dir(self):
-        try:
-            return os.path.join(os.environ["XDG_CONFIG_HOME"], "cider")
-        except KeyError:
-            return os.path.join(os.path.expanduser("~"), ".cider")
+        config_home = self._xdg_dir("XDG_CONFIG_HOME")
+        if config_home is not None:
+            return os.path.join(config_home, "cider")
+        return os.path.join(self.home, ".cider")
 
     def fallback_support_dir(self):
-        try:
-            return os.path.join(os.environ["XDG_DATA_HOME"], "cider")
-        except KeyError:
-            return os.path.join(
-                os.path.expanduser("~"),
-                "Library",
-                "Application Support",
-                "com.msanders.cider"
-            )
+        return support_dir_for(self.home)
+
+    def _xdg_dir(self, name):
+        return _xdg_dir(name, self.home)
+
+    def expanduser(self, path):
+        if path == "~" or path.startswith("~" + os.sep):
+            return self.home + path[1:]
+        return os.path.expanduser(path)
+
+    def for_home(self, home):
+        """
+        Returns a Cider for another user's home, sharing this one's
+        cider_dir and bootstrap environment.
+        """
+        cider = copy.copy(self)
+        cider.home = home
+        cider.support_dir = cider.fallback_support_dir()
+        for attr in ("_symlink_targets_file", "_restore_journal_file",
+                     "_requirements_file", "_icon_cache",
+                     "_completion_index", "_history"):
+            cider.__dict__.pop(attr, None)
+        cider._env = dict(self.env, HOME=home)  # pylint: disable=W0201
+        cider.brew = Brew(self.cask, self.debug, self.verbose, cider.env)
+        cider.defaults = Defaults(self.debug, cider.env)
+        cider._links_lock = threading.RLock()  # pylint: disable=W0212
+        return cider
 
     @lazyproperty
     def symlink_targets_file(self):
         return os.path.join(self.support_dir, "symlink_targets.json")
 
+    @lazyproperty
+    def requirements_file(self):
+        return os.path.join(self.support_dir, "requirements.json")
+
+    @lazyproperty
+    def lock_file(self):
+        return os.path.join(self.cider_dir, "bootstrap.lock")
+
+    @lazyproperty
+    def restore_journal_file(self):
+        return os.path.join(self.support_dir, "restore.journal")
+
+    @lazyproperty
+    def icon_cache(self):
+        return IconCache(
+            os.path.join(self.support_dir, "icons"),
+            os.path.join(self.support_dir, "icons.json"),
+            self.debug
+        )
+
+    @lazyproperty
+    def completion_index(self):
+        return completion_index(self.support_dir)
+
+    @lazyproperty
+    def history(self):
+        return History(os.path.join(self.support_dir, "history.sqlite3"))
+
     def read_bootstrap(self):
         return read_config(self.bootstrap_file, {})
 
@@ -95,9 +179,9 @@ class Cider(object):
     def _check_cider_dir(self):
         if not os.path.isdir(self.cider_dir):
             os.mkdir(self.cider_dir)
-            print(tty.progress("Created cider dir at {0}".format(
+            tty.putprogress("Created cider dir at {0}".format(
                 self.cider_dir
-            )))
+            ))
 
     def _modify_bootstrap(self, key, transform=None, fallback=None):
         if transform is None:
@@ -113,7 +197,13 @@ class Cider(object):
             return bootstrap
 
         self._check_cider_dir()
-        return modify_config(self.bootstrap_file, outer_transform)
+        # Sorting is only for new entries; those already there keep their
+        # place in the file.
+        changed = modify_config(self.bootstrap_file, outer_transform,
+                                unordered=[key])
+        if changed:
+            self._update_completion()
+        return changed
 
     def _modify_defaults(self, domain, transform):
         def outer_transform(defaults):
@@ -121,7 +211,10 @@ class Cider(object):
             return defaults
 
         self._check_cider_dir()
-        return modify_config(self.defaults_file, outer_transform)
+        changed = modify_config(self.defaults_file, outer_transform)
+        if changed:
+            self._update_completion()
+        return changed
 
     def _cached_targets(self):
         return read_config(self.symlink_targets_file, [])
@@ -132,44 +225,47 @@ class Cider(object):
         write_config(self.symlink_targets_file, sorted(new_targets))
 
     def _remove_dead_targets(self, targets):
+        # Unfolded directories (with a trailing separator) are left to
+        # _refold.
         for target in targets:
-            if os.path.islink(target) and os.path.samefile(
-                self.cider_dir,
-                commonpath([
-                    self.cider_dir,
-                    os.path.realpath(target)
-                ]),
-            ):
+            if self._is_cider_link(target):
                 os.remove(target)
-                print(tty.progress("Removed dead symlink: {0}".format(
-                    collapseuser(target))
+                tty.putprogress("Removed dead symlink: {0}".format(
+                    collapseuser(target, self.home)
                 ))
+                tty.event("link", target=target, status="removed")
 
-    @staticmethod
-    def _remove_link_target(source, target):
-        if os.path.exists(target):
-            if os.path.samefile(os.path.realpath(target),
-                                os.path.realpath(source)):
-                os.remove(target)
-            else:
-                raise SymlinkError(
-                    "{0} symlink target already exists at: {1}".format(
-                        collapseuser(source), collapseuser(target)
-                    )
+    def _check_link_target(self, source, target):
+        if os.path.exists(target) and not os.path.samefile(
+            os.path.realpath(target), os.path.realpath(source)
+        ):
+            raise SymlinkError(
+                "{0} symlink target already exists at: {1}".format(
+                    collapseuser(source, self.home),
+                    collapseuser(target, self.home)
                 )
+            )
 
-    def _has_xcode_tools(self):
-        developer_dir = spawn(["/usr/bin/xcode-select", "-print-path"],
-                              check_output=True,
-                              debug=self.debug,
-                              env=self.env).strip()
-
-        return bool(os.path.isdir(developer_dir) and os.path.exists(
-            os.path.join(developer_dir, "usr", "bin", "git")
-        ))
+    def _remove_link_target(self, source, target):
+        self._check_link_target(source, target)
+        if os.path.exists(target):
+            os.remove(target)
 
     def _assert_requirements(self):
-        macos_version = platform.mac_ver()[0]
+        """
+        Checks for a supported macOS, the Command Line Tools and Homebrew.
+        What was found is cached in requirements.json and only probed
+        again once one of its inputs changed on disk.
+        """
+        try:
+            cached = read_config(self.requirements_file, {})
+        except ParserError:
+            cached = {}
+        if is_current(cached, self.env):
+            return
+
+        requirements = probe_requirements(self.env, self.debug)
+        macos_version = requirements["os_version"]
 
         if int(macos_version.split(".")[1]) < 9:
             raise UnsupportedOSError(
@@ -178,75 +274,446 @@ class Cider(object):
                 macos_version
             )
 
-        if not self._has_xcode_tools():
-            print(tty.progress("Installing the Command Line Tools (expect a "
-                               "GUI popup):"))
+        if not has_xcode_tools(requirements["developer_dir"]):
+            tty.putprogress("Installing the Command Line Tools (expect a "
+                            "GUI popup):")
             spawn(["/usr/bin/xcode-select", "--install"],
                   debug=self.debug, env=self.env)
             click.pause("Press any key when the installation is complete.")
-            if not self._has_xcode_tools():
+            requirements["developer_dir"] = developer_dir(self.env,
+                                                          self.debug)
+            requirements["fingerprint"] = fingerprint(self.env)
+            if not has_xcode_tools(requirements["developer_dir"]):
                 raise XcodeMissingError(
                     "Aborted Command Line Tools installation.",
                 )
 
-        if spawn(["which", "brew"], check_call=False, debug=self.debug,
-                 stdout=subprocess.PIPE,
-                 stderr=subprocess.PIPE,
-                 env=self.env):
+        if requirements["brew"] is None:
             raise BrewMissingError(
                 "Homebrew not installed",
                 "http://brew.sh/#install"
             )
 
+        mkdir_p(self.support_dir)
+        write_config(self.requirements_file, requirements)
+
     @staticmethod
     def _islinkkey(symlink, stow):
         return symlink == stow or symlink.startswith(os.path.join(stow, ""))
 
-    def restore(self, ignore_errors=None):
+    def restore(self, ignore_errors=None, jobs=None, resume=None,
+                use_lock=None, mirror=None, offline=None, no_update=None,
+                only=None, skip=None, tags=None):
         ignore_errors = ignore_errors if ignore_errors is not None else False
+        resume = resume if resume is not None else False
+        use_lock = use_lock if use_lock is not None else True
+        offline = offline if offline is not None else False
+        no_update = no_update if no_update is not None else False
         self._assert_requirements()
-        caskbrew = Brew(True, self.debug, self.verbose)
-        homebrew = Brew(False, self.debug, self.verbose)
-
         bootstrap = self.read_bootstrap()
-        casks = bootstrap.get("casks", [])
-        dependencies = bootstrap.get("dependencies", {})
+        defaults = self.read_defaults()
+        mirror = self._mirror(mirror, bootstrap)
+        if offline and mirror is None:
+            raise MirrorError(
+                "Restoring offline needs a mirror; pass --mirror or set "
+                "\"mirror\" in {0}".format(
+                    collapseuser(self.bootstrap_file, self.home)
+                )
+            )
 
-        self.run_scripts(before=True)
+        # Brew updates once up front (the "update" step) rather than before
+        # every install.
+        env = dict(self.env, HOMEBREW_NO_AUTO_UPDATE="1")
+        plan = self._restore_plan(bootstrap, ignore_errors, env)
+        plan.workers = jobs
+        if no_update:
+            plan.nodes["update"].fn = lambda: None
+
+        lock = read_config(self.lock_file, {}) if use_lock else {}
+        if lock:
+            self._apply_lock(plan, lock, bootstrap, defaults)
+
+        filtered = bool(only or skip or tags)
+        if filtered:
+            self._filter_plan(plan, bootstrap, only, skip, tags)
+
+        misses = []
+        if mirror is not None:
+            seeded = mirror.seed()
+            tty.putdebug("Seeded {0} downloads from {1}".format(
+                seeded, mirror.path
+            ), self.debug)
+            if offline:
+                self._apply_offline(plan, mirror, misses)
+
+        journal = Journal(
+            self.restore_journal_file,
+            config_hash(bootstrap, defaults)
+        )
+        skipped = journal.start(resume)
+        if resume:
+            if skipped:
+                tty.putprogress(
+                    "Resuming restore ({0} steps already completed)".format(
+                        skipped
+                    )
+                )
+            else:
+                tty.puterr("Nothing to resume; restoring from scratch",
+                           warning=True)
 
-        for tap in bootstrap.get("taps", []):
-            homebrew.tap(tap)
+        def on_skip(step):
+            tty.putdebug("Already completed: {0}".format(step), self.debug)
+            self._skip_step(step, "journal")
+
+        for node in plan.nodes.values():
+            if node.name.split("/", 1)[0] in _JOURNALED_STEPS:
+                node.fn = journal.wrap(node.name, node.fn, on_skip)
+
+        try:
+            plan.run()
+        finally:
+            if mirror is not None and not offline:
+                mirror.populate()
+
+        self._update_completion()
+        if misses:
+            raise MirrorError("Not in the mirror, skipped: {0}".format(
+                ", ".join(sorted(misses))
+            ))
+        if not filtered:
+            # A partial restore leaves what it completed for a later
+            # `restore --resume`.
+            journal.finish()
+
+    def _mirror(self, path=None, bootstrap=None):
+        """
+        Returns the Mirror at `path`, falling back to bootstrap["mirror"],
+        or None if neither is set.
+        """
+        bootstrap = bootstrap if bootstrap is not None else \
+            self.read_bootstrap()
+        path = path if path is not None else bootstrap.get("mirror")
+        if path is None:
+            return None
+        return Mirror(self.expanduser(path), brew_cache(self.env, self.home))
+
+    def _apply_offline(self, plan, mirror, misses):
+        """
+        Restricts a restore to what can be done without the network:
+        packages already installed are left alone, since upgrading them
+        would need a download, and packages and taps with nothing to
+        install from in the mirror are skipped and added to `misses`.
+        """
+        inventory = self.inventory()
+        pending = {"formulas": [], "casks": []}
+        for name in plan.nodes:
+            kind, entry = (name.split("/", 1) + [None])[:2]
+            if kind not in pending:
+                continue
+            if inventory.version(kind, entry) is not None:
+                plan.nodes[name].fn = partial(self._skip_step, name,
+                                              "offline")
+            else:
+                pending[kind].append(entry)
+
+        missed = set("taps/" + name for name in plan.nodes
+                     if name.startswith("taps/"))
+        for kind, entries in pending.items():
+            missed.update("{0}/{1}".format(kind, entry)
+                          for entry in mirror.misses(kind, entries))
+        for name in missed:
+            plan.nodes[name].fn = partial(self._mirror_miss, name, misses)
+        plan.nodes["outdated"].fn = lambda: None
+        plan.nodes["update"].fn = lambda: None
+
+    @staticmethod
+    def _mirror_miss(step, misses):
+        misses.append(step)
+        tty.event("mirror_miss", step=step)
+        tty.puterr("Not in the mirror: {0}".format(step), warning=True)
+        # Not completed, so a later online `restore --resume` retries it.
+        return False
+
+    def _filter_plan(self, plan, bootstrap, only=None, skip=None,
+                     tags=None):
+        """
+        Limits a restore to the steps matching `only` (sections such as
+        "links", or steps such as "casks/app" or "scripts/after") and, with
+        `tags`, to those bootstrap["tags"] lists under any of them, minus
+        those matching `skip`. The rest are skipped without being
+        journaled. Returns the selected steps.
+        """
+        selected = set(plan.nodes) - set(("update", "outdated"))
+        if only:
+            selected &= self._match_steps(plan, only)
+        if tags:
+            tagged = bootstrap.get("tags", {})
+            for tag in tags:
+                if tag not in tagged:
+                    tty.puterr("No entries are tagged {0}".format(tag),
+                               warning=True)
+            selected &= self._match_steps(
+                plan, [ref for tag in tags for ref in tagged.get(tag, [])]
+            )
+        selected -= self._match_steps(plan, skip or [])
+        if any(name.startswith("links/") and name not in selected
+               for name in plan.nodes):
+            # Pruning dead links needs every group's targets.
+            selected.discard("links")
+
+        for name, node in plan.nodes.items():
+            if name not in selected and name not in ("update", "outdated"):
+                node.fn = partial(self._filtered_step, name)
+        if not any(name.split("/", 1)[0] in ("taps", "formulas", "casks")
+                   for name in selected):
+            plan.nodes["outdated"].fn = lambda: None
+            plan.nodes["update"].fn = lambda: None
+        tty.putdebug("Restoring {0} of {1} steps".format(
+            len(selected), len(plan.nodes)
+        ), self.debug)
+        return selected
+
+    @staticmethod
+    def _match_steps(plan, refs):
+        """
+        Returns the steps each of `refs` names, itself or as a prefix ("casks"
+        or "links" for a whole section). Like bootstrap["dependencies"],
+        bare names refer to formulas, with or without their options.
+        """
+        matched = set()
+        for ref in refs:
+            kind = ref.split("/", 1)[0]
+            if kind not in _STEP_KINDS:
+                kind, ref = "formulas", "formulas/" + ref
+            elif kind == "taps":
+                ref = ref.lower()
+            steps = set(
+                name for name in plan.nodes
+                if name == ref or name.startswith(ref + "/") or (
+                    kind in ("formulas", "casks") and "/" in ref and
+                    name.startswith(kind + "/") and
+                    name.split("/", 1)[1].split()[0] == ref.split("/", 1)[1]
+                )
+            )
+            if not steps:
+                tty.puterr("Nothing to restore matches {0}".format(ref),
+                           warning=True)
+            matched |= steps
+        return matched
+
+    @staticmethod
+    def _filtered_step(step):
+        Cider._skip_step(step, "filtered")
+        # Not completed, so a later full `restore --resume` still runs it.
+        return False
+
+    def _apply_lock(self, plan, lock, bootstrap, defaults):
+        """
+        Turns restore steps that the lockfile shows are already done into
+        no-ops, so only entries that differ from it are acted on.
+        """
+        inventory = self.inventory()
+        current = current_steps(lock, bootstrap, defaults, inventory)
+        for tap, locked, revision in tap_drift(lock, inventory):
+            tty.puterr("{0} is at {1} (locked at {2})".format(
+                tap, revision, locked
+            ), warning=True)
+
+        for name in current:
+            if name in plan:
+                plan.nodes[name].fn = partial(self._skip_step, name, "lock")
+        if not any(name.startswith("formulas/") and name not in current
+                   for name in plan.nodes):
+            # Only installs and upgrades need to know what's outdated.
+            plan.nodes["outdated"].fn = lambda: None
+        if not any(name.split("/", 1)[0] in ("taps", "formulas", "casks")
+                   and name not in current for name in plan.nodes):
+            plan.nodes["update"].fn = lambda: None
+
+        tty.putdebug("Up to date with {0}: {1}".format(
+            collapseuser(self.lock_file, self.home), len(current)
+        ), self.debug)
+
+    @staticmethod
+    def _skip_step(step, reason):
+        tty.event("step_skipped", step=step, reason=reason)
+        kind, name = (step.split("/", 1) + [None])[:2]
+        if kind in ("formulas", "casks"):
+            tty.event("package", name=name, cask=kind == "casks",
+                      status="skipped")
+
+    def inventory(self):
+        homebrew = Brew(False, self.debug, self.verbose, self.env)
+        return Inventory(homebrew.prefix(), homebrew.repository(), self.home)
+
+    def lock(self):
+        """
+        Writes bootstrap.lock with the installed version of every formula
+        and cask, the revision of every tap and a hash of every applied
+        defaults domain.
+        """
+        lock, unlocked = build_lock(self.read_bootstrap(),
+                                    self.read_defaults(), self.inventory())
+        for step in unlocked:
+            tty.puterr("Not installed or applied, leaving unlocked: "
+                       "{0}".format(step), warning=True)
+
+        self._check_cider_dir()
+        write_config(self.lock_file, lock)
+        tty.puts("Locked {0} entries in {1}".format(
+            sum(len(lock[kind]) for kind in
+                ("formulas", "casks", "taps", "defaults")),
+            collapseuser(self.lock_file, self.home)
+        ))
 
-        outdated = homebrew.outdated()
+    def _restore_plan(self, bootstrap, ignore_errors=None, env=None):
+        """
+        Builds the restore DAG. Steps are named after the bootstrap
+        entries they come from ("taps/user/repo", "formulas/<formula>",
+        "casks/<cask>", "links/<glob>", "defaults/<domain>", "icons",
+        "scripts/before", "scripts/after"), which is also how entries in
+        bootstrap["dependencies"] refer to them. Package installs share the
+        "brew" resource so only one runs at a time, while independent steps
+        such as links and defaults run alongside them. Taps and packages
+        wait on a single "update" of brew, which runs unless brew updated
+        within HOMEBREW_AUTO_UPDATE_SECS. A package named with its tap
+        ("user/repo/name") waits on that tap, and one named without on
+        every tap.
+        """
+        ignore_errors = ignore_errors if ignore_errors is not None else False
+        caskbrew = Brew(True, self.debug, self.verbose, env)
+        homebrew = Brew(False, self.debug, self.verbose, env)
+        plan = Scheduler()
+
+        before = "scripts/before"
+        plan.add(before, lambda: self.run_scripts(before=True))
+
+        plan.add("update",
+                 partial(homebrew.update, _update_window(env)),
+                 [before], resource="brew")
+
+        taps = bootstrap.get("taps", [])
+        present = set(homebrew.installed_taps()) if taps else set()
+        for tap in taps:
+            node = "taps/" + tap.lower()
+            if tap.lower() not in present and node not in plan:
+                plan.add(node, partial(homebrew.tap, tap),
+                         [before, "update"])
+
+        outdated = []
+        plan.add("outdated",
+                 lambda: outdated.extend(homebrew.outdated()),
+                 [before, "update"])
+
+        def add_package(kind, entry):
+            node = "{0}/{1}".format(kind, entry)
+            if node in plan:
+                return node
+
+            deps = [before, "update"]
+            tap = _tap_for(entry)
+            if tap is not None:
+                if "taps/" + tap in plan:
+                    deps.append("taps/" + tap)
+            else:
+                # A short name may come from any of the taps being cloned.
+                deps += sorted(node for node in plan.nodes
+                               if node.startswith("taps/"))
+
+            def install():
+                if kind == "casks":
+                    return caskbrew.safe_install(entry, ignore_errors)
+                return homebrew.safe_install(entry, ignore_errors,
+                                             entry in outdated)
+
+            if kind == "formulas":
+                deps.append("outdated")
+            plan.add(node, install, deps, resource="brew")
+            return node
 
         for formula in bootstrap.get("formulas", []):
-            if formula in dependencies:
-                deps = dependencies[formula]
-                deps = deps if isinstance(deps, list) else [deps]
-
-                # Currently only cask dependencies are supported.
-                deps = (dep for dep in deps if dep.startswith("casks/"))
-
-                for dep in deps:
-                    cask = dep.split("/")[1]
-                    print(tty.progress(
-                        "Installing {0} dependency for {1}").format(
-                            cask, formula
-                        )
-                    )
+            add_package("formulas", formula)
+        for cask in bootstrap.get("casks", []):
+            add_package("casks", cask)
+
+        linked = {}
+        for source_glob, target in sorted(
+            bootstrap.get("symlinks", {}).items()
+        ):
+            plan.add("links/" + source_glob,
+                     partial(self._link_group, source_glob, target,
+                             results=linked),
+                     [before], resource="links")
+        plan.add(
+            "links",
+            lambda: self._prune_targets(
+                [t for ts in linked.values() for t in ts]
+            ),
+            [node for node in plan.nodes if node.startswith("links/")],
+            resource="links"
+        )
 
-                    caskbrew.safe_install(cask, ignore_errors)
-                    del casks[casks.index(cask)]
+        for domain, options in sorted(self.read_defaults().items()):
+            plan.add("defaults/" + domain,
+                     partial(self._apply_domain, domain, options),
+                     [before])
+        plan.add(
+            "defaults",
+            lambda: tty.puts("Applied defaults"),
+            [node for node in plan.nodes if node.startswith("defaults/")]
+        )
+
+        plan.add("icons", self.apply_icons, [before])
 
-            homebrew.safe_install(formula, ignore_errors, formula in outdated)
+        for key, deps in sorted(bootstrap.get("dependencies", {}).items()):
+            node = self._resolve_step(plan, key, None, taps)
+            deps = deps if isinstance(deps, list) else [deps]
+            for dep in deps:
+                dep = self._resolve_step(plan, dep, add_package, taps)
+                if node is not None and dep is not None:
+                    plan.nodes[node].deps.append(dep)
 
-        for cask in casks:
-            caskbrew.safe_install(cask, ignore_errors)
+        # Icons are usually for apps installed from casks.
+        plan.nodes["icons"].deps += [
+            node for node in plan.nodes if node.startswith("casks/")
+        ]
+        plan.add("scripts/after", lambda: self.run_scripts(after=True),
+                 list(plan.nodes))
+        return plan
 
-        self.relink()
-        self.apply_defaults()
-        self.apply_icons()
-        self.run_scripts(after=True)
+    @staticmethod
+    def _resolve_step(plan, ref, add_package, taps):
+        """
+        Maps a bootstrap["dependencies"] entry to a restore step. Bare names
+        refer to formulas. Packages that aren't otherwise bootstrapped are
+        added to the plan via `add_package` so they get installed first, or
+        ignored if it is None. Returns None for steps that are skipped.
+        """
+        kind = ref.split("/", 1)[0]
+        if kind not in _STEP_KINDS:
+            kind, ref = "formulas", "formulas/" + ref
+        elif kind == "taps":
+            ref = ref.lower()
+
+        if ref in plan:
+            return ref
+
+        if kind in ("formulas", "casks") and "/" in ref:
+            # Allow referring to e.g. "foo" for "foo --with-option".
+            name = ref.split("/", 1)[1]
+            for node in plan.nodes:
+                if node.startswith(kind + "/") and \
+                   node.split("/", 1)[1].split()[0] == name:
+                    return node
+            return add_package(kind, name) if add_package else None
+
+        if kind == "taps" and ref.split("/", 1)[1] in (
+            tap.lower() for tap in taps
+        ):
+            return None
+
+        raise DependencyError("Unknown restore step: {0}".format(ref))
 
     def install(self, *formulas, **kwargs):
         formulas = list(formulas) or []
@@ -291,9 +758,7 @@ class Cider(object):
 
     def tap(self, tap):
         if tap is None:
-            tapped = self.tapped()
-            if tapped:
-                print("\n".join(tapped))
+            tty.putitems(self.tapped(), "taps")
         else:
             self.brew.tap(tap)
             self.add_taps([tap])
@@ -323,23 +788,17 @@ class Cider(object):
         else:
             tty.puterr("{0} tap not found in bootstrapped".format(tap))
 
-    @staticmethod
-    def expandtarget(source, target):
-        expanded = os.path.expanduser(target)
+    def expandtarget(self, source, target):
+        expanded = self.expanduser(target)
         if isdirname(target):
             return os.path.join(expanded, os.path.basename(source))
         return expanded
 
-    def expandtargets(self, source_glob, target):
-        if not isdirname(target) and ("*" in source_glob or
-                                      "?" in source_glob):
-            raise SymlinkError(
-                "Invalid symlink: {0} => {1} (did you mean to add a "
-                "trailing '/'?)".format(source_glob, target)
-            )
-
-        mkdir_p(os.path.dirname(os.path.expanduser(target)))
-        sources = iglob(os.path.join(self.symlink_dir, source_glob))
+    def expandtargets(self, source_glob, target, sources=None):
+        self._check_symlink(source_glob, target)
+        mkdir_p(os.path.dirname(self.expanduser(target)))
+        sources = sources if sources is not None else \
+            iglob(os.path.join(self.symlink_dir, source_glob))
         expanded = []
         for source in sources:
             source = os.path.join(self.cider_dir, source)
@@ -348,29 +807,647 @@ class Cider(object):
             expanded.append((source, source_target))
         return expanded
 
-    def relink(self, force=None):
+    @staticmethod
+    def _check_symlink(source_glob, target):
+        if not isdirname(target) and ("*" in source_glob or
+                                      "?" in source_glob):
+            raise SymlinkError(
+                "Invalid symlink: {0} => {1} (did you mean to add a "
+                "trailing '/'?)".format(source_glob, target)
+            )
+
+    def link_index(self, bootstrap=None):
+        """
+        Expands every symlinks glob once, returning a list of
+        (source_glob, target, sources) that relink can reuse across homes.
+        """
+        bootstrap = bootstrap if bootstrap is not None else \
+            self.read_bootstrap()
+        index = []
+        for source_glob, target in bootstrap.get("symlinks", {}).items():
+            self._check_symlink(source_glob, target)
+            sources = list(iglob(os.path.join(self.symlink_dir, source_glob)))
+            index.append((source_glob, target, sources))
+        return index
+
+    def relink(self, force=None, index=None):
         force = force if force is not None else False
-        symlinks = self.read_bootstrap().get("symlinks", {})
-        old_targets = self._cached_targets()
+        index = index if index is not None else self.link_index()
         new_targets = []
 
-        for source_glob, target in symlinks.items():
-            for source, expanded_target in self.expandtargets(source_glob,
-                                                              target):
-                if self.mklink(source, expanded_target, force):
-                    new_targets.append(expanded_target)
+        for source_glob, target, sources in index:
+            new_targets += run_step(
+                "links/" + source_glob,
+                partial(self._link_group, source_glob, target, force,
+                        sources=sources)
+            )
 
-        self._remove_dead_targets(set(old_targets) - set(new_targets))
-        self._update_target_cache(new_targets)
+        return run_step("links", partial(self._prune_targets, new_targets))
+
+    def _link_group(self, source_glob, target, force=None, results=None,
+                    sources=None):
+        # Groups sharing a target directory may fold or unfold it.
+        with self._links_lock:
+            unfolded = set(path for path in self._cached_targets()
+                           if path.endswith(os.sep))
+            sources = list(sources if sources is not None else
+                           iglob(os.path.join(self.symlink_dir, source_glob)))
+            root = self._group_root(source_glob, target, sources)
+            if root is not None:
+                mkdir_p(os.path.dirname(root[1]))
+                linked = self._link_tree(root[0], root[1], force, unfolded)
+            else:
+                linked = self._unfold_root(source_glob, target, sources)
+                for source, expanded_target in self.expandtargets(
+                    source_glob, target, sources
+                ):
+                    linked += self._link_tree(source, expanded_target,
+                                              force, unfolded)
+        if results is not None:
+            results[source_glob] = linked
+        return linked
+
+    def _group_root(self, source_glob, target, sources):
+        """
+        Returns (source directory, target directory) if the group links
+        every entry of one directory (e.g. "foo/*" => "~/.config/foo/")
+        into a directory that doesn't exist yet, or that it already
+        folded, so the directory itself can be linked instead. Returns
+        None otherwise.
+        """
+        directory, pattern = os.path.split(os.path.normpath(source_glob))
+        if not isdirname(target) or target == "~" or not directory or \
+           _GLOB_MAGIC_RE.search(directory) or \
+           not _GLOB_MAGIC_RE.search(pattern) or not sources:
+            return None
+        source = os.path.join(self.symlink_dir, directory)
+        root = self.expanduser(target).rstrip(os.sep)
+        if not os.path.isdir(source) or sorted(os.listdir(source)) != \
+           sorted(os.path.basename(path) for path in sources):
+            return None
+        if os.path.lexists(root) and not (
+            self._is_cider_link(root) and
+            os.path.realpath(root) == os.path.realpath(source)
+        ):
+            return None
+        return source, root
+
+    def _unfold_root(self, source_glob, target, sources):
+        """
+        Unfolds a group's target directory that _group_root folded once
+        the group no longer covers its whole source directory, dropping
+        links to entries it doesn't match. Returns the new targets.
+        """
+        root = self.expanduser(target).rstrip(os.sep)
+        if not isdirname(target) or not self._is_cider_link(root):
+            return []
+        own = os.path.realpath(root) == os.path.realpath(os.path.join(
+            self.symlink_dir, os.path.dirname(os.path.normpath(source_glob))
+        ))
+        expected = set(self.expandtarget(source, target)
+                       for source in sources)
+        linked = []
+        for link in self._unfold(root):
+            # Another group's folded directory keeps all its links.
+            if link in expected or not own:
+                linked.append(link)
+            else:
+                os.remove(link)
+        return linked + [root + os.sep]
+
+    def _link_tree(self, source, target, force=None, unfolded=None):
+        """
+        Links `target` to `source`, folding directories like GNU stow: a
+        directory is linked as a whole unless its target is already a
+        real directory, or a link to another directory in cider_dir, in
+        which case it's unfolded and each entry linked inside it instead.
+        Returns the links now owned by cider, plus the directories it
+        unfolded (with a trailing separator, as in the target cache).
+        """
+        unfolded = unfolded if unfolded is not None else set()
+        if not os.path.isdir(source) or os.path.islink(source):
+            return [target] if self.mklink(source, target, force) else []
+
+        linked = []
+        if self._is_cider_link(target) and os.path.isdir(target) and \
+           not os.path.samefile(os.path.realpath(target),
+                                os.path.realpath(source)):
+            linked += self._unfold(target)
+            unfolded.add(target + os.sep)
+        if not os.path.isdir(target) or os.path.islink(target):
+            return [target] if self.mklink(source, target, force) else []
+
+        if target + os.sep in unfolded:
+            linked.append(target + os.sep)
+        for name in sorted(os.listdir(source)):
+            linked += self._link_tree(os.path.join(source, name),
+                                      os.path.join(target, name), force,
+                                      unfolded)
+        return linked
+
+    def _is_cider_link(self, target):
+        return os.path.islink(target) and os.path.samefile(
+            self.cider_dir,
+            commonpath([self.cider_dir, os.path.realpath(target)])
+        )
+
+    def _unfold(self, target):
+        """
+        Replaces a folded link to a directory with a real directory of
+        links to its entries. Returns the new links.
+        """
+        source = os.path.join(os.path.dirname(target), os.readlink(target))
+        os.remove(target)
+        os.mkdir(target)
+        tty.putprogress("Unfolded {0}".format(collapseuser(target,
+                                                           self.home)))
+        tty.event("link", source=source, target=target, status="unfolded")
+        linked = []
+        for name in sorted(os.listdir(source)):
+            if self.mklink(os.path.join(source, name),
+                           os.path.join(target, name)):
+                linked.append(os.path.join(target, name))
+        return linked
+
+    def _refold(self, targets, directories):
+        """
+        Tidies up the directories cider unfolded, deepest first: removes
+        those left empty and folds those whose entries are again all links
+        into a single directory in cider_dir back into one link. Returns
+        the updated targets.
+        """
+        targets = set(targets)
+        for directory in sorted(directories, reverse=True):
+            path = directory.rstrip(os.sep)
+            if not os.path.isdir(path) or os.path.islink(path):
+                targets.discard(directory)
+                continue
+            entries = [os.path.join(path, name)
+                       for name in os.listdir(path)]
+            if not entries:
+                os.rmdir(path)
+                targets.discard(directory)
+                continue
+
+            parents = set(
+                os.path.dirname(os.path.join(path, os.readlink(entry)))
+                if self._is_cider_link(entry) else None
+                for entry in entries
+            )
+            if len(parents) != 1 or None in parents:
+                continue
+            source, = parents
+            if sorted(os.listdir(source)) != sorted(
+                os.path.basename(entry) for entry in entries
+            ):
+                continue
+
+            for entry in entries:
+                os.remove(entry)
+                targets.discard(entry)
+            os.rmdir(path)
+            targets.discard(directory)
+            if self.mklink(source, path):
+                targets.add(path)
+                tty.event("link", source=source, target=path,
+                          status="folded")
+        return sorted(targets)
+
+    def _prune_targets(self, new_targets):
+        with self._links_lock:
+            old_targets = self._cached_targets()
+            self._remove_dead_targets(set(old_targets) - set(new_targets))
+            directories = set(path for path in set(old_targets) |
+                              set(new_targets) if path.endswith(os.sep))
+            if directories:
+                new_targets = self._refold(new_targets, directories)
+            self._update_target_cache(new_targets)
         return new_targets
 
+    def provision(self, homes, force=None, scripts=None, jobs=None):
+        """
+        Relinks each of `homes` (and with `scripts`, runs the before/after
+        scripts with HOME set to it) on a worker pool. The bootstrap is
+        parsed and its globs expanded once for every home. Returns the
+        homes that failed.
+        """
+        force = force if force is not None else False
+        scripts = scripts if scripts is not None else False
+        bootstrap = self.read_bootstrap()
+        index = self.link_index(bootstrap)
+
+        def provision_home(home):
+            start = time.time()
+            try:
+                if not os.path.isdir(home):
+                    raise OSError(errno.ENOENT, "No such home directory",
+                                  home)
+                cider = self.for_home(home)
+                owner = _home_owner(home)
+                # pylint: disable=W0212
+                created = cider._missing_dirs(index) if owner else []
+                if scripts:
+                    cider.run_scripts(before=True, bootstrap=bootstrap)
+                linked = cider.relink(force, index=index)
+                if scripts:
+                    cider.run_scripts(after=True, bootstrap=bootstrap)
+                if owner:
+                    cider._chown_created(owner, created, linked)
+            except (CiderException, subprocess.CalledProcessError,
+                    OSError, IOError) as e:
+                tty.event("home_finished", home=home, status="failed",
+                          error=str(e),
+                          duration=round(time.time() - start, 3))
+                return e
+            tty.event("home_finished", home=home, status="ok",
+                      links=len(linked),
+                      duration=round(time.time() - start, 3))
+            return len(linked)
+
+        with WorkerPool(jobs) as pool:
+            results = pool.map(provision_home, homes)
+
+        failed = []
+        for home, result in zip(homes, results):
+            if isinstance(result, Exception):
+                tty.puterr("{0}: {1}".format(home, result))
+                failed.append(home)
+            else:
+                tty.puts(tty.success("{0} links".format(result), home))
+        return failed
+
+    def _missing_dirs(self, index):
+        """
+        Returns the directories under home that relinking with `index`, and
+        writing to support_dir, may create.
+        """
+        paths = [os.path.join(self.support_dir, "")] + [
+            self.expandtarget(source, target)
+            for _, target, sources in index for source in sources
+        ]
+        home = os.path.normpath(self.home)
+        missing = set()
+        for path in paths:
+            path = os.path.dirname(path)
+            while path.startswith(home + os.sep) and \
+                    not os.path.lexists(path):
+                missing.add(path)
+                path = os.path.dirname(path)
+        return sorted(missing)
+
+    def _chown_created(self, owner, created, linked):
+        """
+        Gives the directories in `created` that now exist, the `linked`
+        targets and everything under support_dir to `owner`, a (uid, gid)
+        pair, since provisioning as root would otherwise leave them owned
+        by root.
+        """
+        paths = [path for path in created if os.path.isdir(path)]
+        paths += [path.rstrip(os.sep) for path in linked]
+        for root, _, files in os.walk(self.support_dir):
+            paths.append(root)
+            paths += [os.path.join(root, name) for name in files]
+        for path in paths:
+            os.lchown(path, *owner)
+
+    def watch(self, force=None, debounce=None, poll=None, interval=None):
+        """
+        Relinks once, then watches symlink_dir and the bootstrap file and
+        applies only the link changes implied by each batch of changed
+        paths, until interrupted.
+        """
+        force = force if force is not None else False
+        symlinks = self.read_bootstrap().get("symlinks", {})
+        groups = {}
+        for source_glob, target in symlinks.items():
+            self._link_group(source_glob, target, force, results=groups)
+        self._prune_targets(sum(groups.values(), []))
+
+        roots = [(self.cider_dir, False), (self.symlink_dir, True)]
+        with watcher(roots, poll=poll, interval=interval) as changes:
+            tty.putinfo("Watching {0} for changes...".format(
+                collapseuser(self.cider_dir, self.home)
+            ))
+            try:
+                while True:
+                    changed = changes.wait(debounce)
+                    tty.putdebug("Changed: {0}".format(
+                        ", ".join(sorted(changed))
+                    ), self.debug)
+                    try:
+                        symlinks = self._relink_changed(
+                            changed, symlinks, groups, force
+                        )
+                    except CiderException as e:
+                        tty.puterr(e, prefix="Error:")
+            except KeyboardInterrupt:
+                pass
+
+    def _relink_changed(self, changed, symlinks, groups, force=None):
+        """
+        Re-expands the link groups affected by `changed` and prunes links
+        that no longer belong to any group. `groups` maps each source glob
+        to its current targets and is updated in place. Returns the
+        symlinks mapping now in effect.
+        """
+        touched = set()
+        stale = False
+        # The cider_dir root itself means events were dropped.
+        if changed & set(os.path.abspath(path) for path in (
+            self.bootstrap_file, self.cider_dir
+        )):
+            new_symlinks = self.read_bootstrap().get("symlinks", {})
+            for source_glob, target in symlinks.items():
+                if new_symlinks.get(source_glob) != target:
+                    stale = groups.pop(source_glob, None) is not None or stale
+            touched.update(
+                source_glob for source_glob, target in new_symlinks.items()
+                if symlinks.get(source_glob) != target
+            )
+            symlinks = new_symlinks
+
+        for path in changed:
+            touched.update(source_glob for source_glob in symlinks
+                           if self._affects_group(path, source_glob,
+                                                  symlinks[source_glob]))
+
+        for source_glob in sorted(touched):
+            self._link_group(source_glob, symlinks[source_glob], force,
+                             results=groups)
+
+        if touched or stale:
+            self._prune_targets(sum(groups.values(), []))
+        return symlinks
+
+    def _affects_group(self, path, source_glob, target=None):
+        """
+        Returns True if adding or removing `path` can change what
+        `source_glob` (linked to `target`) expands to, i.e. it is a match
+        or a directory on the way to one, or is inside a match and lands
+        in a real directory under home (one cider unfolded, or that was
+        already there) rather than inside a folded link.
+        """
+        relpath = os.path.relpath(path, self.symlink_dir)
+        if relpath == os.curdir:
+            return True
+        if relpath.startswith(os.pardir):
+            return False
+
+        parts = relpath.split(os.sep)
+        patterns = os.path.normpath(source_glob).split(os.sep)
+        for part, pattern in zip(parts, patterns):
+            # Like glob(), wildcards don't match dotfiles.
+            if part.startswith(".") and not pattern.startswith("."):
+                return False
+            if not fnmatch(part, pattern):
+                return False
+        if len(parts) <= len(patterns):
+            return True
+        if target is None:
+            return False
+
+        match = os.path.join(self.symlink_dir, *parts[:len(patterns)])
+        parent = os.path.dirname(os.path.join(
+            self.expandtarget(match, target), *parts[len(patterns):]
+        ))
+        # Entries of a folded directory show up through its link.
+        return not os.path.realpath(parent).startswith(
+            os.path.join(os.path.realpath(self.cider_dir), "")
+        )
+
+    def sync(self, rev_range=None, force=None, dry_run=None):
+        """
+        Applies only what changed in cider_dir between two commits (by
+        default ORIG_HEAD..HEAD, i.e. what the last `git pull` brought
+        in): runs new or changed scripts, installs added taps and
+        packages, untaps removed taps, relinks the link groups whose
+        mapping or sources changed, writes changed defaults keys and
+        deletes removed ones, and applies changed icons. Packages removed
+        from the bootstrap stay installed, as with restore. The checkout
+        is expected to be at the end of the range. Returns the names of
+        the steps, which are only listed with `dry_run`.
+        """
+        dry_run = dry_run if dry_run is not None else False
+        repo = Repo(self.cider_dir, self.env, self.debug)
+        old, new = repo.resolve(rev_range)
+        changed = repo.changed(old, new)
+        tty.putdebug("Changed between {0} and {1}: {2}".format(
+            old[:7], new[:7], ", ".join(sorted(changed)) or "nothing"
+        ), self.debug)
+
+        configs = []
+        for rev in (old, new):
+            configs.append([
+                parse_config(repo.show(rev, os.path.relpath(
+                    path, self.cider_dir
+                )), path) or {}
+                for path in (self.bootstrap_file, self.defaults_file)
+            ])
+        (old_bootstrap, old_defaults), (bootstrap, defaults) = configs
+        steps = self._sync_steps(old_bootstrap, bootstrap, old_defaults,
+                                 defaults, changed, force)
+
+        if dry_run:
+            tty.putitems((name for name, _ in steps), "steps")
+        elif not steps:
+            tty.puts("Nothing to sync")
+        else:
+            for name, fn in steps:
+                run_step(name, fn)
+            if old_bootstrap != bootstrap or old_defaults != defaults:
+                self._update_completion()
+        return [name for name, _ in steps]
+
+    def _sync_steps(self, old_bootstrap, bootstrap, old_defaults, defaults,
+                    changed, force=None):
+        """
+        Maps the differences between two versions of the bootstrap and
+        defaults, and the files `changed` ({path: git status}) between
+        them, to a list of (step name, fn), in the order restore would
+        run them.
+        """
+        homebrew = Brew(False, self.debug, self.verbose, self.env)
+        caskbrew = Brew(True, self.debug, self.verbose, self.env)
+        steps = []
+
+        scripts = {}
+        for phase in ("before", "after"):
+            scripts[phase] = self._changed_scripts(old_bootstrap, bootstrap,
+                                                   changed, phase)
+        if scripts["before"][0]:
+            steps.append(("scripts/before",
+                          partial(self._run_some_scripts,
+                                  *scripts["before"])))
+
+        old_taps = set(tap.lower() for tap in old_bootstrap.get("taps", []))
+        taps = set(tap.lower() for tap in bootstrap.get("taps", []))
+        for tap in bootstrap.get("taps", []):
+            if tap.lower() not in old_taps:
+                steps.append(("taps/" + tap.lower(),
+                              partial(homebrew.tap, tap)))
+        for kind, brew in (("formulas", homebrew), ("casks", caskbrew)):
+            old_entries = set(old_bootstrap.get(kind, []))
+            for entry in bootstrap.get(kind, []):
+                if entry not in old_entries:
+                    steps.append(("{0}/{1}".format(kind, entry),
+                                  partial(brew.safe_install, entry)))
+        for tap in sorted(old_taps - taps):
+            steps.append(("untap/" + tap, partial(self._sync_untap,
+                                                  homebrew, tap)))
+
+        old_symlinks = old_bootstrap.get("symlinks", {})
+        symlinks = bootstrap.get("symlinks", {})
+        groups = self._changed_groups(old_symlinks, symlinks, changed)
+        if groups:
+            linked = {}
+            for source_glob in sorted(groups & set(symlinks)):
+                steps.append(("links/" + source_glob,
+                              partial(self._link_group, source_glob,
+                                      symlinks[source_glob], force,
+                                      results=linked)))
+            steps.append(("links", partial(self._prune_groups, groups,
+                                           linked)))
+
+        for domain in sorted(set(old_defaults) | set(defaults)):
+            old_options = old_defaults.get(domain) or {}
+            options = defaults.get(domain) or {}
+            written = dict(
+                (key, value) for key, value in options.items()
+                if not same_default(old_options, key, value)
+            )
+            deleted = sorted(set(old_options) - set(options))
+            if written or deleted:
+                steps.append(("defaults/" + domain,
+                              partial(self._sync_domain, domain, written,
+                                      deleted)))
+
+        old_icons = old_bootstrap.get("icons") or {}
+        icons = dict((app, icon) for app, icon in
+                     (bootstrap.get("icons") or {}).items()
+                     if old_icons.get(app) != icon)
+        if icons:
+            steps.append(("icons", partial(self._sync_icons, icons)))
+
+        if scripts["after"][0]:
+            steps.append(("scripts/after",
+                          partial(self._run_some_scripts,
+                                  *scripts["after"])))
+        return steps
+
+    @staticmethod
+    def _changed_scripts(old_bootstrap, bootstrap, changed, phase):
+        """
+        Returns (scripts, known) for the `phase` scripts that are new, whose
+        command changed, or with an input among the `changed` files.
+        """
+        selected = {phase: True}
+        old_scripts = dict((script.name, script.run) for script in
+                           parse_scripts(old_bootstrap, **selected)[0])
+        scripts, known = parse_scripts(bootstrap, **selected)
+        return [
+            script for script in scripts
+            if old_scripts.get(script.name) != script.run or any(
+                fnmatch(path, pattern)
+                for pattern in script.inputs or [] for path in changed
+            )
+        ], known
+
+    def _run_some_scripts(self, scripts, known):
+        ScriptRunner(self.cider_dir, self.support_dir, self.env,
+                     self.debug).run(scripts, known)
+
+    @staticmethod
+    def _sync_untap(homebrew, tap):
+        try:
+            homebrew.untap(tap)
+        except subprocess.CalledProcessError:
+            tty.puterr("Couldn't untap {0}; is anything from it still "
+                       "installed?".format(tap), warning=True)
+
+    def _changed_groups(self, old_symlinks, symlinks, changed):
+        """
+        Returns the link groups that were added, removed or retargeted, or
+        whose sources were added or removed.
+        """
+        groups = set(
+            source_glob for source_glob in set(old_symlinks) | set(symlinks)
+            if old_symlinks.get(source_glob) != symlinks.get(source_glob)
+        )
+        for path, status in changed.items():
+            if status not in ("A", "D"):
+                continue
+            path = os.path.join(self.cider_dir, path)
+            groups.update(
+                source_glob for source_glob in symlinks
+                if self._affects_group(path, source_glob,
+                                       symlinks[source_glob])
+            )
+        return groups
+
+    def _in_group(self, source, source_glob):
+        """
+        Returns True if `source` is a match of `source_glob` or inside one.
+        """
+        relpath = os.path.relpath(source, self.symlink_dir)
+        if relpath.startswith(os.pardir):
+            return False
+        parts = relpath.split(os.sep)
+        patterns = os.path.normpath(source_glob).split(os.sep)
+        if len(parts) < len(patterns):
+            return False
+        return all(
+            fnmatch(part, pattern) and
+            (pattern.startswith(".") or not part.startswith("."))
+            for part, pattern in zip(parts, patterns)
+        )
+
+    def _prune_groups(self, groups, linked):
+        """
+        Prunes the dead links of `groups` alone: links from other groups
+        in the target cache are kept as they are.
+        """
+        def owned(target):
+            if not os.path.islink(target):
+                return False
+            source = os.path.join(os.path.dirname(target),
+                                  os.readlink(target))
+            # A group folded at its root links the glob's directory.
+            return any(self._in_group(source, source_glob) or
+                       source == os.path.join(self.symlink_dir,
+                                              os.path.dirname(source_glob))
+                       for source_glob in groups)
+
+        kept = [target for target in self._cached_targets()
+                if target.endswith(os.sep) or not owned(target)]
+        return self._prune_targets(sorted(set(
+            kept + [target for targets in linked.values()
+                    for target in targets]
+        )))
+
+    def _sync_domain(self, domain, written, deleted):
+        if written:
+            self._apply_domain(domain, written)
+        for key in deleted:
+            try:
+                self.defaults.delete(domain, key)
+            except subprocess.CalledProcessError:
+                continue  # Already unset.
+            tty.event("default", domain=domain, key=key, status="deleted")
+
+    def _sync_icons(self, icons):
+        try:
+            for app, icon in sorted(icons.items()):
+                self._apply_icon(app, icon)
+        finally:
+            self.icon_cache.save()
+
     def mklink(self, source, target, force=None):
         linked = False
 
         if not os.path.exists(source):
             raise SymlinkError(
                 "symlink source \"{0}\" does not exist".format(
-                    collapseuser(source)
+                    collapseuser(source, self.home)
                 )
             )
 
@@ -378,9 +1455,10 @@ class Cider(object):
             os.symlink(source, target)
             linked = True
             tty.puts("symlinked {0} -> {1}".format(
-                tty.color(collapseuser(target), tty.MAGENTA),
-                collapseuser(source)
+                tty.color(collapseuser(target, self.home), tty.MAGENTA),
+                collapseuser(source, self.home)
             ))
+            tty.event("link", source=source, target=target, status="created")
         except OSError as e:
             if e.errno != errno.EEXIST:
                 raise
@@ -392,26 +1470,35 @@ class Cider(object):
                 ):
                     linked = True
                     tty.putdebug("Already linked: {0} -> {1}".format(
-                        tty.color(collapseuser(target), tty.MAGENTA),
-                        collapseuser(source)
+                        tty.color(collapseuser(target, self.home),
+                                  tty.MAGENTA),
+                        collapseuser(source, self.home)
                     ), self.debug)
+                    tty.event("link", source=source, target=target,
+                              status="unchanged")
                 else:
                     fmt = "Linked to wrong target: {0} -> {1} (instead of {2})"
                     tty.puterr(fmt.format(
                         tty.color(target, tty.MAGENTA),
-                        os.path.realpath(collapseuser(target)),
-                        os.path.realpath(collapseuser(source))
+                        os.path.realpath(collapseuser(target, self.home)),
+                        os.path.realpath(collapseuser(source, self.home))
                     ), warning=force)
+                    tty.event("link", source=source, target=target,
+                              status="conflict", reason="wrong_target")
             else:
                 tty.puterr("{0} symlink target already exists at: {1}".format(
-                    collapseuser(source),
-                    collapseuser(target)
+                    collapseuser(source, self.home),
+                    collapseuser(target, self.home)
                 ), warning=force)
+                tty.event("link", source=source, target=target,
+                          status="conflict", reason="exists")
 
         if not linked and force:
             try:
                 osx.move_to_trash(target)
-                print(tty.progress("Moved {0} to trash").format(target))
+                tty.putprogress("Moved {0} to trash".format(target))
+                tty.event("link", source=source, target=target,
+                          status="trashed")
             except OSError as e:
                 tty.puterr("Error moving {0} to trash: {1}".format(
                     target, str(e))
@@ -459,38 +1546,250 @@ class Cider(object):
         return sorted(set(brewed) - set(bootstrapped))
 
     def ls(self, formula):
-        formulas = self.installed(formula)
-        if formulas:
-            print("\n".join(formulas))
-        else:
+        key = "casks" if self.cask else "formulas"
+        if not tty.putitems(self.installed(formula), key):
             tty.puterr("nothing to list", prefix="Error")
 
-    def list_missing(self):
+    def list_missing(self, confirm=None):
+        """
+        Lists installed packages missing from the bootstrap file and adds
+        them if `confirm(items)` (by default, a y/N prompt) agrees.
+        """
+        confirm = confirm if confirm is not None else _confirm_add
         missing_items = self.missing()
         if missing_items:
             suffix = "s" if len(missing_items) != 1 else ""
             fmt = "{0} missing formula{1} (tip: try `brew uses " + \
                   "--installed` to see what's using it)"
             tty.puterr(fmt.format(len(missing_items), suffix), warning=True)
-            print("\n".join(missing_items) + "\n")
+            tty.putitems(missing_items, "missing")
 
-            if prompt("Add to bootstrap? [y/N] "):
+            if confirm(missing_items):
                 self.add_to_bootstrap(missing_items)
         else:
-            print("Everything up to date.")
+            tty.putinfo("Everything up to date.")
 
-    def list_missing_taps(self):
+    def list_missing_taps(self, confirm=None):
+        confirm = confirm if confirm is not None else _confirm_add
         missing_taps = self.missing_taps()
         if missing_taps:
             suffix = "s" if len(missing_taps) != 1 else ""
             fmt = "{0} missing tap{1}"
             tty.puterr(fmt.format(len(missing_taps), suffix), warning=True)
-            print("\n".join(missing_taps) + "\n")
+            tty.putitems(missing_taps, "missing_taps")
 
-            if prompt("Add to bootstrap? [y/N] "):
+            if confirm(missing_taps):
                 self.add_taps(missing_taps)
         else:
-            print("Everything up to date.")
+            tty.putinfo("Everything up to date.")
+
+    def status(self):
+        """
+        Gathers package, tap, link and defaults drift concurrently without
+        changing anything. Everything is read from disk; `defaults export`
+        is only spawned for domains whose preferences file can't be read.
+        """
+        bootstrap = self.read_bootstrap()
+        defaults = self.read_defaults()
+        inventory = self.inventory()
+        expected = [
+            (source, self.expandtarget(source, target))
+            for _, target, sources in self.link_index(bootstrap)
+            for source in sources
+        ]
+
+        with WorkerPool() as pool:
+            tasks = {
+                "formulas": pool.submit(package_status, bootstrap,
+                                        inventory, "formulas"),
+                "casks": pool.submit(package_status, bootstrap, inventory,
+                                     "casks"),
+                "taps": pool.submit(tap_status, bootstrap, inventory),
+                "links": pool.submit(link_status, expected,
+                                     self._cached_targets(),
+                                     self.cider_dir),
+                "defaults": pool.submit(defaults_status, defaults,
+                                        inventory, self.defaults.export),
+            }
+        return dict((key, task.result()) for key, task in tasks.items())
+
+    def print_status(self, as_json=None):
+        as_json = as_json if as_json is not None else False
+        status = self.status()
+        if tty.is_ndjson():
+            tty.event("status", **status)
+        elif as_json:
+            print(json.dumps(status, indent=4, sort_keys=True, default=str))
+        else:
+            self._print_status(status)
+        return drifted(status)
+
+    def _print_status(self, status):
+        if not drifted(status):
+            tty.putinfo("Everything up to date.")
+            return
+
+        for kind in ("formulas", "casks", "taps"):
+            for key in ("missing", "extra"):
+                if status[kind][key]:
+                    tty.putprogress("{0} {1}: {2}".format(
+                        len(status[kind][key]), key, kind
+                    ))
+                    tty.putitems(status[kind][key], "{0}_{1}".format(
+                        kind, key
+                    ))
+
+        if status["links"]:
+            tty.putprogress("{0} links need attention".format(
+                len(status["links"])
+            ))
+            tty.putitems(("{0}: {1} -> {2}".format(
+                link["status"], collapseuser(link["target"], self.home),
+                collapseuser(link["source"], self.home)
+            ) for link in status["links"]), "links")
+
+        if status["defaults"]:
+            tty.putprogress("{0} defaults changed".format(
+                len(status["defaults"])
+            ))
+            tty.putitems(("{0} {1}: {2!r} (expected {3!r})".format(
+                change["domain"], change["key"], change["actual"],
+                change["expected"]
+            ) for change in status["defaults"]), "defaults")
+
+    def run_history(self, command, limit=None):
+        """
+        Returns the latest runs of `command`, newest first, and the steps
+        of the newest one that were significantly slower than usual.
+        """
+        runs = self.history.runs(command, limit)
+        slow = self.history.slow_steps(command, runs[0]["id"]) if runs \
+            else []
+        return {"command": command, "runs": runs, "slow": slow}
+
+    def print_history(self, command, limit=None, as_json=None):
+        as_json = as_json if as_json is not None else False
+        history = self.run_history(command, limit)
+        if tty.is_ndjson():
+            tty.event("history", **history)
+            return
+        if as_json:
+            print(json.dumps(history, indent=4, sort_keys=True))
+            return
+        if not history["runs"]:
+            tty.putinfo("No {0} runs recorded yet.".format(command))
+            return
+
+        tty.putprogress("Last {0} {1} runs".format(
+            len(history["runs"]), command
+        ))
+        tty.putitems(("{0}  {1:8.1f}s  {2}".format(
+            time.strftime("%Y-%m-%d %H:%M",
+                          time.localtime(run["started"])),
+            run["duration"],
+            "ok" if not run["exit_code"] else
+            "exit {0}".format(run["exit_code"])
+        ) for run in history["runs"]), "runs")
+
+        if history["slow"]:
+            tty.putprogress("{0} steps slower than usual in the last run"
+                            .format(len(history["slow"])))
+            tty.putitems(("{0}: {1:.1f}s (median {2:.1f}s over {3} runs)"
+                          .format(step["step"], step["duration"],
+                                  step["median"], step["runs"])
+                          for step in history["slow"]), "slow")
+
+    def completion_sources(self):
+        """
+        Returns the (source_id, key, reader) sources of the completion
+        index: the bootstrap, defaults, stowed names, preference domains,
+        brew's lists of formula and cask names and every tap checkout.
+        Keys are stat() results or git revisions, so checking them never
+        spawns anything.
+        """
+        preferences = os.path.join(self.home, "Library", "Preferences")
+        sources = [
+            ("bootstrap", stat_key(self.bootstrap_file),
+             self._bootstrap_names),
+            ("defaults", stat_key(self.defaults_file),
+             lambda: (("domain", domain) for domain in self.read_defaults())),
+            ("stow", stat_key(self.symlink_dir),
+             lambda: (("stow", name) for name in _listdir(self.symlink_dir))),
+            ("preferences", stat_key(preferences),
+             partial(self._preference_domains, preferences)),
+        ]
+
+        api_dir = os.path.join(brew_cache(self.env, self.home), "api")
+        for kind in ("formula", "cask"):
+            path = os.path.join(api_dir, kind + "_names.txt")
+            sources.append(("api/" + kind, stat_key(path),
+                            partial(read_lines, path, kind)))
+
+        brew = which("brew", self.env.get("PATH"))
+        paths = brew_paths(brew) if brew is not None else None
+        if paths is not None:
+            taps_dir = os.path.join(paths[1], "Library", "Taps")
+            for user in _listdir(taps_dir):
+                for repo in _listdir(os.path.join(taps_dir, user)):
+                    tap_dir = os.path.join(taps_dir, user, repo)
+                    sources.append((
+                        "taps/{0}/{1}".format(user, repo),
+                        git_head(tap_dir) or stat_key(tap_dir),
+                        partial(read_tap, tap_dir)
+                    ))
+        return sources
+
+    @staticmethod
+    def _preference_domains(preferences):
+        if not os.path.isdir(preferences):
+            return
+        for name in os.listdir(preferences):
+            if name.endswith(".plist"):
+                yield "domain", os.path.splitext(name)[0]
+
+    def _bootstrap_names(self):
+        bootstrap = self.read_bootstrap()
+        for kind in ("formulas", "casks"):
+            for entry in bootstrap.get(kind, []):
+                yield "bootstrap-" + kind[:-1], entry.split()[0]
+        for tap in bootstrap.get("taps", []):
+            yield "tap", tap
+        for app in bootstrap.get("icons", {}):
+            yield "icon", app
+
+    def refresh_completion(self):
+        """
+        Builds the shell completion index, or updates it with the sources
+        that changed since.
+        """
+        refreshed = self.completion_index.refresh(self.completion_sources())
+        tty.puts("Refreshed {0} completion sources".format(len(refreshed)))
+        tty.putinfo("Enable completion in bash with: "
+                    "eval \"$(_CIDER_COMPLETE=source_bash cider)\"")
+
+    def _update_completion(self):
+        if self._completion_deferred:
+            self._completion_pending = True
+        # Only kept up to date once `cider completion` created it.
+        elif self.completion_index.exists():
+            self.completion_index.refresh(self.completion_sources())
+
+    def defer_completion(self):
+        """
+        Holds off refreshing the completion index after config edits until
+        flush_completion, so a command editing several entries (e.g.
+        `cider install a b c`) rebuilds it once.
+        """
+        self._completion_deferred = True
+
+    def flush_completion(self):
+        self._completion_deferred = False
+        if self._completion_pending:
+            self._completion_pending = False
+            self._update_completion()
+
+    def complete(self, kind, prefix):
+        return self.completion_index.query(kind, prefix)
 
     @staticmethod
     def json_value(value):
@@ -528,19 +1827,28 @@ class Cider(object):
     def apply_defaults(self):
         defaults = self.read_defaults()
         for domain, options in defaults.items():
-            for key, value in options.items():
-                self.defaults.write(domain, key, value)
+            run_step("defaults/" + domain,
+                     partial(self._apply_domain, domain, options))
 
         tty.puts("Applied defaults")
 
-    def run_scripts(self, before=None, after=None):
-        bootstrap = self.read_bootstrap()
-        scripts = []
-        scripts += bootstrap.get("before-scripts", []) if before else []
-        scripts += bootstrap.get("after-scripts", []) if after else []
-        for script in scripts:
-            spawn([script], shell=True, debug=self.debug,
-                  cwd=self.cider_dir, env=self.env)
+    def _apply_domain(self, domain, options):
+        current = self.defaults.export(domain)
+        for key, value in options.items():
+            if same_default(current, key, value):
+                tty.event("default", domain=domain, key=key,
+                          status="unchanged")
+                continue
+            self.defaults.write(domain, key, value)
+            tty.event("default", domain=domain, key=key, status="written")
+
+    def run_scripts(self, before=None, after=None, bootstrap=None):
+        bootstrap = bootstrap if bootstrap is not None else \
+            self.read_bootstrap()
+        scripts, known = parse_scripts(bootstrap, before, after)
+        if scripts:
+            ScriptRunner(self.cider_dir, self.support_dir, self.env,
+                         self.debug).run(scripts, known)
 
     def set_icon(self, app, icon):
         def transform(icons):
@@ -548,7 +1856,8 @@ class Cider(object):
             return icons
 
         self._modify_bootstrap("icons", transform, {})
-        _apply_icon(app, icon)
+        self._apply_icon(app, icon, force=True)
+        self.icon_cache.save()
 
     def remove_icon(self, app):
         def transform(icons):
@@ -562,43 +1871,78 @@ class Cider(object):
 
         self._modify_bootstrap("icons", transform)
         osx.remove_icon(app_path)
+        self.icon_cache.forget(app_path)
+        self.icon_cache.save()
 
     def apply_icons(self):
         bootstrap = read_config(self.bootstrap_file)
         icons = bootstrap.get("icons", {})
-        for app, icon in icons.items():
-            _apply_icon(app, icon)
+        try:
+            fetched = self.icon_cache.fetch_all(icons.values())
+            for app, icon in sorted(icons.items()):
+                self._apply_icon(app, icon, fetched=fetched[icon])
+        finally:
+            self.icon_cache.save()
 
         tty.puts("Applied icons")
 
+    def _apply_icon(self, app, icon, fetched=None, force=None):
+        force = force if force is not None else False
+        app_path = osx.path_for_app(app)
+        if not app_path:
+            raise AppMissingError("Application not found: '{0}'".format(app))
+
+        icon_path, digest = fetched or self.icon_cache.fetch(icon)
+        if not force and self.icon_cache.is_applied(app_path, digest):
+            tty.putdebug("Icon unchanged: {0}".format(app), self.debug)
+            return False
+
+        osx.set_icon(app_path, icon_path)
+        self.icon_cache.mark_applied(app_path, digest)
+        return True
+
     def add_symlink(self, name, target):
-        target = collapseuser(os.path.normpath(target))
-        target_dir = os.path.dirname(target)
+        return self.add_symlinks(name, [target])
 
-        # Add trailing slash for globbing.
-        if target_dir != "~":
-            target_dir = os.path.join(target_dir, "")
+    def add_symlinks(self, name, targets):
+        def add(symlinks, target):
+            target = collapseuser(os.path.normpath(target), self.home)
+            target_dir = os.path.dirname(target)
 
-        def transform(symlinks):
+            # Add trailing slash for globbing.
+            if target_dir != "~":
+                target_dir = os.path.join(target_dir, "")
+
+            # glob() skips dotfiles unless the pattern itself is dotted.
+            dotted = os.path.basename(target).startswith(".")
             for key in symlinks:
+                basename = os.path.basename(key)
                 if (os.path.dirname(key) == name and
-                   fnmatch(os.path.basename(target), os.path.basename(key))):
+                   fnmatch(os.path.basename(target), basename) and
+                   basename.startswith(".") == dotted):
                     return symlinks
 
-            dotted = os.path.basename(target).startswith(".")
             pattern = "{0}/{1}*".format(name, "." if dotted else "")
             symlinks[pattern] = target_dir
             return symlinks
 
+        def transform(symlinks):
+            for target in targets:
+                symlinks = add(symlinks, target)
+            return symlinks
+
         return self._modify_bootstrap("symlinks", transform, {})
 
     def remove_symlink(self, name):
+        return self.remove_symlinks([name])
+
+    def remove_symlinks(self, names):
         def transform(symlinks):
             if symlinks:
                 to_delete = []
                 for key in symlinks.keys():
-                    if self._islinkkey(key, name):
-                       to_delete.append(key)
+                    if any(self._islinkkey(key, name) for name in names):
+                        to_delete.append(key)
                 for key in to_delete:
                     del symlinks[key]
             return symlinks
@@ -606,13 +1950,20 @@ class Cider(object):
         return self._modify_bootstrap("symlinks", transform)
 
     def addlink(self, name, *items):
+        """
+        Moves each item into the `name` stow directory and links it back.
+        Every item is validated before anything is moved, and the bootstrap
+        and target cache are each written once for the whole batch.
+        """
+        stow_path = os.path.join(self.symlink_dir, name)
+        moves = []
+        seen = set()
         for item in items:
-            stow_path = os.path.join(self.symlink_dir, name)
             stow_fpath = os.path.join(stow_path, os.path.basename(item))
             if not os.path.exists(item):
                 raise StowError(
                     "Can't link {0}: No such file or directory".format(
-                        collapseuser(item)
+                        collapseuser(item, self.home)
                     )
                 )
 
@@ -620,68 +1971,146 @@ class Cider(object):
                 os.path.realpath(stow_fpath), os.path.realpath(item)
             )
 
-            if os.path.exists(stow_fpath) and not samefile:
+            if (os.path.exists(stow_fpath) and not samefile) or \
+               stow_fpath in seen:
                 raise StowError("Link already exists at {0}".format(
-                    collapseuser(stow_fpath)
+                    collapseuser(stow_fpath, self.home)
                 ))
 
+            seen.add(stow_fpath)
+            moves.append((item, stow_fpath, samefile))
+
+        targets = []
+        for item, stow_fpath, samefile in moves:
             if not samefile:
                 mkdir_p(stow_path)
-                shutil.move(item, stow_path)
+                move(item, stow_fpath)
 
             target = os.path.abspath(item)
-            self.add_symlink(name, target)
             self.mklink(stow_fpath, target)
-            self._update_target_cache(self._cached_targets() + [target])
+            targets.append(target)
 
-    def unlink(self, name):
+        self.add_symlinks(name, targets)
+        self._update_target_cache(
+            set(self._cached_targets()) | set(targets)
+        )
+
+    def unlink(self, *names):
+        """
+        Moves every file linked from the given stow names back into place.
+        All names and targets are checked before anything is moved, and the
+        bootstrap and target cache are each written once.
+        """
         symlinks = self.read_bootstrap().get("symlinks", {})
 
+        moves = []
+        seen = set()
+        for name in names:
+            found = False
+            for source_glob, target in sorted(symlinks.items()):
+                if self._islinkkey(source_glob, name):
+                    found = True
+                    for source, target in self.expandtargets(source_glob,
+                                                             target):
+                        # Repeated names and overlapping globs resolve to
+                        # the same targets; move each back only once.
+                        if target in seen:
+                            continue
+                        seen.add(target)
+                        self._check_link_target(source, target)
+                        moves.append((source, target))
+
+            if not found:
+                raise StowError("No symlink found with name: {0}".format(
+                    name
+                ))
+
         removed_targets = set()
-        found = False
-        for source_glob, target in symlinks.items():
-            if self._islinkkey(source_glob, name):
-                found = True
-                for source, target in self.expandtargets(source_glob, target):
-                    self._remove_link_target(source, target)
-                    removed_targets.add(target)
-                    shutil.move(source, target)
-                    print(tty.progress("Moved {0} -> {1}".format(
-                        collapseuser(source),
-                        collapseuser(target)
-                    )))
-
-        if not found:
-            raise StowError("No symlink found with name: {0}".format(name))
+        for source, target in moves:
+            self._remove_link_target(source, target)
+            removed_targets.add(target)
+            move(source, target)
+            tty.putprogress("Moved {0} -> {1}".format(
+                collapseuser(source, self.home),
+                collapseuser(target, self.home)
+            ))
 
-        try:
-            os.rmdir(os.path.join(self.symlink_dir, name))
-        except OSError as e:
-            if e.errno != errno.ENOTEMPTY:
-                raise e
+        for name in names:
+            try:
+                os.rmdir(os.path.join(self.symlink_dir, name))
+            except OSError as e:
+                if e.errno not in (errno.ENOTEMPTY, errno.ENOENT):
+                    raise e
 
-        self.remove_symlink(name)
+        self.remove_symlinks(list(names))
         self._update_target_cache(
             set(self._cached_targets()) - removed_targets
         )
 
 
-def _apply_icon(app, icon):
-    app_path = osx.path_for_app(app)
-    if not app_path:
-        raise AppMissingError("Application not found: '{0}'".format(app))
-
+def support_dir_for(home):
+    """
+    Returns the support dir a Cider for `home` uses when none is given.
+    """
+    data_home = _xdg_dir("XDG_DATA_HOME", home)
+    if data_home is not None:
+        return os.path.join(data_home, "cider")
+    return os.path.join(
+        home,
+        "Library",
+        "Application Support",
+        "com.msanders.cider"
+    )
+
+
+def completion_index(support_dir):
+    return CompletionIndex(
+        os.path.join(support_dir, "completion.index"),
+        os.path.join(support_dir, "completion.json")
+    )
+
+
+def _home_owner(home):
+    """
+    Returns the (uid, gid) owning `home` when running as root for another
+    user, otherwise None.
+    """
+    if not hasattr(os, "geteuid") or os.geteuid() != 0:
+        return None
+    st = os.stat(home)
+    if st.st_uid == 0:
+        return None
+    return st.st_uid, st.st_gid
+
+
+def _update_window(env):
+    """
+    Returns HOMEBREW_AUTO_UPDATE_SECS from `env`, or None (i.e. brew's
+    default) when it's unset or, as brew treats it, not a number.
+    """
     try:
-        components = urlparse(icon)
-        if not components["scheme"] or components['scheme'] == "file":
-            icon_path = components["path"]
-        else:
-            tmpdir = mkdtemp()
-            icon_path = os.path.join(tmpdir,
-                                     os.path.basename(components["path"]))
-            print(tty.progress("Downloading {0} icon: {1}".format(app, icon)))
-            curl(icon, icon_path)
-    except ValueError:
-        icon_path = icon
-
-    osx.set_icon(app_path, os.path.expanduser(icon_path))
+        return int((env or {}).get("HOMEBREW_AUTO_UPDATE_SECS"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _xdg_dir(name, home):
+    # XDG variables belong to the invoking user, not to other homes.
+    if os.path.normpath(home) == os.path.normpath(os.path.expanduser("~")):
+        return os.environ.get(name)
+    return None
+
+
+def _tap_for(name):
+    """
+    Returns the tap a fully-qualified formula or cask (e.g.
+    "user/repo/formula --with-option") belongs to, or None.
+    """
+    parts = name.split()[0].split("/") if name.strip() else []
+    if len(parts) != 3:
+        return None
+    return "/".join(parts[:2]).lower()
+
+
+def _confirm_add(items):  # pylint: disable=W0613
+    return prompt("\nAdd to bootstrap? [y/N] ")
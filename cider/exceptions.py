@@ -29,6 +29,16 @@ class BrewMissingError(CiderException):
         self.url = url
 
 
+class DownloadError(CiderException):
+    def __init__(self, message, url, exit_code=None):
+        CiderException.__init__(self, message, exit_code)
+        self.url = url
+
+
+class DependencyError(CiderException):
+    pass
+
+
 class XcodeMissingError(CiderException):
     pass
 
@@ -43,3 +53,15 @@ class AppMissingError(CiderException):
 
 class StowError(CiderException):
     pass
+
+
+class MirrorError(CiderException):
+    pass
+
+
+class DaemonError(CiderException):
+    pass
+
+
+class GitError(CiderException):
+    pass
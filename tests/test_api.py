@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from cider import Api, Cider
+from cider import _tty as tty
+from cider.api import DefaultResult, Drift, LinkResult
+from cider._sh import write_config
+
+try:
+    from mock import MagicMock
+except ImportError:
+    from unittest.mock import MagicMock  # pylint: disable=F0401,E0611
+
+
+def _drift(missing=None, extra=None):
+    return {"missing": missing or [], "extra": extra or []}
+
+
+def test_status(capsys):
+    cider = MagicMock()
+    cider.status.return_value = {
+        "formulas": _drift(["git"]), "casks": _drift(), "taps": _drift(),
+        "links": [{"source": "a", "target": "b", "status": "missing"}],
+        "defaults": [],
+    }
+    status = Api(cider).status()
+    assert status.formulas == Drift(["git"], [])
+    assert status.links == [LinkResult("a", "b", "missing")]
+    assert status.drifted
+
+    cider.status.return_value["formulas"] = _drift()
+    cider.status.return_value["links"] = []
+    assert not Api(cider).status().drifted
+    assert capsys.readouterr() == ("", "")
+
+
+def test_relink_and_defaults(capsys):
+    def relink(force):
+        tty.puts("Relinked")
+        tty.event("link", source="a", target="b", status="created")
+        tty.event("link", target="c", status="removed")
+
+    def apply_defaults():
+        tty.event("default", domain="d", key="k", status="written")
+        tty.puts("Applied defaults")
+
+    cider = MagicMock()
+    cider.relink.side_effect = relink
+    cider.apply_defaults.side_effect = apply_defaults
+    api = Api(cider)
+    assert api.relink() == [LinkResult("a", "b", "created"),
+                            LinkResult(None, "c", "removed")]
+    assert api.apply_defaults() == [DefaultResult("d", "k", "written")]
+    assert capsys.readouterr() == ("", "")
+    assert tty.get_output() == tty.TEXT
+
+
+def test_plan(tmpdir):
+    cider = Cider(cider_dir=str(tmpdir.join("cider")),
+                  support_dir=str(tmpdir.join("support")), home=str(tmpdir))
+    tmpdir.join("cider").ensure(dir=True)
+    write_config(cider.bootstrap_file, {"formulas": ["git"],
+                                        "casks": ["app"]})
+    steps = dict((step.name, step) for step in Api(cider).plan())
+    assert steps["formulas/git"].deps == [
+        "scripts/before", "update", "outdated"
+    ]
+    assert steps["casks/app"].resource == "brew"
+    assert not any(step.current for step in steps.values())
+
+
+def test_adopt(tmpdir):
+    cider = Cider(cider_dir=str(tmpdir.join("cider")),
+                  support_dir=str(tmpdir.join("support")), home=str(tmpdir))
+    api = Api(cider)
+    api.status = MagicMock(return_value=MagicMock(
+        formulas=Drift([], ["git"]), casks=Drift([], ["app"]),
+        taps=Drift([], ["user/tap"]),
+    ))
+    confirm = MagicMock(side_effect=lambda kind, names: kind != "taps")
+    assert api.adopt(confirm) == {"formulas": ["git"], "casks": ["app"]}
+    confirm.assert_called_with("taps", ["user/tap"])
+    assert cider.read_bootstrap() == {"formulas": ["git"], "casks": ["app"]}
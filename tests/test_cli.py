@@ -4,6 +4,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 from cider import _cli as cli
 from click.testing import CliRunner
 from pytest import nonempty_list_of
+import json
 import pytest
 
 try:
@@ -140,13 +141,34 @@ class TestCiderCLI(object):
                       debug=debug,
                       verbose=verbose,
                       expected_flags={
-                          "ignore_errors": False
+                          "ignore_errors": False,
+                          "jobs": None,
+                          "resume": False,
+                          "use_lock": True,
+                          "mirror": None,
+                          "offline": False,
+                          "no_update": False,
+                          "only": [],
+                          "skip": [],
+                          "tags": []
                       })
 
+    def test_lock(self, debug, verbose):
+        _test_command("lock", debug=debug, verbose=verbose)
+
+    def test_completion(self, debug, verbose):
+        _test_command(("completion", "refresh_completion"), debug=debug,
+                      verbose=verbose)
+
     @pytest.mark.randomize(force=bool)
     def test_relink(self, debug, verbose, force):
         _test_command("relink", debug=debug, verbose=verbose, force=force)
 
+    @pytest.mark.randomize(force=bool, poll=bool)
+    def test_watch(self, debug, verbose, force, poll):
+        _test_command("watch", debug=debug, verbose=verbose, force=force,
+                      poll=poll, expected_flags={"debounce": None})
+
     @pytest.mark.randomize(name=str, sources=nonempty_list_of(str),
                            min_length=1)
     def test_addlink(self, debug, verbose, name, sources):
@@ -162,6 +184,61 @@ class TestCiderCLI(object):
         return "NSGlobalDomain", name, key
 
 
+@pytest.mark.parametrize("failed", [[], ["/home/b"]])
+def test_provision(failed):
+    with patch("cider._cli.Cider") as MockCider:
+        MockCider().provision.return_value = failed
+        result = CliRunner().invoke(
+            cli.cli, ["provision", "-j", "2", "/home/a", "/home/b"]
+        )
+
+    assert result.exit_code == (1 if failed else 0)
+    MockCider().provision.assert_called_with(
+        ("/home/a", "/home/b"), force=False, scripts=False, jobs=2
+    )
+
+
+@pytest.mark.parametrize("drifted", [False, True])
+def test_status(drifted):
+    with patch("cider._cli.Cider") as MockCider:
+        MockCider().print_status.return_value = drifted
+        result = CliRunner().invoke(cli.cli, ["status", "--json"])
+
+    assert result.exit_code == (1 if drifted else 0)
+    MockCider().print_status.assert_called_with(as_json=True)
+
+
+def test_completer(tmpdir):
+    support_dir = str(tmpdir)
+    cli.completion_index(support_dir).refresh([
+        ("brew", "1", lambda: [("formula", "git"), ("formula", "git-lfs"),
+                               ("formula", "vim"), ("cask", "gimp")]),
+    ])
+    complete = cli.install.params[0].autocompletion
+    with patch("cider._cli.Cider") as MockCider, \
+            patch("cider._cli.support_dir_for", return_value=support_dir):
+        assert complete(None, [], "gi") == ["git", "git-lfs"]
+    assert not MockCider.called
+
+    # Completion never fails the shell, e.g. on an unreadable index.
+    with patch("cider._cli.completion_index", side_effect=OSError):
+        assert complete(None, [], "gi") == []
+
+
+def test_output_ndjson():
+    with patch("cider._cli.Cider"):
+        try:
+            result = CliRunner().invoke(cli.cli, ["--output=ndjson", "ls"])
+            assert cli.tty.is_ndjson()
+        finally:
+            cli.tty.set_output(cli.tty.TEXT)
+
+    assert not result.exception
+    event, = [json.loads(line) for line in result.output.splitlines()]
+    assert event["event"] == "command_started"
+    assert event["command"] == "ls"
+
+
 def _invoke_command(cmd, args, **flags):
     # TODO: Fix this
     start_flags = {
@@ -199,3 +276,27 @@ def _test_command(cmd, args=None, **flags):
 
 def _format_flags(flags):
     return ["--{0}".format(k) for k, v in flags.items() if v]
+
+
+def test_history():
+    with patch("cider._cli.Cider") as MockCider:
+        result = CliRunner().invoke(cli.cli, ["history", "relink", "-n", "5"])
+        assert not result.exception
+        MockCider().print_history.assert_called_with("relink", 5,
+                                                     as_json=False)
+
+        result = CliRunner().invoke(cli.cli, ["history", "ls"])
+        assert result.exit_code == 2
+
+
+def test_sync():
+    with patch("cider._cli.Cider") as MockCider:
+        result = CliRunner().invoke(cli.cli, ["sync", "v1..v2", "-n"])
+        assert not result.exception
+        MockCider().sync.assert_called_with("v1..v2", force=False,
+                                            dry_run=True)
+
+        result = CliRunner().invoke(cli.cli, ["sync"])
+        assert not result.exception
+        MockCider().sync.assert_called_with(None, force=False,
+                                            dry_run=False)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from cider import Cider
+from cider._complete import CompletionIndex, read_tap
+from cider._sh import write_config
+import os
+
+try:
+    from mock import MagicMock, patch
+except ImportError:
+    from unittest.mock import MagicMock, patch  # pylint: disable=F0401,E0611
+
+
+def _index(tmpdir):
+    return CompletionIndex(str(tmpdir.join("completion.index")),
+                           str(tmpdir.join("completion.json")))
+
+
+def test_query(tmpdir):
+    index = _index(tmpdir)
+    assert index.query("formula", "") == []
+
+    names = ["git", "git-lfs", "gitx", "go", "a", "z"]
+    index.refresh([
+        ("api", 1, lambda: (("formula", name) for name in names)),
+        ("tap", 1, lambda: [("formula", "git"), ("cask", "git-app")]),
+    ])
+    assert index.query("formula", "gi") == ["git", "git-lfs", "gitx"]
+    assert index.query("formula", "git-") == ["git-lfs"]
+    assert index.query("formula", "") == sorted(names)
+    assert index.query("cask", "g") == ["git-app"]
+    assert index.query("formula", "h") == []
+    assert index.query("form", "") == []
+
+
+def test_refresh_incremental(tmpdir):
+    index = _index(tmpdir)
+    api = MagicMock(return_value=[("formula", "git")])
+    stow = MagicMock(return_value=[("stow", "vim")])
+
+    assert index.refresh([("api", 1, api), ("stow", 1, stow)]) == [
+        "api", "stow"
+    ]
+    assert index.refresh([("api", 1, api), ("stow", 1, stow)]) == []
+
+    stow.reset_mock()
+    stow.return_value = [("stow", "zsh")]
+    assert index.refresh([("api", 2, api), ("stow", 1, stow)]) == ["api"]
+    assert not stow.called
+    assert index.query("stow", "") == ["vim"]
+
+    assert index.refresh([("stow", 2, stow)]) == ["stow"]
+    assert index.query("stow", "") == ["zsh"]
+    assert index.query("formula", "") == []
+
+
+def test_read_tap(tmpdir):
+    tmpdir.join("Formula", "g", "git.rb").ensure()
+    tmpdir.join("Formula", "README.md").ensure()
+    tmpdir.join("Casks", "app.rb").ensure()
+    assert sorted(read_tap(str(tmpdir))) == [
+        ("cask", "app"), ("formula", "git")
+    ]
+
+
+def test_completion_sources(tmpdir):
+    home = tmpdir.join("home")
+    home.join("Library", "Preferences", "com.apple.dock.plist").ensure()
+    repository = tmpdir.join("Homebrew")
+    repository.join("Library", "Homebrew").ensure(dir=True)
+    repository.join("Library", "Taps", "user", "homebrew-tap", "Formula",
+                    "tool.rb").ensure()
+    repository.join("bin", "brew").ensure().chmod(0o755)
+    cache = tmpdir.join("cache")
+    cache.join("api", "formula_names.txt").write("git\ngo\n", ensure=True)
+
+    cider = Cider(cider_dir=str(tmpdir.join("cider")),
+                  support_dir=str(tmpdir.join("support")), home=str(home))
+    cider._env = {  # pylint: disable=W0212
+        "PATH": str(repository.join("bin")), "HOMEBREW_CACHE": str(cache)
+    }
+    tmpdir.join("cider", "symlinks", "vim").ensure(dir=True)
+    write_config(cider.bootstrap_file, {
+        "formulas": ["git --HEAD"], "taps": ["user/tap"],
+        "icons": {"/Applications/App.app": "icon.icns"},
+    })
+    write_config(cider.defaults_file, {"NSGlobalDomain": {}})
+
+    cider.refresh_completion()
+    assert cider.complete("formula", "") == ["git", "go", "tool"]
+    assert cider.complete("bootstrap-formula", "") == ["git"]
+    assert cider.complete("domain", "") == [
+        "NSGlobalDomain", "com.apple.dock"
+    ]
+    assert cider.complete("stow", "v") == ["vim"]
+    assert cider.complete("tap", "") == ["user/tap"]
+    assert cider.complete("icon", "") == ["/Applications/App.app"]
+
+    # Edits through cider keep an existing index up to date.
+    cider.add_taps(["other/tap"])
+    assert cider.complete("tap", "") == ["other/tap", "user/tap"]
+    assert os.path.isfile(cider.completion_index.keys_file)
+
+    # Deferred, several edits refresh the index once, on flush.
+    cider.defer_completion()
+    with patch.object(cider.completion_index, "refresh",
+                      wraps=cider.completion_index.refresh) as refresh:
+        cider.add_taps(["a/tap", "b/tap"])
+        assert not refresh.called
+        cider.flush_completion()
+        assert refresh.call_count == 1
+    assert cider.complete("tap", "") == [
+        "a/tap", "b/tap", "other/tap", "user/tap"
+    ]
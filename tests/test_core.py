@@ -3,20 +3,23 @@
 from __future__ import absolute_import, print_function, unicode_literals
 from ._lib import random_case, random_str, touch
 from cider import Cider
-from cider.exceptions import SymlinkError, StowError
-from cider._sh import isdirname
+from cider.exceptions import (
+    SymlinkError, StowError, DependencyError, MirrorError
+)
+from cider._sh import isdirname, modify_config, read_config, write_config
 from pytest import list_of, dict_of, nonempty_list_of
 from glob import iglob
 import os
 import pytest
 import random
+import subprocess
 
 try:
     from contextlib import nested as empty
-    from mock import MagicMock, patch
+    from mock import ANY, MagicMock, patch
 except ImportError:
     from contextlib import ExitStack as empty  # noqa pylint: disable=E0611
-    from unittest.mock import MagicMock, patch  # pylint: disable=F0401,E0611
+    from unittest.mock import ANY, MagicMock, patch  # noqa pylint: disable=F0401,E0611
 
 
 @pytest.mark.randomize(cask=bool, debug=bool, verbose=bool)
@@ -257,6 +260,275 @@ class TestCiderCore(object):
         with patch("cider._osx.move_to_trash", side_effect=os.remove):
             assert cider.mklink(source, target, force=True)
 
+    def test_relink_changed(self, tmpdir, debug, verbose):
+        """
+        Tests that only groups affected by the changed paths are relinked,
+        that removed sources and groups have their links pruned, and that
+        bootstrap edits are picked up.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir.join("cider")),
+            support_dir=str(tmpdir.join("cider", ".cache"))
+        )
+        home = tmpdir.join("home")
+        for name in ("dots/.a", "dots/.b", "bin/tool"):
+            path = os.path.join(cider.symlink_dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            touch(path)
+        cider.add_symlinks("dots", [str(home.join(".a"))])
+        cider.add_symlinks("bin", [str(home.join("bin", "tool"))])
+
+        # pylint:disable=W0212
+        groups = {}
+        symlinks = cider.read_bootstrap()["symlinks"]
+        for source_glob, target in symlinks.items():
+            cider._link_group(source_glob, target, results=groups)
+        cider._prune_targets(sum(groups.values(), []))
+
+        def relink_changed(*paths):
+            changed = set(os.path.abspath(path) for path in paths)
+            return cider._relink_changed(changed, symlinks, groups)
+
+        # Edits inside a source don't touch any group.
+        cider.mklink = MagicMock(side_effect=cider.mklink)
+        relink_changed(os.path.join(cider.symlink_dir, "dots", ".a"))
+        cider.mklink.assert_any_call(ANY, str(home.join(".a")), None)
+        assert not any(call[0][1] == str(home.join("bin", "tool"))
+                       for call in cider.mklink.call_args_list)
+
+        touch(os.path.join(cider.symlink_dir, "dots", ".c"))
+        relink_changed(os.path.join(cider.symlink_dir, "dots", ".c"))
+        assert os.path.islink(str(home.join(".c")))
+
+        os.remove(os.path.join(cider.symlink_dir, "dots", ".b"))
+        relink_changed(os.path.join(cider.symlink_dir, "dots", ".b"))
+        assert not os.path.lexists(str(home.join(".b")))
+        assert str(home.join(".b")) not in cider._cached_targets()
+
+        # Dropping a group from the bootstrap prunes its links.
+        cider.remove_symlinks(["bin"])
+        symlinks = relink_changed(cider.bootstrap_file)
+        assert "bin/*" not in symlinks
+        assert not os.path.lexists(str(home.join("bin", "tool")))
+        assert os.path.islink(str(home.join(".a")))
+
+    def test_relink_folding(self, tmpdir, debug, verbose):
+        """
+        Tests that a directory only one group links into is linked whole,
+        unfolded once another group shares it, and folded again when that
+        group goes away.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir.join("cider")),
+            support_dir=str(tmpdir.join(".cache")),
+            home=str(tmpdir.join("home"))
+        )
+        home = tmpdir.join("home")
+        for name in ("vim/config/nvim/init.vim", "git/config/git/config",
+                     "git/gitconfig"):
+            touch(str(tmpdir.join("cider", "symlinks", name).ensure()))
+        config = str(home.join(".config"))
+        cider.read_bootstrap = MagicMock(return_value={
+            "symlinks": {"vim/config": "~/.config"}
+        })
+
+        cider.relink()
+        assert os.path.islink(config)
+        assert cider._cached_targets() == [config]  # pylint:disable=W0212
+
+        cider.read_bootstrap.return_value = {
+            "symlinks": {"vim/config": "~/.config",
+                         "git/config": "~/.config",
+                         "git/gitconfig": "~/.gitconfig"}
+        }
+        cider.relink()
+        assert not os.path.islink(config)
+        assert os.path.islink(os.path.join(config, "nvim"))
+        assert os.path.islink(os.path.join(config, "git"))
+        cached = cider._cached_targets()  # pylint:disable=W0212
+        assert config + os.sep in cached
+        assert sorted(cider.relink()) == sorted(
+            [config + os.sep, os.path.join(config, "nvim"),
+             os.path.join(config, "git"), str(home.join(".gitconfig"))]
+        )
+
+        cider.read_bootstrap.return_value = {
+            "symlinks": {"vim/config": "~/.config"}
+        }
+        assert cider.relink() == [config]
+        assert os.path.islink(config)
+        assert os.path.isfile(os.path.join(config, "nvim", "init.vim"))
+
+        # A real directory is shared without ever being folded.
+        os.remove(config)
+        touch(str(home.join(".config", "foreign").ensure()))
+        assert cider.relink() == [os.path.join(config, "nvim")]
+        cider.read_bootstrap.return_value = {"symlinks": {}}
+        assert cider.relink() == []
+        assert os.listdir(config) == ["foreign"]
+
+    def test_relink_group_root(self, tmpdir, debug, verbose):
+        """
+        Tests that a group linking a whole directory into one that doesn't
+        exist links the directory itself, unfolding it once the group no
+        longer matches every entry and folding it again after.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir.join("cider")),
+            support_dir=str(tmpdir.join(".cache")),
+            home=str(tmpdir.join("home"))
+        )
+        for name in ("init.vim", "plugins.vim"):
+            touch(str(tmpdir.join("cider", "symlinks", "vim", name).ensure()))
+        cider.read_bootstrap = MagicMock(return_value={
+            "symlinks": {"vim/*": "~/.config/vim/"}
+        })
+        root = str(tmpdir.join("home", ".config", "vim"))
+
+        assert cider.relink() == [root]
+        assert os.path.islink(root)
+
+        hidden = tmpdir.join("cider", "symlinks", "vim", ".hidden")
+        touch(str(hidden))
+        assert cider.relink() == [
+            root + os.sep, os.path.join(root, "init.vim"),
+            os.path.join(root, "plugins.vim"),
+        ]
+        assert not os.path.islink(root)
+        assert sorted(os.listdir(root)) == ["init.vim", "plugins.vim"]
+
+        hidden.remove()
+        assert cider.relink() == [root]
+        assert os.path.islink(root)
+
+        cider.read_bootstrap.return_value = {"symlinks": {}}
+        assert cider.relink() == []
+        assert not os.path.lexists(root)
+
+    def test_relink_changed_nested(self, tmpdir, debug, verbose):
+        """
+        Tests that watch relinks a group for a file added deep inside one
+        of its sources when it lands in an unfolded directory, but not when
+        a folded link already shows it.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir.join("cider")),
+            support_dir=str(tmpdir.join(".cache")),
+            home=str(tmpdir.join("home"))
+        )
+        for name in ("vim/config/nvim/init.vim", "git/config/git/config"):
+            touch(str(tmpdir.join("cider", "symlinks", name).ensure()))
+        symlinks = {"vim/config": "~/.config", "git/config": "~/.config"}
+        cider.read_bootstrap = MagicMock(return_value={"symlinks": symlinks})
+        config = str(tmpdir.join("home", ".config"))
+
+        # pylint:disable=W0212
+        groups = {}
+        for source_glob, target in symlinks.items():
+            cider._link_group(source_glob, target, results=groups)
+        cider._prune_targets(sum(groups.values(), []))
+        assert not os.path.islink(config)
+
+        cider._link_group = MagicMock(side_effect=cider._link_group)
+        folded = str(tmpdir.join("cider", "symlinks", "vim", "config",
+                                 "nvim", "plugin.vim").ensure())
+        cider._relink_changed(set([folded]), symlinks, groups)
+        assert not cider._link_group.called
+        assert os.path.isfile(os.path.join(config, "nvim", "plugin.vim"))
+
+        unfolded = str(tmpdir.join("cider", "symlinks", "vim", "config",
+                                   "ideavimrc").ensure())
+        cider._relink_changed(set([unfolded]), symlinks, groups)
+        cider._link_group.assert_called_once_with(
+            "vim/config", "~/.config", None, results=groups
+        )
+        assert os.path.islink(os.path.join(config, "ideavimrc"))
+
+    def test_provision(self, tmpdir, debug, verbose):
+        """
+        Tests that:
+        1. Links are created in every home, with a target cache per home.
+        2. The bootstrap is read once for all homes.
+        3. A failing home is reported without stopping the others.
+        """
+        cider = Cider(False, debug, verbose,
+                      cider_dir=str(tmpdir.join("cider")))
+        os.makedirs(os.path.join(cider.symlink_dir, "dots"))
+        touch(os.path.join(cider.symlink_dir, "dots", ".vimrc"))
+        cider.add_symlinks("dots", [os.path.join(cider.home, ".vimrc")])
+
+        homes = [str(tmpdir.join("home", name)) for name in ("a", "b")]
+        for home in homes:
+            os.makedirs(home)
+        missing = str(tmpdir.join("home", "missing"))
+
+        with patch("cider.core.read_config", wraps=read_config) as read:
+            failed = cider.provision(homes + [missing], jobs=2)
+            bootstrap_reads = [call for call in read.call_args_list
+                               if call[0][0] == cider.bootstrap_file]
+            assert len(bootstrap_reads) == 1
+
+        assert failed == [missing]
+        for home in homes:
+            target = os.path.join(home, ".vimrc")
+            assert os.path.islink(target)
+            assert os.path.samefile(
+                target, os.path.join(cider.symlink_dir, "dots", ".vimrc")
+            )
+            home_cider = cider.for_home(home)
+            targets = home_cider._cached_targets()  # pylint:disable=W0212
+            assert targets == [target]
+        assert not os.path.exists(missing)
+
+    @pytest.mark.skipif(not hasattr(os, "geteuid") or os.geteuid() != 0,
+                        reason="requires root")
+    def test_provision_owner(self, tmpdir, debug, verbose):
+        """
+        Tests that, run as root, what provision creates in a home belongs
+        to the home's owner.
+        """
+        cider = Cider(False, debug, verbose,
+                      cider_dir=str(tmpdir.join("cider")))
+        os.makedirs(os.path.join(cider.symlink_dir, "app"))
+        touch(os.path.join(cider.symlink_dir, "app", "config"))
+        cider.add_symlinks("app", [
+            os.path.join(cider.home, ".config", "app", "config")
+        ])
+
+        home = str(tmpdir.join("home", "a"))
+        os.makedirs(home)
+        os.chown(home, 4242, 4243)
+        assert cider.provision([home]) == []
+
+        home_cider = cider.for_home(home)
+        for path in (os.path.join(home, ".config"),
+                     os.path.join(home, ".config", "app"),
+                     os.path.join(home, "Library"),
+                     home_cider.support_dir,
+                     home_cider.symlink_targets_file):
+            assert (os.lstat(path).st_uid, os.lstat(path).st_gid) == \
+                (4242, 4243), path
+
+    @pytest.mark.parametrize("path,source_glob,expected", [
+        ("dots/.vimrc", "dots/.*", True),
+        ("dots/.vimrc", "dots/*", False),
+        ("dots", "dots/*", True),
+        ("dots/vim/colors/x.vim", "dots/*", False),
+        ("bin/tool", "dots/*", False),
+        (".", "dots/*", True),
+    ])
+    def test_affects_group(self, tmpdir, debug, verbose, path, source_glob,
+                           expected):
+        cider = Cider(False, debug, verbose, cider_dir=str(tmpdir))
+        path = os.path.normpath(os.path.join(cider.symlink_dir, path))
+        affects = cider._affects_group  # pylint:disable=W0212
+        assert affects(path, source_glob) == expected
+
     @pytest.mark.randomize(name=str, min_length=1)
     def test_addlink(self, tmpdir, debug, verbose, name):
         """
@@ -275,7 +547,7 @@ class TestCiderCore(object):
             cider_dir=str(tmpdir),
             support_dir=str(tmpdir.join(".cache"))
         )
-        cider.add_symlink = MagicMock()
+        cider.add_symlinks = MagicMock()
 
         source = os.path.abspath(str(tmpdir.join(random_str(min_length=1))))
         basename = os.path.basename(source)
@@ -296,7 +568,7 @@ class TestCiderCore(object):
             os.path.realpath(stow), os.path.realpath(source)
         )
 
-        cider.add_symlink.assert_called_with(name, source)
+        cider.add_symlinks.assert_called_with(name, [source])
         new_cache = cider._cached_targets()  # pylint:disable=W0212
         assert source in new_cache
 
@@ -324,7 +596,7 @@ class TestCiderCore(object):
             cider_dir=str(tmpdir.join("cider")),
             support_dir=str(tmpdir.join("cider", ".cache"))
         )
-        cider.remove_symlink = MagicMock()
+        cider.remove_symlinks = MagicMock()
 
         stow_dir = os.path.abspath(os.path.join(cider.symlink_dir, name))
         os.makedirs(stow_dir)
@@ -346,9 +618,59 @@ class TestCiderCore(object):
             assert not os.path.exists(source)
             assert target not in new_cache
 
-        cider.remove_symlink.assert_called_with(name)
+        cider.remove_symlinks.assert_called_with([name])
         assert not os.path.exists(stow_dir)
 
+    def test_addlink_unlink_batch(self, tmpdir, debug, verbose):
+        """
+        Tests that linking and unlinking several items writes the bootstrap
+        and target cache once, that nothing is moved when any item in the
+        batch is invalid, and that repeated names are unlinked once.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir.join("cider")),
+            support_dir=str(tmpdir.join("cider", ".cache"))
+        )
+        items = [str(tmpdir.join(name)) for name in ("a", ".b", "c")]
+        for item in items:
+            touch(item)
+
+        missing = str(tmpdir.join("missing"))
+        with pytest.raises(StowError):
+            cider.addlink("dots", items[0], missing)
+        assert not os.path.islink(items[0])
+
+        with patch("cider.core.modify_config", wraps=modify_config) \
+                as modify, \
+                patch("cider.core.write_config", wraps=write_config) as write:
+            cider.addlink("dots", *items[:2])
+            assert modify.call_count == 1
+            assert write.call_count == 1
+
+        cider.addlink("misc", items[2])
+        for item in items:
+            assert os.path.islink(item)
+        targets = cider._cached_targets()  # pylint:disable=W0212
+        assert sorted(targets) == sorted(items)
+
+        with pytest.raises(StowError):
+            cider.unlink("dots", "bogus")
+        assert os.path.islink(items[0])
+
+        with patch("cider.core.modify_config", wraps=modify_config) \
+                as modify, \
+                patch("cider.core.write_config", wraps=write_config) as write:
+            cider.unlink("dots", "misc", "dots")
+            assert modify.call_count == 1
+            assert write.call_count == 1
+
+        for item in items:
+            assert os.path.isfile(item) and not os.path.islink(item)
+        assert cider._cached_targets() == []  # pylint:disable=W0212
+        assert not cider.read_bootstrap().get("symlinks")
+        assert not os.path.exists(os.path.join(cider.symlink_dir, "dots"))
+
     @pytest.mark.randomize(defaults=dict_of(str, dict_of(str, str)))
     def test_apply_defaults(self, tmpdir, debug, verbose, defaults):
         cider = Cider(False, debug, verbose, cider_dir=str(tmpdir))
@@ -360,25 +682,559 @@ class TestCiderCore(object):
             for key, value in options.items():
                 cider.defaults.write.assert_any_call(domain, key, value)
 
+    def test_apply_defaults_unchanged(self, tmpdir, debug, verbose):
+        cider = Cider(False, debug, verbose, cider_dir=str(tmpdir))
+        cider.defaults = MagicMock()
+        cider.defaults.export.return_value = {
+            "same": 1, "bool": 1, "changed": "a"
+        }
+        cider.read_defaults = MagicMock(return_value={"domain": {
+            "same": 1, "bool": True, "changed": "b", "new": 2.0
+        }})
+        cider.apply_defaults()
+
+        cider.defaults.export.assert_called_once_with("domain")
+        assert sorted(
+            args[1] for args, _ in cider.defaults.write.call_args_list
+        ) == ["bool", "changed", "new"]
+
+    def test_apply_icons(self, tmpdir, debug, verbose):
+        """
+        Tests that icons are only reapplied to apps whose icon changed.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir),
+            support_dir=str(tmpdir.join(".cache"))
+        )
+        icon = tmpdir.join("icon.icns")
+        icon.write("icon")
+        apps = {}
+        for app in ["Foo", "Bar"]:
+            apps[app] = tmpdir.join(app + ".app")
+            apps[app].ensure(dir=True)
+
+        def set_icon(app_path, _):
+            tmpdir.join(os.path.basename(app_path), "Icon\r").ensure()
+
+        with open(cider.bootstrap_file, "w") as f:
+            f.write("icons:\n  Foo: {0}\n  Bar: {0}\n".format(icon))
+
+        with patch("cider.core.osx") as osx:
+            osx.path_for_app.side_effect = lambda app: str(apps[app])
+            osx.set_icon.side_effect = set_icon
+
+            cider.apply_icons()
+            assert osx.set_icon.call_count == 2
+
+            Cider(
+                False, debug, verbose,
+                cider_dir=str(tmpdir),
+                support_dir=str(tmpdir.join(".cache"))
+            ).apply_icons()
+            assert osx.set_icon.call_count == 2
+
+            icon.write("new icon")
+            cider.apply_icons()
+            assert osx.set_icon.call_count == 4
+
     @pytest.mark.randomize(before=bool, after=bool, bootstrap={
         "before-scripts": list_of(str),
         "after-scripts": list_of(str)
     }, min_length=1)
     def test_run_scripts(self, tmpdir, debug, verbose, before,
                          after, bootstrap):
-        cider = Cider(False, debug, verbose, cider_dir=str(tmpdir))
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir),
+            support_dir=str(tmpdir.join(".cache"))
+        )
         cider.read_bootstrap = MagicMock(return_value=bootstrap)
         scripts = []
         scripts += bootstrap.get("before-scripts", []) if before else []
         scripts += bootstrap.get("after-scripts", []) if after else []
 
-        # TODO: Assert ordering
-        with patch("cider.core.spawn", autospec=True, return_value=0) as spawn:
+        with patch("cider._scripts.spawn", autospec=True,
+                   return_value=0) as spawn:
             cider.run_scripts(before, after)
+            assert [c[0][0] for c in spawn.call_args_list] == [
+                [script] for script in scripts
+            ]
             for script in scripts:
                 spawn.assert_any_call([script],
                                       shell=True, debug=debug,
-                                      cwd=cider.cider_dir, env=cider.env)
+                                      cwd=cider.cider_dir, env=cider.env,
+                                      stdout=ANY, stderr=subprocess.STDOUT)
+
+    def test_restore_taps(self, tmpdir, debug, verbose):
+        """
+        Tests that:
+        1. Taps that are already present are not cloned again.
+        2. Remaining taps are cloned, and each tapped formula waits for its
+           tap to be cloned before installing, while formulas named without
+           a tap wait for every tap.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir),
+            support_dir=str(tmpdir.join(".cache"))
+        )
+        cider.read_bootstrap = MagicMock(return_value={
+            "taps": ["present/tap", "Other/Tap", "third/tap"],
+            "formulas": ["plain", "other/tap/formula --with-option"],
+        })
+        cider._assert_requirements = MagicMock()  # pylint:disable=W0212
+        cider.run_scripts = MagicMock()
+        cider.apply_icons = MagicMock()
+
+        calls = []
+
+        def tap(name):
+            calls.append(("tap", name))
+
+        def safe_install(formula, *args):
+            calls.append(("install", formula))
+
+        with patch("cider.core.Brew") as MockBrew:
+            brew = MockBrew.return_value
+            brew.installed_taps.return_value = ["present/tap"]
+            brew.outdated.return_value = []
+            brew.tap.side_effect = tap
+            brew.safe_install.side_effect = safe_install
+            cider.restore()
+
+        tapped = [name for cmd, name in calls if cmd == "tap"]
+        assert sorted(tapped) == ["Other/Tap", "third/tap"]
+        assert calls.index(("tap", "Other/Tap")) < calls.index(
+            ("install", "other/tap/formula --with-option")
+        )
+        assert max(calls.index(("tap", name)) for name in tapped) < \
+            calls.index(("install", "plain"))
+
+    def test_restore_resume(self, tmpdir, debug, verbose):
+        """
+        Tests that a resumed restore skips steps completed by an interrupted
+        one, unless the bootstrap changed in between.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir),
+            support_dir=str(tmpdir.join(".cache"))
+        )
+        bootstrap = {"formulas": ["a", "b", "c"]}
+        cider.read_bootstrap = MagicMock(return_value=bootstrap)
+        cider._assert_requirements = MagicMock()  # pylint:disable=W0212
+        cider.run_scripts = MagicMock()
+        cider.apply_icons = MagicMock()
+        installed = []
+        failing = set(["b"])
+
+        def safe_install(formula, *args):
+            if formula in failing:
+                raise RuntimeError("Interrupted")
+            installed.append(formula)
+            return True
+
+        with patch("cider.core.Brew") as MockBrew:
+            brew = MockBrew.return_value
+            brew.outdated.return_value = []
+            brew.safe_install.side_effect = safe_install
+
+            with pytest.raises(RuntimeError):
+                cider.restore()
+            assert installed == ["a"]
+
+            failing.clear()
+            cider.restore(resume=True)
+            assert installed == ["a", "b", "c"]
+            assert not os.path.exists(cider.restore_journal_file)
+
+            # A changed bootstrap invalidates the journal.
+            failing.add("b")
+            del installed[:]
+            with pytest.raises(RuntimeError):
+                cider.restore()
+            failing.clear()
+            bootstrap["formulas"].append("d")
+            cider.restore(resume=True)
+            assert installed == ["a", "a", "b", "c", "d"]
+
+    def test_restore_lock(self, tmpdir, debug, verbose):
+        """
+        Tests that `lock` records installed versions, and that a restore
+        then only installs entries that differ from the lockfile, without
+        asking brew what's outdated when no formula needs work.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir.join("cider")),
+            support_dir=str(tmpdir.join(".cache"))
+        )
+        bootstrap = {"formulas": ["a", "b --with-x"], "casks": ["app"]}
+        cider.read_bootstrap = MagicMock(return_value=bootstrap)
+        cider.read_defaults = MagicMock(return_value={})
+        cider._assert_requirements = MagicMock()  # pylint:disable=W0212
+        cider.run_scripts = MagicMock()
+        cider.apply_icons = MagicMock()
+
+        prefix = tmpdir.join("prefix")
+        for path in ("Cellar/a/1.0", "Cellar/b/2.0", "Caskroom/app/3.0"):
+            prefix.join(path).ensure(dir=True)
+
+        installed = []
+        with patch("cider.core.Brew") as MockBrew:
+            brew = MockBrew.return_value
+            brew.prefix.return_value = str(prefix)
+            brew.repository.return_value = str(tmpdir.join("repo"))
+            brew.installed_taps.return_value = []
+            brew.outdated.return_value = []
+            brew.safe_install.side_effect = \
+                lambda formula, *args: installed.append(formula)
+
+            cider.lock()
+            lock = read_config(cider.lock_file)
+            assert lock["formulas"] == {"a": "1.0", "b --with-x": "2.0"}
+            assert lock["casks"] == {"app": "3.0"}
+
+            cider.restore()
+            assert installed == []
+            assert not brew.outdated.called
+            assert not brew.update.called
+
+            prefix.join("Cellar", "b").remove()
+            bootstrap["casks"].append("new")
+            cider.restore()
+            assert sorted(installed) == ["b --with-x", "new"]
+            assert brew.outdated.called
+            brew.update.assert_called_once_with(None)
+
+            brew.update.reset_mock()
+            cider.restore(no_update=True)
+            assert not brew.update.called
+
+            del installed[:]
+            cider.restore(use_lock=False)
+            assert sorted(installed) == ["a", "app", "b --with-x", "new"]
+
+    def test_restore_mirror(self, tmpdir, debug, verbose):
+        """
+        Tests that a restore seeds the download cache from the mirror and
+        copies new downloads back, and that an offline restore only
+        installs what the mirror has and reports the rest.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir.join("cider")),
+            support_dir=str(tmpdir.join(".cache"))
+        )
+        bootstrap = {"formulas": ["a", "b"], "casks": ["app"],
+                     "mirror": str(tmpdir.join("mirror"))}
+        cider.read_bootstrap = MagicMock(return_value=bootstrap)
+        cider.read_defaults = MagicMock(return_value={})
+        cider._assert_requirements = MagicMock()  # pylint:disable=W0212
+        cider.run_scripts = MagicMock()
+        cider.apply_icons = MagicMock()
+
+        cache = tmpdir.join("brew-cache")
+        cider._env = dict(os.environ,  # pylint:disable=W0212
+                          HOMEBREW_CACHE=str(cache))
+        tmpdir.join("mirror", "a--1.0.bottle.tar.gz").ensure()
+        prefix = tmpdir.join("prefix").ensure(dir=True)
+        installed = []
+
+        def install(formula, *args):
+            installed.append(formula)
+            cache.join(formula + "--1.0.bottle.tar.gz").ensure()
+
+        with patch("cider.core.Brew") as MockBrew:
+            brew = MockBrew.return_value
+            brew.prefix.return_value = str(prefix)
+            brew.repository.return_value = str(tmpdir.join("repo"))
+            brew.installed_taps.return_value = []
+            brew.outdated.return_value = []
+            brew.safe_install.side_effect = install
+
+            with pytest.raises(MirrorError):
+                cider.restore(offline=True, mirror=str(tmpdir.join("none")))
+            assert installed == []
+            assert not cache.check()
+
+            prefix.join("Cellar", "b", "1.0").ensure(dir=True)
+            with pytest.raises(MirrorError) as exc:
+                cider.restore(offline=True)
+            assert "casks/app" in str(exc.value)
+            assert installed == ["a"]
+            assert cache.join("a--1.0.bottle.tar.gz").check()
+            assert not brew.outdated.called
+            assert not brew.update.called
+            assert any((args[3] or {}).get("HOMEBREW_NO_AUTO_UPDATE") == "1"
+                       for args, _ in MockBrew.call_args_list)
+
+            cider.restore()
+            assert sorted(installed) == ["a", "a", "app", "b"]
+            assert tmpdir.join("mirror", "app--1.0.bottle.tar.gz").check()
+
+        del bootstrap["mirror"]
+        with pytest.raises(MirrorError):
+            cider.restore(offline=True)
+
+    def test_status(self, tmpdir, debug, verbose):
+        """
+        Tests that `status` reports drift read from disk without changing
+        anything.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir.join("cider")),
+            support_dir=str(tmpdir.join(".cache"))
+        )
+        cider.read_bootstrap = MagicMock(return_value={
+            "formulas": ["a", "missing"], "casks": [], "taps": ["user/tap"],
+            "symlinks": {"file": str(tmpdir.join("home", "file"))},
+        })
+        cider.read_defaults = MagicMock(return_value={})
+        touch(str(tmpdir.join("cider", "symlinks").ensure(dir=True)
+                  .join("file")))
+
+        prefix = tmpdir.join("prefix")
+        for path in ("Cellar/a/1.0", "Cellar/b/1.0"):
+            prefix.join(path).ensure(dir=True)
+
+        with patch("cider.core.Brew") as MockBrew:
+            brew = MockBrew.return_value
+            brew.prefix.return_value = str(prefix)
+            brew.repository.return_value = str(tmpdir.join("repo"))
+            status = cider.status()
+            assert not brew.install.called
+
+        assert status["formulas"] == {"missing": ["missing"], "extra": ["b"]}
+        assert status["taps"] == {"missing": ["user/tap"], "extra": []}
+        assert [link["status"] for link in status["links"]] == ["missing"]
+        assert status["defaults"] == []
+        assert not tmpdir.join("home", "file").check()
+
+    def test_restore_plan(self, tmpdir, debug, verbose):
+        """
+        Tests that:
+        1. Links and defaults only wait on the before scripts.
+        2. Packages wait on their tap and declared dependencies, and
+           undeclared package dependencies are installed too.
+        3. Icons wait on casks, and after scripts wait on everything.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir),
+            support_dir=str(tmpdir.join(".cache"))
+        )
+        cider.read_defaults = MagicMock(return_value={"NSGlobalDomain": {}})
+        bootstrap = {
+            "taps": ["user/repo"],
+            "formulas": ["user/repo/tool", "foo --with-bar"],
+            "casks": ["app"],
+            "symlinks": {"vim/*": "~/"},
+            "dependencies": {
+                "foo": ["casks/java", "links"],
+                "casks/app": "defaults/NSGlobalDomain",
+            }
+        }
+
+        with patch("cider.core.Brew") as MockBrew:
+            MockBrew.return_value.installed_taps.return_value = []
+            plan = cider._restore_plan(bootstrap)  # pylint:disable=W0212
+
+        def deps(node):
+            return set(plan.nodes[node].deps)
+
+        before = "scripts/before"
+        assert deps("links/vim/*") == set([before])
+        assert deps("defaults/NSGlobalDomain") == set([before])
+        assert deps("taps/user/repo") == set([before, "update"])
+        assert deps("formulas/user/repo/tool") == set([
+            before, "update", "outdated", "taps/user/repo"
+        ])
+        assert deps("formulas/foo --with-bar") == set([
+            before, "update", "outdated", "taps/user/repo", "casks/java",
+            "links"
+        ])
+        assert deps("casks/app") == set([
+            before, "update", "taps/user/repo", "defaults/NSGlobalDomain"
+        ])
+        assert deps("icons") == set([before, "casks/app", "casks/java"])
+        assert deps("scripts/after") == set(plan.nodes) - set([
+            "scripts/after"
+        ])
+        assert plan.nodes["casks/java"].resource == "brew"
+        assert plan.nodes["links/vim/*"].resource == "links"
+        assert plan.nodes["links"].resource == "links"
+        plan.order()
+
+        bootstrap["dependencies"] = {"foo": "links/missing/*"}
+        with patch("cider.core.Brew"):
+            with pytest.raises(DependencyError):
+                cider._restore_plan(bootstrap)  # pylint:disable=W0212
+
+    def test_restore_plan_taps(self, tmpdir, debug, verbose):
+        """
+        Tests that packages named without a tap wait on every tap, and
+        those named with one only on theirs.
+        """
+        cider = Cider(False, debug, verbose, cider_dir=str(tmpdir))
+        cider.read_defaults = MagicMock(return_value={})
+        bootstrap = {
+            "taps": ["user/repo", "other/repo"],
+            "formulas": ["other/repo/tool"],
+            "casks": ["foo"],
+        }
+        with patch("cider.core.Brew") as MockBrew:
+            MockBrew.return_value.installed_taps.return_value = []
+            plan = cider._restore_plan(bootstrap)  # pylint:disable=W0212
+
+        assert set(["taps/user/repo", "taps/other/repo"]) <= \
+            set(plan.nodes["casks/foo"].deps)
+        tool = set(plan.nodes["formulas/other/repo/tool"].deps)
+        assert "taps/other/repo" in tool and "taps/user/repo" not in tool
+
+    @pytest.mark.parametrize("window,expected", [
+        (None, None), ("3600", 3600), ("", None), ("1d", None),
+    ])
+    def test_restore_update_window(self, tmpdir, debug, verbose, window,
+                                   expected):
+        """
+        Tests that brew is updated within HOMEBREW_AUTO_UPDATE_SECS, and
+        within brew's default window when that isn't a number.
+        """
+        cider = Cider(False, debug, verbose, cider_dir=str(tmpdir))
+        cider.read_defaults = MagicMock(return_value={})
+        env = {} if window is None else {"HOMEBREW_AUTO_UPDATE_SECS": window}
+        with patch("cider.core.Brew"):
+            plan = cider._restore_plan({}, env=env)  # pylint:disable=W0212
+        assert plan.nodes["update"].fn.args == (expected,)
+
+    def test_restore_filter(self, tmpdir, debug, verbose):
+        """
+        Tests that `only`, `skip` and `tags` limit which restore steps run,
+        that dead links are only pruned when every link group runs, and
+        that brew isn't updated when no package step runs.
+        """
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(tmpdir),
+            support_dir=str(tmpdir.join(".cache"))
+        )
+        cider.read_defaults = MagicMock(return_value={"NSGlobalDomain": {}})
+        bootstrap = {
+            "formulas": ["git", "foo --with-bar"],
+            "casks": ["app", "other"],
+            "symlinks": {"vim/*": "~/", "git/*": "~/"},
+            "tags": {"work": ["foo", "casks/app", "links/git/*"]},
+        }
+
+        def selected(**kwargs):
+            with patch("cider.core.Brew") as MockBrew:
+                MockBrew.return_value.installed_taps.return_value = []
+                plan = cider._restore_plan(bootstrap)  # pylint:disable=W0212
+            fns = dict((name, node.fn) for name, node in plan.nodes.items())
+            steps = cider._filter_plan(  # pylint:disable=W0212
+                plan, bootstrap, **kwargs
+            )
+            updated = plan.nodes["update"].fn is fns["update"]
+            return sorted(steps), updated
+
+        assert selected(only=["links", "defaults"]) == ([
+            "defaults", "defaults/NSGlobalDomain", "links", "links/git/*",
+            "links/vim/*"
+        ], False)
+        assert selected(only=["foo", "casks/other"]) == ([
+            "casks/other", "formulas/foo --with-bar"
+        ], True)
+
+        steps, updated = selected(skip=["casks", "links/vim/*"])
+        assert updated and "links/git/*" in steps
+        assert not [step for step in steps
+                    if step.startswith("casks/") or step == "links"]
+        assert "scripts/after" in steps and "icons" in steps
+
+        assert selected(tags=["work"], skip=["casks"]) == ([
+            "formulas/foo --with-bar", "links/git/*"
+        ], True)
+        with patch("cider.core.tty.puterr") as puterr:
+            assert selected(tags=["home"]) == ([], False)
+            assert selected(only=["casks/missing"]) == ([], False)
+        assert puterr.call_count == 2
+
+        with patch("cider.core.Brew"):
+            plan = cider._restore_plan(bootstrap)  # pylint:disable=W0212
+        cider._filter_plan(plan, bootstrap,  # pylint:disable=W0212
+                           only=["links"])
+        with patch("cider.core.tty.event") as event:
+            assert plan.nodes["casks/app"].fn() is False
+        event.assert_any_call("step_skipped", step="casks/app",
+                              reason="filtered")
+
+    def test_sync(self, tmpdir, debug, verbose):
+        """
+        Tests that sync only installs, untaps, relinks, writes defaults and
+        runs scripts for what changed between two commits, leaving other
+        link groups alone.
+        """
+        repo = tmpdir.join("cider")
+        home = tmpdir.join("home").ensure(dir=True)
+        cider = Cider(
+            False, debug, verbose,
+            cider_dir=str(repo),
+            support_dir=str(tmpdir.join(".cache")),
+            home=str(home)
+        )
+
+        def commit(bootstrap, defaults, *paths):
+            for path in paths:
+                touch(str(repo.join("symlinks", path).ensure()))
+            write_config(cider.bootstrap_file, bootstrap)
+            write_config(cider.defaults_file, defaults)
+            for args in (["add", "-A"], ["commit", "-q", "-m", "x"]):
+                subprocess.check_call(
+                    ["git", "-c", "user.name=x", "-c", "user.email=x@x"] +
+                    args, cwd=str(repo)
+                )
+
+        subprocess.check_call(["git", "init", "-q", str(repo)])
+        symlinks = {"vim/*": "~/", "git/*": "~/"}
+        commit({"formulas": ["git"], "taps": ["user/tap"],
+                "symlinks": symlinks, "before-scripts": ["echo one"]},
+               {"NSGlobalDomain": {"a": 1, "b": 2}},
+               "vim/vimrc", "vim/old", "git/gitconfig")
+        cider.relink()
+        repo.join("symlinks", "vim", "old").remove()
+        commit({"formulas": ["git", "zsh"], "symlinks": symlinks,
+                "before-scripts": ["echo two"]},
+               {"NSGlobalDomain": {"a": 1, "c": True}}, "vim/gvimrc")
+
+        expected = ["scripts/before", "formulas/zsh", "untap/user/tap",
+                    "links/vim/*", "links", "defaults/NSGlobalDomain"]
+        with patch("cider.core.Brew") as MockBrew:
+            assert cider.sync("HEAD~1", dry_run=True) == expected
+            assert not MockBrew.return_value.safe_install.called
+
+            cider.defaults = MagicMock()
+            cider.defaults.export.return_value = {}
+            with patch("cider.core.ScriptRunner") as MockRunner:
+                assert cider.sync("HEAD~1..HEAD") == expected
+            brew = MockBrew.return_value
+            brew.safe_install.assert_called_once_with("zsh")
+            brew.untap.assert_called_once_with("user/tap")
+
+        (scripts, _), _ = MockRunner.return_value.run.call_args
+        assert [script.run for script in scripts] == ["echo two"]
+        cider.defaults.write.assert_called_once_with("NSGlobalDomain", "c",
+                                                     True)
+        cider.defaults.delete.assert_called_once_with("NSGlobalDomain", "b")
+        assert sorted(os.listdir(str(home))) == [
+            "gitconfig", "gvimrc", "vimrc"
+        ]
+        assert len(cider._cached_targets()) == 3  # pylint:disable=W0212
+
+        with patch("cider.core.Brew"):
+            assert cider.sync("HEAD..HEAD") == []
 
     @pytest.mark.randomize(installed=list_of(str), brewed=list_of(str),
                            min_length=1)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from cider import _cli as cli
+from cider import _tty as tty
+from cider._daemon import Daemon, WarmCider, WarmState, forward, relay
+from cider._sh import prompt, write_config
+from cider.exceptions import DaemonError
+from click.testing import CliRunner
+import io
+import os
+import pytest
+import socket
+import sys
+import threading
+
+try:
+    from mock import MagicMock, patch
+except ImportError:
+    from unittest.mock import MagicMock, patch  # pylint: disable=F0401,E0611
+
+
+def test_warm_state(tmpdir):
+    state = WarmState()
+    read = MagicMock(side_effect=[1, 2])
+    path = str(tmpdir.join("cider", "bootstrap.yaml"))
+    assert state.get("bootstrap", [path], read) == 1
+    assert state.get("bootstrap", [path], read) == 1
+    assert state.get("taps", [], lambda: ["a/b"]) == ["a/b"]
+
+    state.invalidate([str(tmpdir.join("support", "x"))])
+    assert state.get("bootstrap", [path], read) == 1
+    state.invalidate([str(tmpdir.join("cider"))])
+    assert state.get("bootstrap", [path], read) == 2
+    assert read.call_count == 2
+    assert state.get("taps", [], lambda: []) == ["a/b"]
+
+
+def test_warm_cider(tmpdir):
+    state = WarmState()
+
+    def warm_cider():
+        return WarmCider(state, cider_dir=str(tmpdir.join("cider")),
+                         support_dir=str(tmpdir.join("support")),
+                         home=str(tmpdir))
+
+    bootstrap_file = tmpdir.join("cider", "bootstrap.yaml").ensure()
+    write_config(str(bootstrap_file), {"formulas": ["git"]})
+    cider = warm_cider()
+    assert warm_cider().read_bootstrap() == {"formulas": ["git"]}
+    warm_cider().read_bootstrap()["formulas"].append("vim")
+
+    write_config(cider.bootstrap_file, {"formulas": ["zsh"]})
+    assert warm_cider().read_bootstrap() == {"formulas": ["git"]}
+    state.invalidate([cider.bootstrap_file])
+    assert warm_cider().read_bootstrap() == {"formulas": ["zsh"]}
+
+    with patch.object(WarmCider, "brew_paths",
+                      return_value=(str(tmpdir), str(tmpdir))):
+        cider.brew.brew = MagicMock(cask=False)
+        cider.brew.brew.ls.return_value = ["git"]
+        assert cider.brew.ls() == ["git"]
+        assert warm_cider().brew.ls() == ["git"]
+        assert cider.brew.brew.ls.call_count == 1
+        state.invalidate([str(tmpdir.join("Cellar", "vim"))])
+        assert ("ls", False) not in state.values
+        assert ("config", cider.bootstrap_file) in state.values
+
+
+def _serve(daemon, args, stdin=""):
+    client, server = socket.socketpair()
+    thread = threading.Thread(target=daemon.handle, args=(server,))
+    thread.start()
+    stdout, stderr = io.StringIO(), io.StringIO()
+    try:
+        exit_code = relay(client, args, io.StringIO(stdin), stdout, stderr)
+    finally:
+        thread.join()
+        client.close()
+        server.close()
+    return exit_code, stdout.getvalue(), stderr.getvalue()
+
+
+def test_handle(tmpdir):
+    def run(args, factory):
+        assert factory.func is WarmCider
+        tty.add_listener(lambda event: None)
+        print(" ".join(args))
+        sys.stderr.write("warning\n")
+        if prompt("Add? [y/N] "):
+            sys.exit(3)
+        raise ValueError("boom")
+
+    daemon = Daemon(str(tmpdir.join("cider.sock")), run)
+    listeners = tty.listeners()
+    assert _serve(daemon, ["ls", "git"], "y\n") == (
+        3, "ls git\nAdd? [y/N] ", "warning\n"
+    )
+    exit_code, _, stderr = _serve(daemon, ["ls"], "n\n")
+    assert exit_code == 1 and "ValueError: boom" in stderr
+    assert tty.listeners() == listeners
+    assert sys.stdout is not None and not hasattr(sys.stdout, "channel")
+
+
+def test_forward(tmpdir):
+    path = str(tmpdir.join("cider.sock"))
+    assert forward(path, ["ls"]) is None
+
+    daemon = Daemon(path, MagicMock())
+    listener = daemon.listen()
+    try:
+        assert os.stat(path).st_mode & 0o077 == 0
+        with pytest.raises(DaemonError):
+            daemon.listen()
+    finally:
+        listener.close()
+
+    # A socket nobody is listening on is replaced.
+    daemon.listen().close()
+
+
+def test_daemon_factory():
+    factory = MagicMock()
+    with patch("cider._cli.Cider") as MockCider:
+        result = CliRunner().invoke(cli.cli, ["cask", "ls"], obj=factory)
+    assert not result.exception
+    assert not MockCider.called
+    factory.assert_any_call(False, False, False)
+    factory.assert_any_call(True, factory().debug, factory().verbose)
+    factory().ls.assert_called_with(None)
+
+
+@pytest.mark.parametrize("args,expected", [
+    (["ls"], True),
+    (["-d", "status", "--json"], True),
+    (["cask", "missing"], True),
+    (["install", "git"], False),
+    (["--version"], False),
+    ([], False),
+])
+def test_forwardable(args, expected):
+    try:
+        assert cli._forwardable(args) == expected  # pylint: disable=W0212
+    finally:
+        tty.set_output(tty.TEXT)
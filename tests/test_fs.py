@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from ._lib import touch
+from cider import _fs
+import errno
+import os
+import pytest
+
+try:
+    from mock import patch
+except ImportError:
+    from unittest.mock import patch  # pylint: disable=F0401,E0611
+
+
+def _cross_device(rename):
+    """
+    Makes os.rename() fail with EXDEV except for staging renames, the way
+    it does when moving between filesystems.
+    """
+    def _rename(src, dst):
+        if not src.endswith(".cider-move"):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        return rename(src, dst)
+    return _rename
+
+
+def _make_tree(root):
+    os.makedirs(os.path.join(root, "sub", "deeper"))
+    files = {
+        "a": "alpha",
+        os.path.join("sub", "b"): "beta" * 100000,
+        os.path.join("sub", "deeper", ".c"): "",
+    }
+    for name, contents in files.items():
+        with open(os.path.join(root, name), "w") as f:
+            f.write(contents)
+    os.chmod(os.path.join(root, "a"), 0o600)
+    os.symlink("a", os.path.join(root, "link"))
+    os.symlink("sub", os.path.join(root, "dirlink"))
+    return files
+
+
+def _assert_tree(root, files):
+    for name, contents in files.items():
+        with open(os.path.join(root, name)) as f:
+            assert f.read() == contents
+    assert os.stat(os.path.join(root, "a")).st_mode & 0o777 == 0o600
+    assert os.readlink(os.path.join(root, "link")) == "a"
+    assert os.readlink(os.path.join(root, "dirlink")) == "sub"
+
+
+def test_move_rename(tmpdir):
+    src = str(tmpdir.join("src"))
+    dst = str(tmpdir.join("dst"))
+    touch(src)
+    with patch("cider._fs.copy_tree") as copy_tree:
+        assert _fs.move(src, dst) == dst
+        assert not copy_tree.called
+    assert os.path.isfile(dst)
+    assert not os.path.exists(src)
+
+
+@pytest.mark.parametrize("offload", [True, False])
+def test_move_cross_device(tmpdir, offload):
+    src = str(tmpdir.join("src"))
+    dst = str(tmpdir.join("dst"))
+    files = _make_tree(src)
+    mtime = os.stat(os.path.join(src, "sub", "b")).st_mtime
+
+    patches = [patch("os.rename", side_effect=_cross_device(os.rename))]
+    if not offload:
+        patches += [
+            patch("cider._fs._clone", return_value=False),
+            patch("cider._fs._copy_file_range", return_value=False),
+            patch("cider._fs._sendfile", return_value=False),
+        ]
+    for p in patches:
+        p.start()
+    try:
+        _fs.move(src, dst, workers=2)
+    finally:
+        for p in patches:
+            p.stop()
+
+    assert not os.path.exists(src)
+    assert not os.path.exists(_fs.staging_path(dst))
+    _assert_tree(dst, files)
+    assert os.stat(os.path.join(dst, "sub", "b")).st_mtime == \
+        pytest.approx(mtime)
+
+
+def test_move_interrupted(tmpdir):
+    """
+    An error partway through a cross-device copy leaves the source intact
+    and nothing at the destination.
+    """
+    src = str(tmpdir.join("src"))
+    dst = str(tmpdir.join("dst"))
+    files = _make_tree(src)
+
+    copy_file = _fs.copy_file
+
+    def flaky(source, target):
+        if os.path.basename(source) == "b":
+            raise IOError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        return copy_file(source, target)
+
+    with patch("os.rename", side_effect=_cross_device(os.rename)), \
+            patch("cider._fs.copy_file", side_effect=flaky):
+        with pytest.raises(IOError):
+            _fs.move(src, dst)
+
+    _assert_tree(src, files)
+    assert not os.path.exists(dst)
+    assert not os.path.exists(_fs.staging_path(dst))
+
+
+def test_move_stale_staging(tmpdir):
+    """
+    A staging copy left behind by a crash is discarded, not merged.
+    """
+    src = str(tmpdir.join("src"))
+    dst = str(tmpdir.join("dst"))
+    touch(src)
+    os.makedirs(os.path.join(_fs.staging_path(dst), "junk"))
+
+    with patch("os.rename", side_effect=_cross_device(os.rename)):
+        _fs.move(src, dst)
+
+    assert os.path.isfile(dst)
+    assert not os.path.exists(_fs.staging_path(dst))
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from cider import Cider
+from cider import _cli as cli
+from cider import _tty as tty
+from cider._history import History, Recorder
+from cider._sched import run_step
+import pytest
+
+try:
+    from mock import MagicMock
+except ImportError:
+    from unittest.mock import MagicMock  # pylint: disable=F0401,E0611
+
+
+@pytest.fixture
+def history(tmpdir):
+    return History(str(tmpdir.join("support", "history.sqlite3")))
+
+
+def _record(history, durations, command=None):
+    return history.record(command or "restore", 0, sum(durations.values()),
+                          0, [(step, "ok", duration)
+                              for step, duration in durations.items()])
+
+
+def test_slow_steps(history):
+    assert history.runs("restore") == []
+    for duration in (10, 12, 11, 30):
+        _record(history, {"formulas/git": duration, "links": 0.1})
+    run_id = _record(history, {"formulas/git": 25, "links": 1.0,
+                               "defaults/NSGlobalDomain": 60})
+
+    assert history.slow_steps("restore", run_id) == [{
+        "step": "formulas/git", "duration": 25, "median": 11.5, "runs": 4
+    }]
+    assert history.slow_steps("restore", run_id, min_seconds=0.5) == [
+        {"step": "links", "duration": 1.0, "median": 0.1, "runs": 4},
+        {"step": "formulas/git", "duration": 25, "median": 11.5, "runs": 4},
+    ]
+    assert history.slow_steps("restore", run_id, min_runs=5) == []
+    assert history.slow_steps("relink", run_id) == []
+
+    runs = history.runs("restore", limit=2)
+    assert [run["id"] for run in runs] == [run_id, run_id - 1]
+    assert runs[0]["duration"] == 86
+
+
+def test_recorder(history):
+    recorder = Recorder(lambda: history)
+    tty.add_listener(recorder)
+    try:
+        tty.event("command_started", command="relink")
+        assert run_step("links/a", lambda: 1) == 1
+        with pytest.raises(ValueError):
+            run_step("links", lambda: int("x"))
+        tty.event("command_finished", exit_code="failed", duration=0.5)
+    finally:
+        tty.remove_listener(recorder)
+
+    run, = history.runs("relink")
+    assert run["exit_code"] == 1 and run["duration"] == 0.5
+    assert history.medians("relink", run["id"] + 1) == {"links/a": (
+        recorder.steps[0][2], 1
+    )}
+
+
+def test_recorder_crash(history):
+    # A command dying on an unexpected exception is recorded as failed.
+    factory = MagicMock()
+    factory.return_value.history = history
+    factory.return_value.relink.side_effect = OSError("crashed")
+    with pytest.raises(OSError):
+        cli._run(["relink"], factory)
+
+    run, = history.runs("relink")
+    assert run["exit_code"] == 1
+
+
+def test_recorder_ignores_skipped(history):
+    recorder = Recorder(lambda: history)
+    recorder({"event": "command_started", "command": "restore"})
+    for step, duration in (("casks/app", 0.0), ("links", 2.0)):
+        recorder({"event": "step_finished", "step": step, "status": "ok",
+                  "duration": duration})
+    recorder({"event": "step_skipped", "step": "casks/app",
+              "reason": "filtered"})
+    recorder({"event": "command_finished", "exit_code": 0, "duration": 2})
+
+    run, = history.runs("restore")
+    assert history.medians("restore", run["id"] + 1) == {"links": (2.0, 1)}
+
+
+def test_recorder_skips():
+    recorder = Recorder(lambda: pytest.fail("history opened"))
+    recorder({"event": "command_started", "command": "ls"})
+    recorder({"event": "command_finished", "exit_code": 0, "duration": 1})
+
+
+def test_print_history(tmpdir, capsys):
+    cider = Cider(cider_dir=str(tmpdir.join("cider")),
+                  support_dir=str(tmpdir.join("support")),
+                  home=str(tmpdir))
+    cider.print_history("restore")
+    assert "No restore runs recorded yet." in capsys.readouterr()[0]
+
+    for duration in (10, 10, 10, 40):
+        _record(cider.history, {"formulas/git": duration})
+    cider.print_history("restore", limit=2)
+    out = capsys.readouterr()[0]
+    assert "Last 2 restore runs" in out
+    assert "formulas/git: 40.0s (median 10.0s over 3 runs)" in out
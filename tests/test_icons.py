@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=no-self-use
+from __future__ import absolute_import, print_function, unicode_literals
+from cider._icons import IconCache, icon_source
+from cider.exceptions import DownloadError
+import hashlib
+import os
+import pytest
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # noqa pylint: disable=F0401
+
+
+class IconServer(object):
+    """
+    Local HTTP stand-in that serves icons with an ETag and answers
+    conditional requests with 304.
+    """
+    def __init__(self):
+        self.icons = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=C0103
+                server.requests.append(self.path)
+                body = server.icons.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                etag = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, path):
+        return "http://127.0.0.1:{0}{1}".format(
+            self.httpd.server_address[1], path
+        )
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    icon_server = IconServer()
+    yield icon_server
+    icon_server.stop()
+
+
+def _cache(tmpdir):
+    return IconCache(str(tmpdir.join("icons")), str(tmpdir.join("icons.json")))
+
+
+def test_icon_source(tmpdir):
+    path = str(tmpdir.join("icon.icns"))
+    assert icon_source(path) == (None, path)
+    assert icon_source("file://" + path) == (None, path)
+    assert icon_source("https://example.com/a.icns") == (
+        "https://example.com/a.icns", None
+    )
+
+
+def test_download_is_cached(tmpdir, server):
+    server.icons["/a.icns"] = b"icon a"
+    cache = _cache(tmpdir)
+
+    path, digest = cache.fetch(server.url("/a.icns"))
+    assert digest == hashlib.sha1(b"icon a").hexdigest()
+    assert os.path.basename(path) == digest + ".icns"
+    with open(path, "rb") as f:
+        assert f.read() == b"icon a"
+
+    # Unchanged icons are revalidated, not downloaded again, and the cache
+    # survives across instances once saved.
+    cache.save()
+    cache = _cache(tmpdir)
+    assert cache.fetch(server.url("/a.icns")) == (path, digest)
+    assert len(server.requests) == 2
+    assert len(os.listdir(str(tmpdir.join("icons")))) == 1
+
+    # Changed icons are downloaded under their new hash.
+    server.icons["/a.icns"] = b"icon a, v2"
+    new_path, new_digest = cache.fetch(server.url("/a.icns"))
+    assert new_digest != digest and new_path != path
+    assert os.path.isfile(new_path)
+
+
+def test_fetch_all(tmpdir, server):
+    urls = []
+    for i in range(8):
+        server.icons["/{0}.png".format(i)] = str(i).encode("utf-8")
+        urls.append(server.url("/{0}.png".format(i)))
+
+    local = tmpdir.join("local.icns")
+    local.write("local icon")
+
+    fetched = _cache(tmpdir).fetch_all(urls + [str(local)] * 2, workers=4)
+    assert len(fetched) == len(urls) + 1
+    assert fetched[str(local)] == (
+        str(local), hashlib.sha1(b"local icon").hexdigest()
+    )
+    for i, url in enumerate(urls):
+        assert fetched[url][1] == hashlib.sha1(
+            str(i).encode("utf-8")
+        ).hexdigest()
+
+
+def test_download_errors(tmpdir, server):
+    cache = _cache(tmpdir)
+    with pytest.raises(DownloadError):
+        cache.fetch(server.url("/missing.icns"))
+    with pytest.raises(DownloadError):
+        cache.fetch(str(tmpdir.join("missing.icns")))
+
+    # Falls back to the cached copy when the server stops serving it.
+    server.icons["/a.icns"] = b"icon a"
+    expected = cache.fetch(server.url("/a.icns"))
+    del server.icons["/a.icns"]
+    assert cache.fetch(server.url("/a.icns")) == expected
+
+
+def test_applied(tmpdir):
+    cache = _cache(tmpdir)
+    app_path = tmpdir.join("Foo.app")
+    app_path.ensure(dir=True)
+
+    assert not cache.is_applied(str(app_path), "abc")
+    cache.mark_applied(str(app_path), "abc")
+
+    # The bundle must still carry a custom icon (e.g. the app wasn't
+    # reinstalled since).
+    assert not cache.is_applied(str(app_path), "abc")
+    app_path.join("Icon\r").ensure(file=True)
+    assert cache.is_applied(str(app_path), "abc")
+    assert not cache.is_applied(str(app_path), "def")
+
+    cache.forget(str(app_path))
+    assert not cache.is_applied(str(app_path), "abc")
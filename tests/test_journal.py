@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=no-self-use
+from __future__ import absolute_import, print_function, unicode_literals
+from cider._journal import Journal, config_hash
+from pytest import dict_of
+import pytest
+import random
+
+
+@pytest.mark.randomize(config=dict_of(str, str))
+def test_config_hash(config):
+    assert config_hash(config) == config_hash(dict(config))
+    assert config_hash(config, {}) != config_hash(config, {"a": 1})
+    assert config_hash({"a": [1, 2]}) != config_hash({"a": [2, 1]})
+
+
+def test_resume(tmpdir):
+    path = str(tmpdir.join("support", "restore.journal"))
+    journal = Journal(path, "v1")
+    assert journal.start() == 0
+
+    steps = []
+    journal.wrap("a", lambda: steps.append("a"))()
+    journal.wrap("b", lambda: False)()
+
+    # A fresh run ignores the journal, and starts a new one.
+    assert Journal(path, "v1").read() == set(["a"])
+    journal = Journal(path, "v1")
+    assert journal.start(resume=True) == 1
+
+    skipped = []
+    journal.wrap("a", lambda: steps.append("a"), skipped.append)()
+    journal.wrap("b", lambda: steps.append("b"))()
+    assert steps == ["a", "b"]
+    assert skipped == ["a"]
+
+    # Truncated lines (e.g. from a crash) are ignored.
+    with open(path, "a") as f:
+        f.write('{"key": "v1", "st')
+    assert Journal(path, "v1").read() == set(["a", "b"])
+
+    # Entries for another config don't apply.
+    journal = Journal(path, "v2")
+    assert journal.start(resume=True) == 0
+    assert Journal(path, "v1").read() == set()
+
+    journal.finish()
+    assert not tmpdir.join("support", "restore.journal").exists()
+    journal.finish()
+
+    assert Journal(path, "v1").start() == 0
+    assert Journal(path, "v1").start(resume=False) == 0
+
+
+def setup_module():
+    random.seed()
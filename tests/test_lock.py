@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from cider._inventory import Inventory, defaults_hash, git_head, package_name
+from cider._lock import build_lock, current_steps, tap_drift
+import os
+import plistlib
+import pytest
+
+REVISION = "0123456789abcdef0123456789abcdef01234567"
+
+
+def _write(path, contents):
+    path.ensure()
+    path.write(contents)
+
+
+@pytest.fixture
+def inventory(tmpdir):
+    prefix = tmpdir.join("prefix")
+    for path in ("Cellar/git/2.9.0", "Cellar/git/2.10.0",
+                 "Cellar/python/3.6.0", "Cellar/python/3.7.0",
+                 "Caskroom/app/1.0", "Caskroom/app/.metadata"):
+        prefix.join(path).ensure(dir=True)
+    prefix.join("opt").ensure(dir=True)
+    os.symlink(str(prefix.join("Cellar", "python", "3.6.0")),
+               str(prefix.join("opt", "python")))
+
+    taps = tmpdir.join("repo", "Library", "Taps")
+    _write(taps.join("User", "homebrew-Loose", ".git", "HEAD"),
+           "ref: refs/heads/master\n")
+    _write(taps.join("User", "homebrew-Loose", ".git", "refs", "heads",
+                     "master"), REVISION + "\n")
+    _write(taps.join("user", "homebrew-packed", ".git", "HEAD"),
+           "ref: refs/heads/master\n")
+    _write(taps.join("user", "homebrew-packed", ".git", "packed-refs"),
+           "# pack-refs with: peeled\n{0} refs/heads/master\n".format(
+               REVISION[::-1]
+           ))
+
+    home = tmpdir.join("home")
+    preferences = home.join("Library", "Preferences")
+    preferences.ensure(dir=True)
+    with open(str(preferences.join(".GlobalPreferences.plist")), "wb") as f:
+        dump = getattr(plistlib, "dump", None) or plistlib.writePlist
+        dump({"AppleShowAllExtensions": True, "Other": 1}, f)
+
+    return Inventory(str(prefix), str(tmpdir.join("repo")), str(home))
+
+
+def test_inventory(inventory):
+    # Linked version wins, otherwise the newest.
+    assert inventory.formulas == {"git": "2.10.0", "python": "3.6.0"}
+    assert inventory.casks == {"app": "1.0"}
+    assert inventory.taps == {
+        "user/loose": REVISION, "user/packed": REVISION[::-1]
+    }
+    assert inventory.version("formulas", "user/tap/git --HEAD") == "2.10.0"
+    assert inventory.read_domain("com.example.missing") is None
+    assert inventory.domain_hash(
+        "NSGlobalDomain", ["AppleShowAllExtensions"]
+    ) == defaults_hash({"AppleShowAllExtensions": True})
+
+
+def test_git_head_detached(tmpdir):
+    _write(tmpdir.join(".git", "HEAD"), REVISION + "\n")
+    assert git_head(str(tmpdir)) == REVISION
+    assert git_head(str(tmpdir.join("missing"))) is None
+
+
+def test_package_name():
+    assert package_name("foo") == "foo"
+    assert package_name("user/repo/foo --with-bar") == "foo"
+
+
+def test_defaults_hash_types():
+    assert defaults_hash({"a": 1}) != defaults_hash({"a": True})
+    assert defaults_hash({"a": 1, "b": "x"}) == \
+        defaults_hash({"b": "x", "a": 1})
+
+
+def test_build_lock(inventory):
+    bootstrap = {
+        "formulas": ["git", "missing"],
+        "casks": ["app"],
+        "taps": ["User/Loose", "user/untapped"],
+    }
+    defaults = {
+        "NSGlobalDomain": {"AppleShowAllExtensions": True},
+        "com.example": {"Key": "value"},
+    }
+    lock, unlocked = build_lock(bootstrap, defaults, inventory)
+
+    assert lock["formulas"] == {"git": "2.10.0"}
+    assert lock["casks"] == {"app": "1.0"}
+    assert lock["taps"] == {"user/loose": REVISION}
+    assert lock["defaults"] == {
+        "NSGlobalDomain": defaults_hash({"AppleShowAllExtensions": True})
+    }
+    assert sorted(unlocked) == [
+        "defaults/com.example", "formulas/missing", "taps/user/untapped"
+    ]
+
+
+def test_current_steps(inventory):
+    bootstrap = {"formulas": ["git", "python", "new"], "casks": ["app"]}
+    defaults = {"NSGlobalDomain": {"AppleShowAllExtensions": True}}
+    lock = {
+        "formulas": {"git": "2.10.0", "python": "3.7.0"},
+        "casks": {"app": "1.0"},
+        "defaults": {"NSGlobalDomain": defaults_hash(
+            defaults["NSGlobalDomain"]
+        )},
+    }
+    assert current_steps(lock, bootstrap, defaults, inventory) == set([
+        "formulas/git", "casks/app", "defaults/NSGlobalDomain"
+    ])
+
+    # Options edited since the lock was written need to be applied.
+    defaults["NSGlobalDomain"]["AppleShowAllExtensions"] = False
+    assert "defaults/NSGlobalDomain" not in current_steps(
+        lock, bootstrap, defaults, inventory
+    )
+
+
+def test_tap_drift(inventory):
+    lock = {"taps": {"user/loose": REVISION, "user/packed": REVISION,
+                     "user/gone": REVISION}}
+    assert tap_drift(lock, inventory) == [
+        ("user/packed", REVISION, REVISION[::-1])
+    ]
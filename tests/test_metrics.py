@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from cider import _cli as cli
+from cider import _tty as tty
+from cider._history import History
+from cider._metrics import Metrics
+from cider._sh import spawn
+from click.testing import CliRunner
+from subprocess import CalledProcessError
+import pytest
+import sys
+
+try:
+    from mock import MagicMock, patch
+except ImportError:
+    from unittest.mock import MagicMock, patch  # pylint: disable=F0401,E0611
+
+
+@pytest.fixture
+def metrics(tmpdir):
+    listener = Metrics(str(tmpdir.join("metrics")))
+    tty.add_listener(listener)
+    yield listener
+    tty.remove_listener(listener)
+
+
+def _samples(path):
+    with open(path) as f:
+        return [line for line in f.read().splitlines()
+                if not line.startswith("#")]
+
+
+def test_metrics(tmpdir, metrics):
+    tty.event("command_started", command="restore")
+    tty.event("step_finished", step="formulas/a", status="ok", duration=1.5)
+    tty.event("step_finished", step="formulas/b", status="failed",
+              duration=0.5)
+    tty.event("package", name="a", cask=False, status="installed")
+    tty.event("package", name="app", cask=True, status="skipped")
+    tty.event("link", source="a", target="b", status="created")
+    tty.event("link", source="a", target="c", status="conflict")
+    tty.event("default", domain="d", key="k", status="written")
+    spawn([sys.executable, "-c", "pass"])
+    tty.event("command_finished", exit_code=1, duration=3.25)
+
+    samples = _samples(str(tmpdir.join("metrics", "cider_restore.prom")))
+    for sample in (
+        'cider_last_run_duration_seconds{command="restore"} 3.25',
+        'cider_last_run_exit_code{command="restore"} 1',
+        'cider_phase_duration_seconds{command="restore",phase="formulas"} 2',
+        'cider_steps{command="restore",phase="formulas",status="failed"} 1',
+        'cider_packages{command="restore",kind="cask",status="skipped"} 1',
+        'cider_links{command="restore",status="conflict"} 1',
+        'cider_defaults{command="restore",status="written"} 1',
+    ):
+        assert sample in samples
+
+    program = 'program="{0}"'.format(sys.executable.rsplit("/", 1)[-1])
+    assert 'cider_subprocesses{{command="restore",{0}}} 1'.format(
+        program
+    ) in samples
+    assert len(tmpdir.join("metrics").listdir()) == 1
+
+
+def test_escape(metrics):
+    metrics.add("cider_links", 1, status='a "b"\n')
+    assert 'status="a \\"b\\"\\n"' in metrics.render()
+
+
+def test_metrics_dir(tmpdir):
+    with patch("cider._cli.Cider"):
+        result = CliRunner().invoke(cli.cli, [
+            "--metrics-dir", str(tmpdir), "ls"
+        ])
+    listeners = tty._listeners  # pylint: disable=W0212
+    listener, = [l for l in listeners if isinstance(l, Metrics)]
+    try:
+        assert not result.exception
+        tty.event("command_finished", exit_code=0, duration=0.1)
+        assert tmpdir.join("cider_ls.prom").check()
+    finally:
+        tty.remove_listener(listener)
+
+
+def test_failed_command_exit_code(tmpdir):
+    factory = MagicMock()
+    factory.return_value.history = History(str(tmpdir.join("history")))
+    factory.return_value.relink.side_effect = CalledProcessError(
+        1, ["brew", "list"]
+    )
+    metrics_dir = str(tmpdir.join("metrics"))
+    listeners = tty.listeners()
+    try:
+        with pytest.raises(SystemExit) as e:
+            cli._run(["--metrics-dir", metrics_dir, "relink"], factory)
+    finally:
+        for listener in tty.listeners():
+            if listener not in listeners:
+                tty.remove_listener(listener)
+
+    assert e.value.code == 1
+    assert 'cider_last_run_exit_code{command="relink"} 1' in _samples(
+        str(tmpdir.join("metrics", "cider_relink.prom"))
+    )
+    run, = factory.return_value.history.runs("relink")
+    assert run["exit_code"] == 1
+
+
+def test_crashed_command_exit_code(tmpdir):
+    factory = MagicMock()
+    factory.return_value.relink.side_effect = RuntimeError("crashed")
+    metrics_dir = str(tmpdir.join("metrics"))
+    listeners = tty.listeners()
+    try:
+        with pytest.raises(RuntimeError):
+            cli._run(["--metrics-dir", metrics_dir, "relink"], factory)
+    finally:
+        for listener in tty.listeners():
+            if listener not in listeners:
+                tty.remove_listener(listener)
+
+    assert 'cider_last_run_exit_code{command="relink"} 1' in _samples(
+        str(tmpdir.join("metrics", "cider_relink.prom"))
+    )
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from cider._mirror import Mirror
+import os
+
+
+def _write(path, contents=""):
+    path.ensure()
+    path.write(contents)
+
+
+def _cache(tmpdir):
+    cache = tmpdir.join("cache")
+    _write(cache.join("downloads", "abc--git--2.0.bottle.tar.gz"), "git")
+    os.symlink(os.path.join("downloads", "abc--git--2.0.bottle.tar.gz"),
+               str(cache.join("git--2.0.bottle.tar.gz")))
+    _write(cache.join("Cask", "app--1.0.dmg"), "app")
+    _write(cache.join("downloads", "def--big--1.0.incomplete"), "partial")
+    return cache
+
+
+def test_populate_and_seed(tmpdir):
+    cache = _cache(tmpdir)
+    mirror = Mirror(str(tmpdir.join("mirror")), str(cache))
+
+    assert mirror.populate() == 3
+    assert mirror.populate() == 0
+    assert tmpdir.join("mirror", "git--2.0.bottle.tar.gz").read() == "git"
+    assert os.path.islink(str(tmpdir.join("mirror",
+                                          "git--2.0.bottle.tar.gz")))
+    assert not tmpdir.join("mirror", "downloads",
+                           "def--big--1.0.incomplete").check()
+
+    other = Mirror(mirror.path, str(tmpdir.join("other")))
+    assert other.seed() == 3
+    assert tmpdir.join("other", "Cask", "app--1.0.dmg").read() == "app"
+    assert not [name for name in os.listdir(str(tmpdir.join("other")))
+                if name.endswith(".cider-mirror")]
+
+
+def test_seed_keeps_cached(tmpdir):
+    cache = _cache(tmpdir)
+    _write(tmpdir.join("mirror", "Cask", "app--1.0.dmg"), "mirrored")
+    assert Mirror(str(tmpdir.join("mirror")), str(cache)).seed() == 0
+    assert cache.join("Cask", "app--1.0.dmg").read() == "app"
+
+
+def test_seed_dependencies(tmpdir):
+    """
+    Tests that seeding copies downloads no bootstrap names (e.g. the
+    bottles of dependencies), and only once.
+    """
+    mirror = tmpdir.join("mirror")
+    _write(mirror.join("pcre2--10.0.bottle.tar.gz"), "dependency")
+    _write(mirror.join("Cask", "other--2.0.dmg"), "other")
+    cache = tmpdir.join("cache")
+    seeded = Mirror(str(mirror), str(cache))
+
+    assert seeded.seed() == 2
+    assert cache.join("pcre2--10.0.bottle.tar.gz").read() == "dependency"
+    assert cache.join("Cask", "other--2.0.dmg").read() == "other"
+    assert seeded.seed() == 0
+
+
+def test_misses(tmpdir):
+    mirror = Mirror(str(tmpdir.join("mirror")), str(_cache(tmpdir)))
+    assert mirror.misses("formulas", ["git"]) == ["git"]
+
+    mirror.populate()
+    assert mirror.misses("formulas", ["user/tap/git --HEAD", "gitx",
+                                      "big"]) == ["gitx", "big"]
+    assert mirror.misses("casks", ["app", "git"]) == ["git"]
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from cider import _native as native
+from cider._sh import Brew
+from cider.exceptions import DownloadError
+import hashlib
+import os
+import pytest
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # noqa pylint: disable=F0401
+
+try:
+    from mock import patch
+except ImportError:
+    from unittest.mock import patch  # pylint: disable=F0401,E0611
+
+BODY = b"0123456789" * 1000
+
+
+class RangeServer(object):
+    """
+    Local HTTP stand-in that honours Range requests and can be told to
+    fail the next few requests with a server error.
+    """
+    def __init__(self):
+        self.failures = 0
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=C0103
+                server.requests.append(self.headers.get("Range"))
+                if self.path != "/file":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                if server.failures:
+                    server.failures -= 1
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                if self.headers.get("If-None-Match") == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                body = BODY
+                byte_range = self.headers.get("Range")
+                if byte_range:
+                    body = BODY[int(byte_range[len("bytes="):-1]):]
+                    self.send_response(206)
+                else:
+                    self.send_response(200)
+                self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, path):
+        return "http://127.0.0.1:{0}{1}".format(
+            self.httpd.server_address[1], path
+        )
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    range_server = RangeServer()
+    yield range_server
+    range_server.stop()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff():
+    with patch.object(native, "_BACKOFF", 0):
+        yield
+
+
+def test_download_resumes(tmpdir, server):
+    path = str(tmpdir.join("file"))
+    with open(path + ".part", "wb") as f:
+        f.write(BODY[:4000])
+
+    info = native.download(server.url("/file"), path,
+                           sha256=hashlib.sha256(BODY).hexdigest())
+    assert info.get("ETag") == '"v1"'
+    assert server.requests == ["bytes=4000-"]
+    with open(path, "rb") as f:
+        assert f.read() == BODY
+    assert not os.path.exists(path + ".part")
+
+
+def test_download_retries(tmpdir, server):
+    server.failures = 2
+    path = str(tmpdir.join("file"))
+    native.download(server.url("/file"), path)
+    assert len(server.requests) == 3
+
+    server.failures = 3
+    with pytest.raises(DownloadError):
+        native.download(server.url("/file"), path)
+
+    with pytest.raises(DownloadError):
+        native.download(server.url("/missing"), path)
+    assert server.requests[-1] is None and len(server.requests) == 7
+
+
+def test_download_checks(tmpdir, server):
+    path = str(tmpdir.join("file"))
+    with pytest.raises(DownloadError):
+        native.download(server.url("/file"), path, sha256="0" * 64)
+    assert not os.path.exists(path) and not os.path.exists(path + ".part")
+
+    assert native.download(server.url("/file"), path,
+                           headers={"If-None-Match": '"v1"'}) is None
+
+
+def test_which(tmpdir):
+    tmpdir.join("a", "tool").ensure()
+    executable = tmpdir.join("b", "tool").ensure()
+    executable.chmod(0o755)
+    path = os.pathsep.join([str(tmpdir.join("a")), str(tmpdir.join("b"))])
+    assert native.which("tool", path) == str(executable)
+    assert native.which("missing", path) is None
+
+
+def test_brew_paths(tmpdir):
+    repository = tmpdir.join("Homebrew")
+    repository.join("Library", "Homebrew").ensure(dir=True)
+    repository.join("bin", "brew").ensure().chmod(0o755)
+    tmpdir.join("bin").ensure(dir=True)
+    os.symlink(str(repository.join("bin", "brew")),
+               str(tmpdir.join("bin", "brew")))
+
+    assert native.brew_paths(str(tmpdir.join("bin", "brew"))) == (
+        str(tmpdir), str(repository)
+    )
+    assert native.brew_paths(str(tmpdir.join("a", "brew"))) is None
+
+    brew = Brew(env={"PATH": str(tmpdir.join("bin"))})
+    with patch("cider._sh.spawn") as spawn:
+        assert brew.prefix() == str(tmpdir)
+        assert brew.repository() == str(repository)
+        assert not spawn.called
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=no-self-use
+from __future__ import absolute_import, print_function, unicode_literals
+from cider._pool import WorkerPool, wait_all
+import pytest
+import random
+import threading
+import time
+
+
+@pytest.mark.randomize(workers=int, ntasks=int, min_num=1, max_num=8)
+def test_bounded_concurrency(workers, ntasks):
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def work(x):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.01)
+        with lock:
+            state["running"] -= 1
+        return x * 2
+
+    with WorkerPool(workers) as pool:
+        assert pool.map(work, range(ntasks)) == [x * 2 for x in range(ntasks)]
+
+    assert state["peak"] <= workers
+
+
+def test_task_error():
+    def fail():
+        raise ValueError("boom")
+
+    with WorkerPool(2) as pool:
+        ok = pool.submit(lambda: 42)
+        failed = pool.submit(fail)
+
+        assert ok.result() == 42
+        with pytest.raises(ValueError):
+            failed.result()
+        with pytest.raises(ValueError):
+            wait_all([ok, failed])
+        assert ok.done() and failed.done()
+
+
+def test_tasks_wait_independently():
+    gate = threading.Event()
+    with WorkerPool(2) as pool:
+        slow = pool.submit(gate.wait)
+        fast = pool.submit(lambda: "done")
+
+        # The fast task finishes without waiting on the slow one.
+        assert fast.result() == "done"
+        assert not slow.done()
+        gate.set()
+        assert slow.result()
+
+
+def setup_module():
+    random.seed()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from cider import _requirements as requirements
+from cider import Cider
+from cider.exceptions import BrewMissingError
+from subprocess import CalledProcessError
+import os
+import pytest
+
+try:
+    from mock import MagicMock, patch
+except ImportError:
+    from unittest.mock import MagicMock, patch  # pylint: disable=F0401,E0611
+
+
+@pytest.fixture
+def system(tmpdir):
+    developer_dir = tmpdir.join("CommandLineTools")
+    developer_dir.join("usr", "bin", "git").ensure()
+    brew = tmpdir.join("bin", "brew").ensure()
+    brew.chmod(0o755)
+    tmpdir.join("SystemVersion.plist").write("10.14.6")
+
+    def spawn(args, **kwargs):  # pylint: disable=W0613
+        assert args[0] == "/usr/bin/xcode-select"
+        return str(developer_dir) + "\n"
+
+    with patch.multiple(
+        requirements,
+        SYSTEM_VERSION_PLIST=str(tmpdir.join("SystemVersion.plist")),
+        XCODE_SELECT_LINK=str(tmpdir.join("xcode_select_link")),
+        spawn=MagicMock(side_effect=spawn)
+    ):
+        with patch("platform.mac_ver", return_value=("10.14.6", "", "")):
+            yield tmpdir
+
+
+def test_probe(system):
+    env = {"PATH": str(system.join("bin"))}
+    probed = requirements.probe(env)
+    assert probed["os_version"] == "10.14.6"
+    assert probed["developer_dir"] == str(system.join("CommandLineTools"))
+    assert probed["brew"] == str(system.join("bin", "brew"))
+    assert requirements.is_current(probed, env)
+
+    assert not requirements.is_current(probed, {"PATH": "/usr/bin"})
+    assert not requirements.is_current({}, env)
+
+    system.join("SystemVersion.plist").write("10.15")
+    assert not requirements.is_current(probed, env)
+
+
+def test_probe_missing(system):
+    requirements.spawn.side_effect = CalledProcessError(1, "xcode-select")
+    probed = requirements.probe({"PATH": str(system)})
+    assert probed["brew"] is None
+    assert probed["developer_dir"] is None
+    assert not requirements.is_current(probed, {"PATH": str(system)})
+
+
+def test_assert_requirements(system):
+    cider = Cider(cider_dir=str(system.join("cider")),
+                  support_dir=str(system.join("support")))
+    cider._env = {"PATH": str(system.join("bin"))}  # pylint: disable=W0212
+    cider._assert_requirements()  # pylint: disable=W0212
+    assert os.path.isfile(cider.requirements_file)
+
+    requirements.spawn.reset_mock()
+    cider._assert_requirements()  # pylint: disable=W0212
+    assert not requirements.spawn.called
+
+    system.join("bin", "brew").remove()
+    with pytest.raises(BrewMissingError):
+        cider._assert_requirements()  # pylint: disable=W0212
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=no-self-use
+from __future__ import absolute_import, print_function, unicode_literals
+from cider._sched import Scheduler
+from cider.exceptions import DependencyError
+import pytest
+import threading
+import time
+
+
+def _recorder():
+    lock = threading.Lock()
+    events = []
+
+    def step(name, result=None, delay=0):
+        def _step():
+            with lock:
+                events.append(("start", name))
+            time.sleep(delay)
+            with lock:
+                events.append(("end", name))
+            return result
+        return _step
+
+    return events, step
+
+
+def test_order():
+    scheduler = Scheduler()
+    scheduler.add("c", None, ["b"])
+    scheduler.add("b", None, ["a"])
+    scheduler.add("a", None)
+    scheduler.add("d", None)
+    assert scheduler.order() == ["a", "d", "b", "c"]
+
+    scheduler.add("e", None, ["f"])
+    with pytest.raises(DependencyError):
+        scheduler.order()
+
+    scheduler.add("f", None, ["e"])
+    with pytest.raises(DependencyError):
+        scheduler.order()
+
+    with pytest.raises(DependencyError):
+        scheduler.add("a", None)
+
+
+def test_run_dependencies():
+    events, step = _recorder()
+    scheduler = Scheduler(4)
+    scheduler.add("slow", step("slow", 1, delay=0.1))
+    scheduler.add("fast", step("fast", 2))
+    scheduler.add("after-fast", step("after-fast", 3), ["fast"])
+    scheduler.add("last", step("last", 4), ["slow", "after-fast"])
+
+    assert scheduler.run() == {
+        "slow": 1, "fast": 2, "after-fast": 3, "last": 4
+    }
+
+    # Independent branches don't wait on each other.
+    assert events.index(("end", "after-fast")) < events.index(
+        ("end", "slow")
+    )
+    assert events[-2:] == [("start", "last"), ("end", "last")]
+
+
+def test_run_resource():
+    events, step = _recorder()
+    scheduler = Scheduler(4)
+    for name in ["a", "b", "c"]:
+        scheduler.add(name, step(name, delay=0.02), resource="brew")
+    scheduler.add("free", step("free", delay=0.02))
+    scheduler.run()
+
+    brew_events = [e for e in events if e[1] != "free"]
+    assert brew_events == [
+        ("start", "a"), ("end", "a"),
+        ("start", "b"), ("end", "b"),
+        ("start", "c"), ("end", "c"),
+    ]
+    assert events.index(("start", "free")) < events.index(("end", "a"))
+
+
+def test_run_error():
+    events, step = _recorder()
+
+    def fail():
+        raise ValueError("boom")
+
+    scheduler = Scheduler(2)
+    scheduler.add("fail", fail)
+    scheduler.add("running", step("running", delay=0.05))
+    scheduler.add("never", step("never"), ["fail"])
+
+    with pytest.raises(ValueError):
+        scheduler.run()
+    assert ("end", "running") in events
+    assert ("start", "never") not in events
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=no-self-use
+from __future__ import absolute_import, print_function, unicode_literals
+from cider._scripts import ScriptRunner, parse_scripts, script_dependencies
+from cider.exceptions import DependencyError
+from subprocess import CalledProcessError
+import os
+import pytest
+import threading
+import time
+
+
+def _runner(tmpdir, **kwargs):
+    return ScriptRunner(str(tmpdir), str(tmpdir.join(".cache")), **kwargs)
+
+
+def test_parse_scripts():
+    bootstrap = {
+        "before-scripts": ["echo a", "echo a"],
+        "after-scripts": [
+            {"run": "echo b", "name": "b", "depends": "echo a",
+             "inputs": "*.txt"},
+        ]
+    }
+
+    scripts, known = parse_scripts(bootstrap, before=True)
+    assert [s.name for s in scripts] == ["echo a", "echo a #2"]
+    assert known == set(["echo a", "echo a #2", "b"])
+
+    scripts, _ = parse_scripts(bootstrap, after=True)
+    assert scripts[0].depends == ["echo a"]
+    assert scripts[0].inputs == ["*.txt"]
+    assert scripts[0].phase == "after"
+
+    with pytest.raises(DependencyError):
+        parse_scripts({"after-scripts": [{"name": "missing run"}]}, True, True)
+    with pytest.raises(DependencyError):
+        parse_scripts({"after-scripts": [
+            {"run": "true", "name": "x"}, {"run": "false", "name": "x"}
+        ]}, after=True)
+
+
+def test_script_dependencies():
+    scripts, known = parse_scripts({"after-scripts": [
+        "a",
+        {"run": "b", "group": "assets"},
+        {"run": "c", "group": "assets"},
+        "d",
+        {"run": "e", "depends": ["a"]},
+        {"run": "f", "depends": ["not run"]},
+    ], "before-scripts": [{"run": "x", "name": "not run"}]}, after=True)
+
+    assert script_dependencies(scripts, known) == {
+        "a": [],
+        "b": ["a"],
+        "c": ["a"],
+        "d": ["b", "c"],
+        "e": ["a"],
+        "f": [],
+    }
+
+    scripts, known = parse_scripts({"after-scripts": [
+        {"run": "a", "depends": "b"}
+    ]}, after=True)
+    with pytest.raises(DependencyError):
+        script_dependencies(scripts, known)
+
+
+def test_run_order_and_logs(tmpdir):
+    scripts, known = parse_scripts({
+        "before-scripts": ["echo one >> order"],
+        "after-scripts": ["echo two >> order", "echo three; echo to-log"]
+    }, before=True, after=True)
+    runner = _runner(tmpdir)
+    runner.run(scripts, known)
+
+    assert tmpdir.join("order").read() == "one\ntwo\n"
+    log = runner.log_path(scripts[-1])
+    assert os.path.dirname(log) == str(tmpdir.join(".cache", "logs",
+                                                   "scripts"))
+    with open(log) as f:
+        assert f.read() == "three\nto-log\n"
+
+
+def test_parallel_group(tmpdir):
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+    runner = _runner(tmpdir, workers=4)
+
+    def run_script(script):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.05)
+        with lock:
+            state["running"] -= 1
+
+    runner.run_script = run_script
+    scripts, known = parse_scripts({"after-scripts": [
+        {"run": str(i), "group": "g"} for i in range(3)
+    ] + ["barrier"]}, after=True)
+    runner.run(scripts, known)
+    assert state["peak"] == 3
+
+
+def test_input_hash_skipping(tmpdir):
+    tmpdir.join("input.txt").write("1")
+    scripts, known = parse_scripts({"after-scripts": [
+        {"run": "echo x >> count", "inputs": ["*.txt"]},
+        "echo y >> always",
+    ]}, after=True)
+
+    def run():
+        _runner(tmpdir).run(scripts, known)
+        return (len(tmpdir.join("count").readlines()),
+                len(tmpdir.join("always").readlines()))
+
+    assert run() == (1, 1)
+    assert run() == (1, 2)
+
+    tmpdir.join("input.txt").write("2")
+    assert run() == (2, 3)
+
+    tmpdir.join("another.txt").write("")
+    assert run() == (3, 4)
+    assert run() == (3, 5)
+
+    # Changing the command itself also reruns it.
+    scripts[0].run = "echo x >> count "
+    assert run() == (4, 6)
+
+
+def test_failure_is_not_recorded(tmpdir):
+    scripts, known = parse_scripts({"after-scripts": [
+        {"run": "echo x >> count; test -f ok", "inputs": []},
+        "echo y >> never",
+    ]}, after=True)
+
+    with pytest.raises(CalledProcessError):
+        _runner(tmpdir).run(scripts, known)
+    assert not tmpdir.join("never").exists()
+
+    tmpdir.join("ok").write("")
+    _runner(tmpdir).run(scripts, known)
+    _runner(tmpdir).run(scripts, known)
+    assert len(tmpdir.join("count").readlines()) == 2
@@ -12,6 +12,7 @@ import yaml
 import os
 import pytest
 import random
+import subprocess
 
 try:
     from contextlib import nested as empty
@@ -92,6 +93,52 @@ class TestBrew(object):
             sh.spawn.assert_called_with(args, debug=debug, check_output=False,
                                         env=brew.env)
 
+    def test_installed_taps(self, tmpdir, cask, debug, verbose):
+        with pytest.raises(AssertionError) if cask else empty():
+            brew = Brew(cask, debug, verbose)
+            taps_dir = tmpdir.join("Library", "Taps")
+            for tap in ["Caskroom/homebrew-Versions", "user/homebrew-repo"]:
+                taps_dir.join(tap).ensure(dir=True)
+            taps_dir.join("user", "not-a-tap").ensure(dir=True)
+            taps_dir.join("user", "homebrew-file").ensure(file=True)
+
+            with patch.object(brew, "repository", return_value=str(tmpdir)):
+                assert brew.installed_taps() == [
+                    "caskroom/versions", "user/repo"
+                ]
+
+            with patch.object(brew, "repository",
+                              return_value=str(tmpdir.join("missing"))):
+                assert brew.installed_taps() == []
+
+    def test_update(self, tmpdir, cask, debug, verbose):
+        with pytest.raises(AssertionError) if cask else empty():
+            brew = Brew(cask, debug, verbose)
+            args = self.__cmd() + ["update"] + self.__flags(debug, verbose)
+            fetch_head = tmpdir.join(".git", "FETCH_HEAD").ensure()
+            sh.spawn.reset_mock()
+
+            with patch.object(brew, "repository", return_value=str(tmpdir)):
+                assert not brew.update(60)
+                assert not sh.spawn.called
+
+                fetch_head.setmtime(fetch_head.mtime() - 120)
+                assert brew.update(60)
+                sh.spawn.assert_called_with(args, debug=debug,
+                                            check_output=False,
+                                            env=brew.env)
+
+                fetch_head.remove()
+                assert brew.update()
+
+    def test_cache(self, tmpdir, cask, debug, verbose):
+        with pytest.raises(AssertionError) if cask else empty():
+            brew = Brew(cask, debug, verbose,
+                        {"HOMEBREW_CACHE": str(tmpdir)})
+            sh.spawn.reset_mock()
+            assert brew.cache() == str(tmpdir)
+            assert not sh.spawn.called
+
     @pytest.mark.randomize()
     def test_ls(self, cask, debug, verbose):
         brew = Brew(cask, debug, verbose)
@@ -146,6 +193,25 @@ class TestDefaults(object):
         defaults.write(domain, key, value, force)
         sh.spawn.assert_called_with(args, debug=debug, env=defaults.env)
 
+    @pytest.mark.randomize(domain=str)
+    def test_export(self, debug, domain):
+        defaults = Defaults(debug)
+        old_return, sh.spawn.return_value = sh.spawn.return_value, (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<plist version="1.0"><dict>'
+            '<key>flag</key><true/><key>size</key><integer>42</integer>'
+            '</dict></plist>\n'
+        )
+
+        assert defaults.export(domain) == {"flag": True, "size": 42}
+        sh.spawn.assert_called_with(["defaults", "export", domain, "-"],
+                                    check_output=True, debug=debug,
+                                    stderr=subprocess.PIPE, env=defaults.env)
+
+        sh.spawn.return_value = "garbage"
+        assert defaults.export(domain) == {}
+        sh.spawn.return_value = old_return
+
     @pytest.mark.randomize(domain=str, key=str)
     def test_delete(self, debug, domain, key):
         defaults = Defaults(debug)
@@ -175,15 +241,6 @@ def test_spawn(args, check_call, check_output, debug):
         assert actual_return_value == call.return_value
 
 
-@pytest.mark.randomize(url=str, path=str, min_length=1)
-def test_curl(url, path):
-    with patch("cider._sh.spawn", return_value=0) as spawn:
-        args = ["curl", "-L", url, "-o", path, "--progress-bar"]
-
-        sh.curl(url, path)
-        spawn.assert_called_with(args)
-
-
 @pytest.mark.randomize(path=str, fname=str, min_length=1)
 def test_mkdir_p(tmpdir, path, fname):
     # Shouldn't raise an exception when directory already exists.
@@ -217,6 +274,14 @@ def test_collapse_user(tmpdir, path, home):
     os.rmdir(homedir)
 
 
+def test_collapse_user_home(tmpdir):
+    home = str(tmpdir.join("other"))
+    os.makedirs(home)
+    path = os.path.join(home, ".vimrc")
+    assert sh.collapseuser(path, home) == os.path.join("~", ".vimrc")
+    assert sh.collapseuser(home, home) == "~"
+
+
 @pytest.mark.randomize(path1=str, path2=str, bogusprefix=str, min_length=1)
 def test_commonpath(tmpdir, path1, path2, bogusprefix):
     dir1 = str(tmpdir.join(path1))
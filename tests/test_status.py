@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from ._lib import touch
+from cider._inventory import Inventory
+from cider._status import (
+    defaults_status, link_status, link_state, package_status, tap_status
+)
+import json
+import os
+
+try:
+    from mock import MagicMock
+except ImportError:
+    from unittest.mock import MagicMock  # pylint: disable=F0401,E0611
+
+
+def _inventory(tmpdir):
+    prefix = tmpdir.join("prefix")
+    for path in ("Cellar/git/1.0", "Cellar/dep/1.0", "Cellar/stray/1.0",
+                 "Caskroom/app/1.0", "Caskroom/other/1.0"):
+        prefix.join(path).ensure(dir=True)
+    prefix.join("Cellar", "dep", "1.0", "INSTALL_RECEIPT.json").write(
+        json.dumps({"installed_on_request": False})
+    )
+    for tap in ("homebrew/homebrew-core", "user/homebrew-tap",
+                "user/homebrew-extra"):
+        tmpdir.join("repo", "Library", "Taps", tap).ensure(dir=True)
+    return Inventory(str(prefix), str(tmpdir.join("repo")),
+                     str(tmpdir.join("home")))
+
+
+def test_package_status(tmpdir):
+    inventory = _inventory(tmpdir)
+    bootstrap = {"formulas": ["git --HEAD", "missing"],
+                 "casks": ["app", "gone"]}
+    assert package_status(bootstrap, inventory, "formulas") == {
+        "missing": ["missing"], "extra": ["stray"]
+    }
+    assert package_status(bootstrap, inventory, "casks") == {
+        "missing": ["gone"], "extra": ["other"]
+    }
+
+
+def test_tap_status(tmpdir):
+    inventory = _inventory(tmpdir)
+    assert tap_status({"taps": ["User/Tap", "user/new"]}, inventory) == {
+        "missing": ["user/new"], "extra": ["user/extra"]
+    }
+
+
+def test_link_status(tmpdir):
+    cider_dir = tmpdir.join("cider")
+    sources = dict((name, str(cider_dir.join(name)))
+                   for name in ("ok", "missing", "wrong", "conflict",
+                                "broken", "stale"))
+    for source in sources.values():
+        touch(str(cider_dir.ensure(dir=True).join(
+            os.path.basename(source)
+        )))
+
+    home = tmpdir.ensure("home", dir=True)
+    target = dict((name, str(home.join(name))) for name in sources)
+    os.symlink(sources["ok"], target["ok"])
+    os.symlink(sources["ok"], target["wrong"])
+    touch(target["conflict"])
+    os.symlink(str(tmpdir.join("nowhere")), target["broken"])
+    os.symlink(sources["stale"], target["stale"])
+
+    expected = [(sources[name], target[name]) for name in
+                ("ok", "missing", "wrong", "conflict", "broken")]
+    cached = [target["ok"], target["stale"], str(home.join("unrelated"))]
+    problems = link_status(expected, cached, str(cider_dir))
+
+    assert dict((problem["target"], problem["status"])
+                for problem in problems) == {
+        target["missing"]: "missing",
+        target["wrong"]: "wrong",
+        target["conflict"]: "conflict",
+        target["broken"]: "broken",
+        target["stale"]: "stale",
+    }
+    assert link_state(sources["ok"], target["ok"]) == "ok"
+
+
+def test_link_state_unfolded(tmpdir):
+    source = tmpdir.join("cider", "symlinks", "config")
+    for name in ("a", "b"):
+        source.join(name).ensure()
+    target = tmpdir.join("home", ".config").ensure(dir=True)
+    os.symlink(str(source.join("a")), str(target.join("a")))
+    assert link_state(str(source), str(target)) == "missing"
+    os.symlink(str(source.join("b")), str(target.join("b")))
+    assert link_state(str(source), str(target)) == "ok"
+
+
+def test_defaults_status(tmpdir):
+    inventory = _inventory(tmpdir)
+    inventory.read_domain = MagicMock(side_effect=lambda domain: {
+        "plist": {"Same": True, "Typed": 1},
+        "binary": None,
+    }[domain])
+    export = MagicMock(return_value={"Key": "old"})
+
+    changed = defaults_status({
+        "plist": {"Same": True, "Typed": True, "Unset": "x"},
+        "binary": {"Key": "new"},
+    }, inventory, export)
+
+    export.assert_called_once_with("binary")
+    assert [(c["domain"], c["key"], c["actual"]) for c in changed] == [
+        ("binary", "Key", "old"),
+        ("plist", "Typed", 1),
+        ("plist", "Unset", None),
+    ]
+
+
+def test_defaults_status_missing_plist(tmpdir):
+    # Domains without a preferences file are asked of `defaults` instead.
+    export = MagicMock(return_value={"Key": "new"})
+    assert defaults_status({"com.example.app": {"Key": "new"}},
+                           _inventory(tmpdir), export) == []
+    export.assert_called_once_with("com.example.app")
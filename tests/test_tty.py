@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=no-self-use
+from __future__ import absolute_import, print_function, unicode_literals
+from cider import _tty as tty
+import json
+import pytest
+
+
+@pytest.fixture
+def ndjson():
+    tty.set_output(tty.NDJSON)
+    yield
+    tty.set_output(tty.TEXT)
+
+
+def _events(capsys):
+    out, err = capsys.readouterr()
+    assert not err
+    return [json.loads(line) for line in out.splitlines()]
+
+
+def test_text_mode(capsys):
+    tty.event("package", name="foo")
+    assert tty.putitems(iter(["a", "b"]), "formulas") == 2
+    tty.putinfo("info")
+    out, _ = capsys.readouterr()
+    assert out == "a\nb\ninfo\n"
+
+
+def test_putitems(capsys, ndjson):  # pylint: disable=W0613
+    items = ["foo", "bar --with-baz", "user/repo/formula"]
+    assert tty.putitems(iter(items), "formulas") == len(items)
+    events = _events(capsys)
+    assert [e["value"] for e in events] == items
+    assert all(e["event"] == "item" and e["list"] == "formulas"
+               for e in events)
+
+
+def test_messages(capsys, ndjson):  # pylint: disable=W0613
+    tty.puts("done")
+    tty.puterr("careful", warning=True)
+    tty.puterr("failed")
+    tty.putprogress("working")
+    tty.putdebug("hidden")
+    tty.putdebug(tty.color("shown", tty.MAGENTA), True)
+
+    events = _events(capsys)
+    assert [(e["level"], e["message"]) for e in events] == [
+        ("success", "done"),
+        ("warning", "careful"),
+        ("error", "failed"),
+        ("progress", "working"),
+        ("debug", "shown"),
+    ]
+    assert all(e["event"] == "message" and "time" in e for e in events)
+
+
+def test_event(capsys, ndjson):  # pylint: disable=W0613
+    tty.event("link", source="a", target="b", status="created")
+    event, = _events(capsys)
+    assert event["event"] == "link"
+    assert event["status"] == "created"
+
+
+def test_silent_mode(capsys):
+    events = []
+    tty.set_output(tty.SILENT)
+    tty.add_listener(events.append)
+    try:
+        tty.puts("done")
+        assert tty.putitems(["a"], "formulas") == 1
+        tty.event("link", target="b", status="created")
+    finally:
+        tty.remove_listener(events.append)
+        tty.set_output(tty.TEXT)
+
+    assert capsys.readouterr() == ("", "")
+    assert [e["event"] for e in events] == ["message", "item", "link"]
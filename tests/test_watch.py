@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from ._lib import touch
+from cider import _watch
+import os
+import pytest
+import sys
+
+
+def _watchers():
+    watchers = [lambda roots: _watch.PollingWatcher(roots, interval=0.01)]
+    if sys.platform.startswith("linux"):
+        watchers.append(_watch.InotifyWatcher)
+    return watchers
+
+
+@pytest.fixture(params=_watchers(), ids=lambda x: getattr(x, "__name__",
+                                                          "polling"))
+def make_watcher(request):
+    return request.param
+
+
+def test_watch_recursive(tmpdir, make_watcher):
+    root = str(tmpdir.join("root"))
+    os.makedirs(os.path.join(root, "a"))
+    touch(os.path.join(root, "a", "x"))
+
+    with make_watcher([(root, True)]) as watcher:
+        assert watcher.poll(0.05) == set()
+
+        os.makedirs(os.path.join(root, "b", "c"))
+        touch(os.path.join(root, "b", "c", "y"))
+        os.remove(os.path.join(root, "a", "x"))
+        changed = watcher.wait(0.1)
+
+        assert os.path.join(root, "a", "x") in changed
+        assert os.path.join(root, "b") in changed
+        assert os.path.join(root, "b", "c", "y") in changed
+
+        # Directories created while running are watched too.
+        touch(os.path.join(root, "b", "c", "z"))
+        assert os.path.join(root, "b", "c", "z") in watcher.wait(0.1)
+
+
+def test_watch_shallow(tmpdir, make_watcher):
+    root = str(tmpdir.join("root"))
+    os.makedirs(os.path.join(root, "sub"))
+
+    with make_watcher([(root, False)]) as watcher:
+        touch(os.path.join(root, "sub", "deep"))
+        assert watcher.poll(0.05) - set([os.path.join(root, "sub")]) == set()
+
+        touch(os.path.join(root, "bootstrap.yaml"))
+        assert os.path.join(root, "bootstrap.yaml") in watcher.wait(0.1)
+
+
+def test_watcher_fallback(tmpdir):
+    assert isinstance(_watch.watcher([(str(tmpdir), True)], poll=True),
+                      _watch.PollingWatcher)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+from cider import _sh as sh
+from cider._yamledit import splice
+import pytest
+import yaml
+
+BOOTSTRAP = """\
+# Packages for every machine.
+formulas:
+- git
+# Editors
+- vim
+- zsh
+
+casks:
+  - firefox   # browser
+  - slack
+symlinks:
+    vim/*: ~/
+"""
+
+DEFAULTS = """\
+NSGlobalDomain:
+    AppleShowAllExtensions: true  # everywhere
+    KeyRepeat: 2
+
+# The dock
+com.apple.dock:
+    orientation: left
+"""
+
+
+def _splice(text, unordered=None, **changes):
+    old = yaml.safe_load(text)
+    new = dict(old, **changes)
+    for key, value in list(new.items()):
+        if value is None:
+            del new[key]
+    return splice(text, old, new, unordered)
+
+
+def test_splice_set():
+    assert _splice(BOOTSTRAP, ["formulas", "casks"],
+                   formulas=["ack", "git", "tmux", "zsh"],
+                   casks=["firefox", "slack", "zoom"],
+                   taps=["user/repo"]) == """\
+# Packages for every machine.
+formulas:
+- ack
+- git
+# Editors
+- tmux
+- zsh
+
+casks:
+  - firefox   # browser
+  - slack
+  - zoom
+symlinks:
+    vim/*: ~/
+taps:
+- user/repo
+"""
+
+    # Items already there keep their place.
+    unsorted = BOOTSTRAP.replace("- vim\n- zsh", "- zsh\n- vim")
+    assert _splice(unsorted, ["formulas"],
+                   formulas=["git", "htop", "vim", "zsh"]) == \
+        unsorted.replace("- vim\n", "- vim\n- htop\n")
+
+
+def test_splice_mapping():
+    assert _splice(DEFAULTS, NSGlobalDomain={
+        "AppleShowAllExtensions": True, "AppleLocale": "en_GB",
+        "KeyRepeat": 1,
+    }, **{"com.apple.finder": {"ShowPathbar": True}}) == """\
+NSGlobalDomain:
+    AppleLocale: en_GB
+    AppleShowAllExtensions: true  # everywhere
+    KeyRepeat: 1
+
+# The dock
+com.apple.dock:
+    orientation: left
+com.apple.finder:
+    ShowPathbar: true
+"""
+
+    assert _splice(DEFAULTS, NSGlobalDomain=None) == \
+        DEFAULTS.split("\n", 3)[3]
+
+
+@pytest.mark.parametrize("text,changes", [
+    ("formulas: [git, vim]\n", {"formulas": ["git"]}),
+    (BOOTSTRAP, {"formulas": []}),
+    ("symlinks:\n    a: ~/\n", {"symlinks": {"b": "~/"}}),
+])
+def test_splice_replaces(text, changes):
+    """
+    Tests that values on their key's line, and those emptied or replaced
+    outright, are dumped anew.
+    """
+    spliced = _splice(text, **changes)
+    assert yaml.safe_load(spliced) == dict(yaml.safe_load(text), **changes)
+
+
+def test_splice_fallback():
+    # Other lists (e.g. defaults arrays) are replaced in their new order.
+    assert _splice(BOOTSTRAP, formulas=["git", "zsh", "vim"]) == \
+        BOOTSTRAP.replace("- git\n# Editors\n- vim\n- zsh\n",
+                          "- git\n- zsh\n- vim\n")
+    assert _splice("{}\n", formulas=["git"]) is None
+    assert _splice("a: &x [1]\nb: *x\n", a=None) is None
+
+
+def test_modify_config(tmpdir):
+    path = str(tmpdir.join("bootstrap.yaml"))
+    with open(path, "w") as f:
+        f.write(BOOTSTRAP)
+    assert sh.modify_config(
+        path, lambda config: dict(config, formulas=["git", "vim"]),
+        unordered=["formulas"]
+    )
+    with open(path) as f:
+        assert f.read() == BOOTSTRAP.replace("- zsh\n", "")